@@ -0,0 +1,81 @@
+"""
+JSON 編解碼效能基準
+此乃譯館之量度：以仿 Perplexity 之回應（長串 citations 與 search_results）比較各後端
+
+用法：
+    python benchmarks/bench_codec.py --citations 200
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chatbot.codec import get_json_codec  # noqa: E402
+
+
+def perplexity_response(citations: int) -> dict:
+    """仿 Perplexity 之回應"""
+    snippet = "量子糾纏是量子力學中的現象，兩個粒子之狀態相互關聯，量測其一即決定其二。" * 4
+    return {
+        "id": "b2b5f1c4-6d1e-4c2a-9a51-1d1c8e9c2f10",
+        "model": "sonar",
+        "created": 1760000000,
+        "usage": {"prompt_tokens": 18, "completion_tokens": 612, "total_tokens": 630, "search_context_size": "low"},
+        "citations": [f"https://example.com/research/quantum-entanglement/{i}" for i in range(citations)],
+        "search_results": [
+            {
+                "title": f"量子糾纏研究綜述（第 {i} 篇）",
+                "url": f"https://example.com/research/quantum-entanglement/{i}",
+                "date": "2025-06-01",
+                "last_updated": "2025-07-15",
+                "snippet": snippet,
+            }
+            for i in range(citations)
+        ],
+        "object": "chat.completion",
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": "量子糾纏乃兩粒子之狀態相互關聯。[1][2]" * 40},
+        }],
+    }
+
+
+def bench(label: str, fn, number: int) -> None:
+    """印出每次呼叫之平均耗時"""
+    seconds = min(timeit.repeat(fn, number=number, repeat=5)) / number
+    print(f"{label:<32} {seconds * 1e6:>10.1f} µs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON 編解碼效能基準")
+    parser.add_argument('--citations', type=int, default=200, help="引用數")
+    parser.add_argument('--number', type=int, default=200, help="每輪呼叫次數")
+    args = parser.parse_args()
+
+    response = perplexity_response(args.citations)
+    body = json.dumps(response, ensure_ascii=False).encode('utf-8')
+    payload = {"model": "sonar", "messages": [{"role": "user", "content": "請解釋量子糾纏。" * 20}]}
+    print(f"回應大小 {len(body) / 1024:.0f} KiB，引用 {args.citations} 則")
+
+    bench("baseline json.loads + index", lambda: json.loads(body)["choices"][0]["message"]["content"], args.number)
+    for name in ('json', 'orjson', 'msgspec'):
+        try:
+            backend = get_json_codec(name)
+        except ImportError:
+            print(f"{name:<32} {'未安裝':>10}")
+            continue
+        assert backend.chat_content(body) == response["choices"][0]["message"]["content"]
+        assert backend.chat_usage(body) == response["usage"]
+        bench(f"{name} loads", lambda: backend.loads(body), args.number)
+        bench(f"{name} chat_content", lambda: backend.chat_content(body), args.number)
+        bench(f"{name} chat_usage", lambda: backend.chat_usage(body), args.number)
+        bench(f"{name} dumps (payload)", lambda: backend.dumps(payload), args.number * 10)
+
+
+if __name__ == '__main__':
+    main()
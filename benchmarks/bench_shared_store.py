@@ -0,0 +1,96 @@
+"""
+共享記憶體對話儲存之效能基準
+此乃多行程負載下之量度：各行程各持字典、共享記憶體、經代理行程之字典三者之吞吐量
+
+每次操作模擬 ChatBot 之一輪：讀取歷史，再寫入提問與回應。
+「行程內字典」各行程互不相見，僅為上限之參照；後二者方能令任一工作者服務任一使用者。
+
+用法：
+    python benchmarks/bench_shared_store.py --processes 4 --ops 50000
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chatbot.models import ConversationManager, SharedConversationManager  # noqa: E402
+
+REPLY = "量子糾纏乃兩粒子之狀態相互關聯，量測其一即定其二。" * 4
+
+
+class _BrokerStore:
+    """以 multiprocessing.Manager 之字典代理實作之對照組"""
+
+    def __init__(self, proxy, max_messages: int = 4):
+        self.proxy = proxy
+        self.max_messages = max_messages
+
+    def get_history(self, user_id):
+        return self.proxy.get(user_id, [])
+
+    def add_message(self, user_id, content):
+        history = self.proxy.get(user_id, [])
+        history.append(content)
+        self.proxy[user_id] = history[-self.max_messages:]
+
+
+def _worker(store, users: int, ops: int, seed: int, barrier, results) -> None:
+    """執行 ops 輪並回報耗時"""
+    store = store if store is not None else ConversationManager()
+    rng = random.Random(seed)
+    keys = [f"user{rng.randrange(users)}" for _ in range(ops)]
+    barrier.wait()
+    start = time.perf_counter()
+    for key in keys:
+        store.get_history(key)
+        store.add_message(key, "請解釋量子糾纏。")
+        store.add_message(key, REPLY)
+    results.put(time.perf_counter() - start)
+
+
+def run(label: str, store, processes: int, users: int, ops: int) -> None:
+    """啟動 processes 個行程並印出總吞吐量"""
+    barrier = multiprocessing.Barrier(processes)
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=_worker, args=(store, users, ops, seed, barrier, results))
+        for seed in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    elapsed = max(results.get() for _ in workers)
+    for worker in workers:
+        worker.join()
+    print(f"{label:<20} {processes * ops / elapsed:>12,.0f} 輪/s  ({elapsed:.2f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="共享記憶體對話儲存之效能基準")
+    parser.add_argument('--processes', type=int, default=4, help="工作行程數")
+    parser.add_argument('--users', type=int, default=10_000, help="使用者數")
+    parser.add_argument('--ops', type=int, default=50_000, help="每行程之輪數")
+    parser.add_argument('--broker-ops', type=int, default=5_000, help="代理行程組每行程之輪數（較慢）")
+    args = parser.parse_args()
+
+    print(f"行程數 {args.processes}，使用者 {args.users}")
+    run("行程內字典（不共享）", None, args.processes, args.users, args.ops)
+
+    shared = SharedConversationManager(slots=max(1024, args.users * 2 // 1024 * 1024), stripes=256)
+    try:
+        run("共享記憶體", shared, args.processes, args.users, args.ops)
+        print(f"{'驅逐':<20} {shared.evictions:>12,}")
+    finally:
+        shared.close()
+        shared.unlink()
+
+    with multiprocessing.Manager() as broker:
+        run("Manager 代理字典", _BrokerStore(broker.dict()), args.processes, args.users, args.broker_ops)
+
+
+if __name__ == '__main__':
+    main()
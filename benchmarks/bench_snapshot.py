@@ -0,0 +1,64 @@
+"""
+快照效能基準
+此乃封存與復原之量度：寫入、延遲復原、首次取用與全量復原之耗時
+
+用法：
+    python benchmarks/bench_snapshot.py --users 1000000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chatbot.models import ConversationManager  # noqa: E402
+
+
+def timed(label, fn):
+    """執行並印出耗時"""
+    start = time.perf_counter()
+    result = fn()
+    print(f"{label:<24} {time.perf_counter() - start:>8.3f}s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="快照效能基準")
+    parser.add_argument('--users', type=int, default=1_000_000, help="使用者數")
+    parser.add_argument('--lookups', type=int, default=10_000, help="延遲復原後之隨機取用次數")
+    args = parser.parse_args()
+
+    manager = ConversationManager()
+    for i in range(args.users):
+        manager.conversations[f"user{i}"] = [
+            f"第 {i} 位使用者之提問：請解釋量子糾纏。",
+            "量子糾纏乃兩粒子之狀態相互關聯，量測其一即定其二。" * 2,
+            "再舉一例？",
+            f"例如偏振相關之光子對 #{i}。",
+        ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "state.snap")
+        timed("snapshot", lambda: manager.snapshot(path))
+        print(f"{'file size':<24} {os.path.getsize(path) / 1e6:>8.1f}MB")
+
+        lazy = ConversationManager()
+        timed("restore (lazy, verify)", lambda: lazy.restore(path))
+        lazy_fast = ConversationManager()
+        timed("restore (lazy, no crc)", lambda: lazy_fast.restore(path, verify=False))
+
+        keys = [f"user{random.randrange(args.users)}" for _ in range(args.lookups)]
+        elapsed = timed(f"{args.lookups} lazy lookups", lambda: [lazy.get_history(k) for k in keys])
+        assert all(elapsed)
+
+        eager = ConversationManager()
+        timed("restore (eager)", lambda: eager.restore(path, lazy=False))
+        assert len(eager.conversations) == args.users
+
+
+if __name__ == '__main__':
+    main()
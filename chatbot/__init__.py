@@ -1,12 +1,21 @@
 """
 聊天機器人主模組
 此乃系統之樞紐
+
+各子模組於首次取用時方載入（PEP 562），故 `import chatbot` 不牽動重型依賴。
 """
 
-from .config import load_environment_variables
-from .handlers import ChatBot, TriggerFilter
-from .models import ConversationManager, Message
-from .services import APIHandler
+import importlib
+
+# 公開名稱 -> 所在子模組
+_EXPORTS = {
+    'load_environment_variables': '.config',
+    'ChatBot': '.handlers',
+    'TriggerFilter': '.handlers',
+    'ConversationManager': '.models',
+    'Message': '.models',
+    'APIHandler': '.services',
+}
 
 __all__ = [
     'load_environment_variables',
@@ -16,3 +25,17 @@ __all__ = [
     'Message',
     'APIHandler',
 ]
+
+
+def __getattr__(name: str):
+    """延遲載入公開名稱"""
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value  # 快取，下次不再經此
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,278 @@
+"""
+JSON 編解碼層
+此乃文書之譯館，提供者之酬答與落地之記錄皆經此處；有 orjson 或 msgspec 則用之，否則退回標準庫
+
+chat_content() 與 chat_usage() 僅取聊天完成回應之 choices[0].message.content 與 usage，
+不解其餘欄位（如 Perplexity 之長串 citations 與 search_results）：自該鍵處僅解其值；
+形態不符時退回後端之全量解析（msgspec 以型別化解碼器略過未宣告之欄位）。
+"""
+
+import json
+import re
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple, Union
+
+Data = Union[bytes, bytearray, memoryview, str]
+
+_KEY_SEPARATOR = re.compile(r'\s*:\s*')
+_DECODER = json.JSONDecoder()
+_WINDOW = 4096  # 局部解碼先試之位元組數
+_TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*"|[{}\[\]]', re.DOTALL)  # 字串或括號
+
+
+class JsonCodec(NamedTuple):
+    """一組 JSON 編解碼函式"""
+    name: str  # 後端名稱："orjson"、"msgspec" 或 "json"
+    dumps: Callable[..., bytes]  # (物件, pretty=False) -> UTF-8 位元組
+    loads: Callable[[Data], Any]  # 位元組或字串 -> 物件
+    chat_content: Callable[[Data], str]  # 聊天完成回應 -> choices[0].message.content
+    chat_usage: Callable[[Data], Optional[dict]]  # 聊天完成回應 -> usage（無則 None）
+
+
+def _content_of(completion: Any) -> str:
+    """自已解析之回應取出內容"""
+    try:
+        content = completion["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        raise ValueError("回應缺少 choices[0].message.content") from None
+    if not isinstance(content, str):
+        raise ValueError("回應之 choices[0].message.content 非字串")
+    return content
+
+
+_MISSING = object()  # 局部解碼未果
+_NOT_KEY = object()  # 所見之字樣非鍵
+
+
+def _value_after_key(raw: bytes, start: int) -> Tuple[Any, int]:
+    """
+    解碼 raw[start:] 開頭之 ": 值"
+
+    先試其後 _WINDOW 位元組（退至 UTF-8 字元邊界），值未及窗末即結束者方採信，否則解至結尾，
+    故截短之純量不致誤取。
+
+    返回：
+        (值, 值結束之位元組位置)；非鍵則值為 _NOT_KEY，無法解碼則為 _MISSING
+    """
+    limit = len(raw)
+    if limit - start > _WINDOW:
+        limit = start + _WINDOW
+        while (raw[limit] & 0xC0) == 0x80:
+            limit -= 1
+    try:
+        tail = raw[start:limit].decode('utf-8')
+    except UnicodeDecodeError:
+        return _MISSING, start
+    colon = _KEY_SEPARATOR.match(tail)
+    if colon is None:
+        return _NOT_KEY, start
+    try:
+        value, end = _DECODER.raw_decode(tail, colon.end())
+    except ValueError:
+        end = len(tail)
+    if end >= len(tail):
+        if limit == len(raw):
+            return _MISSING, start
+        # 值觸及窗末，或被截斷，解至結尾
+        try:
+            tail = raw[start:].decode('utf-8')
+            value, end = _DECODER.raw_decode(tail, colon.end())
+        except ValueError:
+            return _MISSING, start
+    return value, start + len(tail[:end].encode('utf-8'))
+
+
+def _bracket_depth(raw: bytes, start: int, end: int, depth: int) -> Optional[int]:
+    """
+    掃描 raw[start:end] 之括號（略過字串），返回其後之深度；中途歸零則為 None
+    """
+    for token in _TOKEN.finditer(raw, start, end):
+        bracket = token.group()
+        if bracket in (b'{', b'['):
+            depth += 1
+        elif bracket in (b'}', b']'):
+            depth -= 1
+            if depth == 0 and token.end() < end:
+                return None
+    return depth
+
+
+def _at_top_level(raw: bytes, key_start: int, value_end: int) -> bool:
+    """
+    鍵是否位於頂層物件（深度 1）
+
+    掃描鍵前或值後兩段之較短者：鍵前之括號須恰留一層未閉；值後之括號須恰於全文末尾閉合頂層。
+    """
+    end = len(raw)
+    while end and raw[end - 1] in b' \t\r\n':
+        end -= 1
+    if key_start <= end - value_end:
+        return _bracket_depth(raw, 0, key_start, 0) == 1
+    return _bracket_depth(raw, value_end, end, 1) == 0
+
+
+def _partial_value(data: Data, key: bytes) -> Any:
+    """
+    僅解碼頂層某鍵之值
+
+    字串值內之引號皆經轉義，故其後緊接冒號、且開頭引號未經轉義之 "鍵" 必為鍵；
+    自後往前逐處檢視，以括號深度驗其位於頂層，巢狀之同名鍵無論在前在後皆略過。
+    僅將該處以後解碼為字串，並以 raw_decode 解至該值結束，省去其餘欄位（如長串引用）之 UTF-8 解碼與解析。
+
+    返回：
+        該鍵之值；找不到或無法解碼則為 _MISSING，由呼叫者全量解析
+    """
+    raw = data.encode('utf-8') if isinstance(data, str) else bytes(data)
+    quoted = b'"' + key + b'"'
+    end = len(raw)
+    while True:
+        index = raw.rfind(quoted, 0, end)
+        if index < 0:
+            return _MISSING
+        end = index
+        escape = index
+        while escape and raw[escape - 1] == 0x5C:
+            escape -= 1
+        if (index - escape) % 2:
+            continue  # 字串內經轉義之引號
+        value, value_end = _value_after_key(raw, index + len(quoted))
+        if value is _NOT_KEY:
+            continue
+        if value is _MISSING:
+            return _MISSING
+        if _at_top_level(raw, index, value_end):
+            return value
+
+
+def _partial_chat_content(data: Data) -> Optional[str]:
+    """僅解碼 choices 陣列以取內容；形態不符則為 None"""
+    choices = _partial_value(data, b'choices')
+    if choices is _MISSING:
+        return None
+    try:
+        return _content_of({"choices": choices})
+    except ValueError:
+        return None
+
+
+def _usage_of(usage: Any) -> Optional[dict]:
+    """驗證 usage 之形態：須為含整數 prompt_tokens/completion_tokens 之物件"""
+    if not isinstance(usage, dict):
+        return None
+    if not all(isinstance(usage.get(k, 0), int) for k in ('prompt_tokens', 'completion_tokens')):
+        return None
+    return usage
+
+
+def _make_chat_usage(full_loads: Callable[[Data], Any]) -> Callable[[Data], Optional[dict]]:
+    def chat_usage(data: Data) -> Optional[dict]:
+        usage = _usage_of(_partial_value(data, b'usage'))
+        if usage is not None:
+            return usage
+        completion = full_loads(data)
+        return _usage_of(completion.get('usage')) if isinstance(completion, dict) else None
+
+    return chat_usage
+
+
+def _stdlib_codec() -> JsonCodec:
+    def dumps(obj: Any, pretty: bool = False) -> bytes:
+        if pretty:
+            return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def loads(data: Data) -> Any:
+        if isinstance(data, (bytearray, memoryview)):
+            data = bytes(data)
+        return json.loads(data)
+
+    def chat_content(data: Data) -> str:
+        content = _partial_chat_content(data)
+        return content if content is not None else _content_of(loads(data))
+
+    return JsonCodec('json', dumps, loads, chat_content, _make_chat_usage(loads))
+
+
+def _orjson_codec() -> JsonCodec:
+    import orjson
+
+    def dumps(obj: Any, pretty: bool = False) -> bytes:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(obj, option=option)
+
+    def chat_content(data: Data) -> str:
+        content = _partial_chat_content(data)
+        return content if content is not None else _content_of(orjson.loads(data))
+
+    return JsonCodec('orjson', dumps, orjson.loads, chat_content, _make_chat_usage(orjson.loads))
+
+
+def _msgspec_codec() -> JsonCodec:
+    import msgspec
+
+    class _Message(msgspec.Struct):
+        content: str
+
+    class _Choice(msgspec.Struct):
+        message: _Message
+
+    class _Completion(msgspec.Struct):
+        choices: List[_Choice]
+
+    encoder = msgspec.json.Encoder()
+    decoder = msgspec.json.Decoder()
+    completion_decoder = msgspec.json.Decoder(_Completion)
+
+    def dumps(obj: Any, pretty: bool = False) -> bytes:
+        data = encoder.encode(obj)
+        return msgspec.json.format(data, indent=2) if pretty else data
+
+    def chat_content(data: Data) -> str:
+        content = _partial_chat_content(data)
+        if content is not None:
+            return content
+        try:
+            completion = completion_decoder.decode(data)
+        except msgspec.ValidationError as e:
+            raise ValueError(f"回應缺少 choices[0].message.content: {e}") from None
+        if not completion.choices:
+            raise ValueError("回應缺少 choices[0].message.content")
+        return completion.choices[0].message.content
+
+    return JsonCodec('msgspec', dumps, decoder.decode, chat_content, _make_chat_usage(decoder.decode))
+
+
+_FACTORIES = {'orjson': _orjson_codec, 'msgspec': _msgspec_codec, 'json': _stdlib_codec}
+
+
+def get_json_codec(name: Optional[str] = None) -> JsonCodec:
+    """
+    取得 JSON 編解碼函式
+
+    參數：
+        name: "orjson"、"msgspec"、"json"；None 則依序取第一個已安裝者
+
+    返回：
+        JsonCodec
+
+    異常：
+        ValueError: 未知之後端
+        ImportError: 指定之後端未安裝
+    """
+    if name is None:
+        for candidate in ('orjson', 'msgspec'):
+            try:
+                return _FACTORIES[candidate]()
+            except ImportError:
+                continue
+        return _stdlib_codec()
+    if name not in _FACTORIES:
+        raise ValueError(f"未知之 JSON 後端: {name}")
+    return _FACTORIES[name]()
+
+
+_default = get_json_codec()
+BACKEND: str = _default.name  # 使用中之後端
+dumps = _default.dumps
+loads = _default.loads
+chat_content = _default.chat_content
+chat_usage = _default.chat_usage
@@ -6,21 +6,62 @@
 import logging
 import os
 import sys
+from typing import List, Tuple
 
 from dotenv import load_dotenv
 
 logger = logging.getLogger(__name__)
 
 
+def parse_api_keys(value: str) -> List[Tuple[str, float]]:
+    """
+    解析祕鑰列表
+
+    多把祕鑰以逗號分隔，各鑰可以 "祕鑰;weight=權重" 指定權重（預設 1），如 "key-a,key-b;weight=2"。
+    祕鑰中之冒號等字元皆原樣保留。
+
+    參數：
+        value: 環境變數之值
+
+    返回：
+        (祕鑰, 權重) 之列表
+
+    異常：
+        ValueError: 未知之參數，或權重非正數
+    """
+    keys = []
+    for item in value.split(','):
+        secret, *params = (part.strip() for part in item.split(';'))
+        if not secret:
+            continue
+        weight = 1.0
+        for param in params:
+            name, sep, setting = param.partition('=')
+            if name.strip() != 'weight' or not sep:
+                raise ValueError(f"未知之祕鑰參數: {param}")
+            try:
+                weight = float(setting)
+            except ValueError:
+                raise ValueError(f"祕鑰之權重須為數字: {setting}") from None
+            if weight <= 0:
+                raise ValueError(f"祕鑰之權重須為正數: {setting}")
+        keys.append((secret, weight))
+    return keys
+
+
 def load_environment_variables() -> dict:
     """
     載入並驗證環境變數
+
+    各提供者之祕鑰可為一把或多把（見 parse_api_keys），
+    亦可置於複數名之變數（GEMINI_API_KEYS、PERPLEXITY_API_KEYS），後者優先。
     
     返回：
-        包含所有必需環境變數的字典
+        包含所有必需環境變數的字典：GEMINI_API_KEY、PERPLEXITY_API_KEY 為原字串
+        （僅設複數名之變數者為其首把祕鑰）；GEMINI_API_KEYS、PERPLEXITY_API_KEYS 為 (祕鑰, 權重) 之列表
     
     異常：
-        SystemExit: 若缺失必需環境變數
+        SystemExit: 若缺失必需環境變數，或祕鑰之格式有誤
     """
     # 載入 .env 檔案（若尚未載入）
     load_dotenv(override=False)
@@ -37,10 +78,16 @@ def load_environment_variables() -> dict:
 
     for var_name, var_description in required_vars.items():
         value = os.environ.get(var_name)
-        if not value:
+        try:
+            keys = parse_api_keys(os.environ.get(f"{var_name}S") or value or '')
+        except ValueError as e:
+            logger.error("%s 之格式有誤: %s", var_name, e)
+            sys.exit(1)
+        if not keys:
             missing_vars.append(f"{var_name} ({var_description})")
         else:
-            config[var_name] = value
+            config[var_name] = value or keys[0][0]
+            config[f"{var_name}S"] = keys
 
     # 若缺失環境變數，記錄錯誤並終止
     if missing_vars:
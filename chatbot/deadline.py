@@ -0,0 +1,85 @@
+"""
+端到端時限
+此乃呼叫者之時間預算，層層下傳，逾時即止
+"""
+
+import time
+from typing import Optional, Union
+
+from chatbot.exceptions import DeadlineExceeded
+
+
+class Deadline:
+    """
+    以單調時鐘記錄之絕對時限
+    """
+
+    def __init__(self, expires_at: float):
+        """
+        參數：
+            expires_at: 到期時刻（time.monotonic() 之刻度）
+        """
+        self.expires_at = expires_at  # 到期時刻
+
+    @classmethod
+    def after(cls, seconds: float) -> 'Deadline':
+        """建立於若干秒後到期之時限"""
+        return cls(time.monotonic() + seconds)
+
+    @classmethod
+    def coerce(cls, value: Union[None, float, 'Deadline']) -> Optional['Deadline']:
+        """將秒數或時限統一為時限；None 表示無時限"""
+        if value is None or isinstance(value, Deadline):
+            return value
+        return cls.after(value)
+
+    def wall_clock(self) -> float:
+        """到期時刻之牆鐘刻度（time.time()），供跨行程傳遞；單調時鐘之起點各行程未必相同"""
+        return time.time() + (self.expires_at - time.monotonic())
+
+    @classmethod
+    def from_wall_clock(cls, timestamp: float) -> 'Deadline':
+        """由牆鐘之到期時刻重建時限"""
+        return cls.after(timestamp - time.time())
+
+    def remaining(self) -> float:
+        """剩餘秒數，已到期則為 0"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        """是否已到期"""
+        return time.monotonic() >= self.expires_at
+
+    def check(self, what: str = '') -> None:
+        """
+        檢查時限
+
+        參數：
+            what: 描述所要進行之工作，用於異常訊息
+
+        異常：
+            DeadlineExceeded: 已到期
+        """
+        if self.expired:
+            raise DeadlineExceeded(f"時限已過{'：' + what if what else ''}")
+
+    def timeout(self, cap: Optional[float] = None) -> float:
+        """
+        取得下一次呼叫可用之超時
+
+        參數：
+            cap: 超時上限（秒）
+
+        返回：
+            min(cap, 剩餘秒數)
+
+        異常：
+            DeadlineExceeded: 已到期
+        """
+        self.check()
+        remaining = self.remaining()
+        return remaining if cap is None else min(cap, remaining)
+
+    def __repr__(self) -> str:
+        return f"Deadline(remaining={self.remaining():.3f}s)"
@@ -0,0 +1,50 @@
+"""
+聊天機器人之異常類別
+此乃諸般失敗之名
+"""
+
+
+class ChatBotError(Exception):
+    """聊天機器人異常之基底"""
+
+
+class BusyError(ChatBotError):
+    """系統忙碌，請求於入場時被拒"""
+
+
+class QueueTimeoutError(BusyError):
+    """請求於佇列中等候逾時而被捨棄"""
+
+
+class DeadlineExceeded(ChatBotError):
+    """呼叫者之時限已過，其後之工作應予放棄"""
+
+
+class SnapshotError(ChatBotError):
+    """快照檔案毀損或版本不符"""
+
+
+class QuotaExceededError(ChatBotError):
+    """使用者於時窗內之用量已達限額"""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        """
+        參數：
+            message: 說明
+            retry_after: 建議之重試等候（秒）
+        """
+        super().__init__(message)
+        self.retry_after = retry_after  # 建議之重試等候（秒）
+
+
+class NoAvailableKeyError(BusyError):
+    """金鑰池中之祕鑰皆遭限流或停用"""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        """
+        參數：
+            message: 說明
+            retry_after: 最早可用之祕鑰恢復前之秒數
+        """
+        super().__init__(message)
+        self.retry_after = retry_after  # 最早可用之祕鑰恢復前之秒數
@@ -4,6 +4,15 @@
 """
 
 from .trigger_filter import TriggerFilter
+from .admission import AdmissionController, AdmissionStats
+from .race import RaceRunner, RaceStats
 from .chatbot import ChatBot
 
-__all__ = ['TriggerFilter', 'ChatBot']
+__all__ = [
+    'TriggerFilter',
+    'AdmissionController',
+    'AdmissionStats',
+    'RaceRunner',
+    'RaceStats',
+    'ChatBot',
+]
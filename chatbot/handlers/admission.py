@@ -0,0 +1,149 @@
+"""
+入場控制 - 以有界佇列限制同時處理之請求
+此乃量力而行之道，寧速拒而勿久候
+"""
+
+import threading
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Deque, Dict, Iterator, Mapping, Optional
+
+from chatbot.exceptions import BusyError, QueueTimeoutError
+from chatbot.services.scheduler import INTERACTIVE, default_classes
+
+
+@dataclass
+class AdmissionStats:
+    """入場統計"""
+    admitted: int = 0  # 已入場數
+    rejected: int = 0  # 佇列已滿而速拒之數
+    expired: int = 0  # 等候逾時而捨棄之數
+    in_flight: int = 0  # 處理中之數
+    queued: int = 0  # 佇列中之數
+    peak_queued: int = 0  # 佇列之峰值
+
+
+class _ClassQueue:
+    """單一優先類別之等候佇列"""
+
+    __slots__ = ('weight', 'waiters', 'vtime')
+
+    def __init__(self, weight: float):
+        self.weight = weight  # 權重
+        self.waiters: Deque[threading.Event] = deque()  # 等候者，類別內先來先得
+        self.vtime = 0.0  # 虛擬時間
+
+
+class AdmissionController:
+    """
+    限制同時處理數與等候佇列深度
+
+    處理中之請求達上限時，新請求依其優先類別排隊；佇列已滿則即刻拒絕，等候逾時者捨棄。
+    名額釋出時直接轉交，免遭插隊：與 PriorityScheduler 同以加權公平排隊，交予虛擬時間最小之類別，
+    故互動請求優先，而批次與背景請求仍依權重入場，不致餓死。
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 16,
+        max_queue: int = 64,
+        max_queue_wait: float = 5.0,
+        weights: Optional[Mapping[str, float]] = None
+    ):
+        """
+        參數：
+            max_concurrency: 最大同時處理數
+            max_queue: 佇列最大深度（各類別合計）；0 則不排隊
+            max_queue_wait: 佇列中之最長等候（秒）
+            weights: 各優先類別之權重，同分時排前者優先；預設同 PriorityScheduler，未列之類別權重為 1
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency 須至少為 1")
+        if weights is None:
+            weights = {spec.name: spec.weight for spec in default_classes(max_concurrency)}
+        if any(weight <= 0 for weight in weights.values()):
+            raise ValueError("類別之權重須為正數")
+        self.max_concurrency = max_concurrency  # 最大同時處理數
+        self.max_queue = max_queue  # 佇列最大深度
+        self.max_queue_wait = max_queue_wait  # 最長等候（秒）
+        self.stats = AdmissionStats()  # 入場統計
+        self._lock = threading.Lock()
+        self._classes: Dict[str, _ClassQueue] = {name: _ClassQueue(weight) for name, weight in weights.items()}
+        self._vclock = 0.0  # 最近一次分配時之虛擬時間
+
+    def _queue(self, priority: str) -> _ClassQueue:
+        """取得類別之佇列，未列之類別以權重 1 加入（須持有 self._lock）"""
+        queue = self._classes.get(priority)
+        if queue is None:
+            queue = self._classes[priority] = _ClassQueue(1.0)
+        return queue
+
+    def _grant(self, queue: _ClassQueue) -> None:
+        """計入一次分配，推進其虛擬時間"""
+        self._vclock = max(self._vclock, queue.vtime)
+        queue.vtime += 1.0 / queue.weight
+
+    def acquire(self, timeout: Optional[float] = None, priority: str = INTERACTIVE) -> None:
+        """
+        取得處理名額
+
+        參數：
+            timeout: 本次等候上限（秒）；與 max_queue_wait 取其短
+            priority: 優先類別；名額依類別之權重分配
+
+        異常：
+            BusyError: 佇列已滿
+            QueueTimeoutError: 等候逾時
+        """
+        with self._lock:
+            queue = self._queue(priority)
+            if self.stats.in_flight < self.max_concurrency and not self.stats.queued:
+                self._grant(queue)
+                self.stats.in_flight += 1
+                self.stats.admitted += 1
+                return
+            if self.stats.queued >= self.max_queue:
+                self.stats.rejected += 1
+                raise BusyError("佇列已滿")
+            if not queue.waiters:
+                # 閒置後重新活躍之類別不得以累積之落後搶占名額
+                queue.vtime = max(queue.vtime, self._vclock)
+            waiter = threading.Event()
+            queue.waiters.append(waiter)
+            self.stats.queued += 1
+            self.stats.peak_queued = max(self.stats.peak_queued, self.stats.queued)
+
+        wait = self.max_queue_wait if timeout is None else min(timeout, self.max_queue_wait)
+        granted = waiter.wait(wait)
+        with self._lock:
+            if not granted and not waiter.is_set():
+                queue.waiters.remove(waiter)
+                self.stats.queued -= 1
+                self.stats.expired += 1
+                raise QueueTimeoutError(f"等候逾 {wait:.3f} 秒")
+            # 名額已由釋出者轉交，in_flight 未曾減少
+            self.stats.admitted += 1
+
+    def release(self) -> None:
+        """釋出處理名額；有等候者則轉交虛擬時間最小之類別"""
+        with self._lock:
+            chosen = None
+            for queue in self._classes.values():
+                if queue.waiters and (chosen is None or queue.vtime < chosen.vtime):
+                    chosen = queue
+            if chosen is None:
+                self.stats.in_flight -= 1
+                return
+            self._grant(chosen)
+            chosen.waiters.popleft().set()
+            self.stats.queued -= 1
+
+    @contextmanager
+    def admit(self, timeout: Optional[float] = None, priority: str = INTERACTIVE) -> Iterator[None]:
+        """以上下文管理取得並釋出名額"""
+        self.acquire(timeout, priority)
+        try:
+            yield
+        finally:
+            self.release()
@@ -3,11 +3,20 @@
 此乃對話之樞紐，協調各元件
 """
 
+import functools
 import logging
-from typing import Optional
+import re
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Sequence, Set, Tuple, Union
 
-from chatbot.models import ConversationManager
-from chatbot.services import APIHandler
+from chatbot.deadline import Deadline
+from chatbot.exceptions import BusyError, DeadlineExceeded, QueueTimeoutError, QuotaExceededError
+from chatbot.models import ConversationManager, Usage, UsageMeter
+from chatbot.profiling import RequestProfiler
+from chatbot.services import INTERACTIVE, PRIORITIES, APIHandler, PriorityScheduler
+from .admission import AdmissionController
+from .race import Contender, RaceRunner
 from .trigger_filter import TriggerFilter
 
 logger = logging.getLogger(__name__)
@@ -18,10 +27,22 @@ class ChatBot:
     主要業務邏輯，協調 APIHandler 與 ConversationManager
     """
 
+    ERROR_MESSAGE: str = "抱歉，處理您的訊息時出現錯誤。請稍後再試。"  # 錯誤回覆
+    EMPTY_QUERY_MESSAGE: str = "請提供查詢內容。"  # 缺查詢內容之提示
+    BUSY_MESSAGE: str = "系統繁忙，請稍後再試。"  # 入場被拒之回覆
+    TIMEOUT_MESSAGE: str = "處理逾時，請稍後再試。"  # 時限已過之回覆
+    QUOTA_MESSAGE: str = "您的使用量已達上限，請稍後再試。"  # 超出用量限額之回覆
+    RACE_COMMAND: str = "/競速"  # 單則訊息啟用競速之指令
+
     def __init__(
         self,
         api_handler: APIHandler,
-        conversation_manager: ConversationManager
+        conversation_manager: ConversationManager,
+        race_runner: Optional[RaceRunner] = None,
+        race_contenders: Sequence[str] = ('gemini', 'perplexity'),
+        admission: Optional[AdmissionController] = None,
+        profiler: Optional[RequestProfiler] = None,
+        usage_meter: Optional[UsageMeter] = None
     ):
         """
         初始化聊天機器人
@@ -29,54 +50,256 @@ class ChatBot:
         參數：
             api_handler: API 處理器
             conversation_manager: 對話歷史管理器
+            race_runner: 競速執行器；預設自建
+            race_contenders: 競速參賽者，"gemini"、"perplexity" 或 "gemini:<模型名>"
+            admission: 入場控制器；None 則不設限
+            profiler: 按需剖析器；None 則不剖析
+            usage_meter: 用量計量器；設有限額者於呼叫提供者前檢查，None 則不計量
         """
         self.api_handler = api_handler  # API 處理器
         self.conversation_manager = conversation_manager  # 對話歷史管理器
+        self.race_runner = race_runner or RaceRunner()  # 競速執行器
+        self.race_contenders = list(race_contenders)  # 競速參賽者
+        self.race_users: Set[str] = set()  # 預設啟用競速之使用者
+        self.admission = admission  # 入場控制器
+        self.profiler = profiler  # 按需剖析器
+        self.usage_meter = usage_meter  # 用量計量器
+
+    def set_race_mode(self, user_id: str, enabled: bool) -> None:
+        """
+        設定使用者是否預設以競速模式處理一般訊息
+
+        參數：
+            user_id: 使用者識別
+            enabled: 是否啟用
+        """
+        if enabled:
+            self.race_users.add(user_id)
+        else:
+            self.race_users.discard(user_id)
+
+    def _build_contenders(
+        self,
+        prompt: str,
+        message: str,
+        deadline: Optional[Deadline],
+        on_usage: Optional[Callable[[Usage], None]] = None,
+        priority: str = INTERACTIVE
+    ) -> List[Contender]:
+        """
+        依設定之參賽者建立競速呼叫；各參賽者之用量皆計入
+
+        Gemini 參賽者得含對話歷史之提示詞，Perplexity 為搜尋引擎，僅得使用者之原訊息。
+        """
+        contenders = []
+        for spec in self.race_contenders:
+            provider, _, model = spec.partition(':')
+            if provider == 'gemini':
+                contenders.append((spec, lambda m=model or None: self.api_handler.query_gemini(
+                    prompt, model=m, deadline=deadline, on_usage=on_usage, priority=priority)))
+            elif provider == 'perplexity':
+                contenders.append((spec, lambda: self.api_handler.query_perplexity(
+                    message, deadline=deadline, on_usage=on_usage, priority=priority)))
+            else:
+                raise ValueError(f"未知之競速參賽者: {spec}")
+        return contenders
 
-    def process_message(self, user_id: str, message: str) -> str:
+    def process_message(
+        self,
+        user_id: str,
+        message: str,
+        race: Optional[bool] = None,
+        deadline: Union[None, float, Deadline] = None,
+        priority: str = INTERACTIVE
+    ) -> str:
         """
         處理使用者訊息
         
         參數：
             user_id: 使用者識別
             message: 使用者訊息
+            race: 是否以競速模式處理；None 則依使用者設定或 /競速 指令
+            deadline: 時限（Deadline 或自此刻起之秒數）；逾時之工作放棄且不入歷史
+            priority: 優先類別（"interactive"、"batch"、"background"）；入場與 API 處理器之排程據以分配名額
         
         返回：
             聊天機器人之回應
         
         異常：
+            ValueError: 未知之優先類別
             Exception: 處理訊息時發生錯誤
         """
+        if priority not in self._priorities():
+            raise ValueError(f"未知之優先類別: {priority}")
+        if self.profiler is not None and self.profiler.active:
+            return self.profiler.run(self._process_message, user_id, message, race, deadline, priority)
+        return self._process_message(user_id, message, race, deadline, priority)
+
+    def _process_message(
+        self,
+        user_id: str,
+        message: str,
+        race: Optional[bool],
+        deadline: Union[None, float, Deadline],
+        priority: str = INTERACTIVE
+    ) -> str:
+        """處理訊息之本體：入場、路由與錯誤轉換"""
+        deadline = Deadline.coerce(deadline)
+        start = time.perf_counter()
+        route = 'unrouted'  # 路由失敗時日誌所記之路由
+        charged = False  # 是否已計入限額
+        used: List[Usage] = []  # 本則請求之提供者用量
+        try:
+            message, route = self._route(user_id, message, race)
+            # 超額者於入場與呼叫提供者之前即拒，不佔上游容量
+            on_usage = None
+            if self.usage_meter is not None:
+                self.usage_meter.admit(user_id)
+                charged = True
+                on_usage = functools.partial(self._record_usage, user_id, used)
+            with self._admitted(deadline, priority):
+                response = self._handle_message(user_id, message, route, deadline, priority, on_usage)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("訊息處理完成", extra=self._log_fields(user_id, route, start))
+            return response
+
+        except QuotaExceededError as e:
+            logger.warning("拒絕超額之使用者: %s", e, extra=self._log_fields(user_id, route, start))
+            return self.QUOTA_MESSAGE
+        except BusyError as e:
+            logger.warning("拒絕處理訊息: %s", e, extra=self._log_fields(user_id, route, start))
+            self._refund(user_id, charged, used)
+            return self.BUSY_MESSAGE
+        except DeadlineExceeded as e:
+            logger.warning("放棄逾時之訊息: %s", e, extra=self._log_fields(user_id, route, start))
+            self._refund(user_id, charged, used)
+            return self.TIMEOUT_MESSAGE
+        except Exception as e:
+            if deadline is not None and deadline.expired:
+                logger.warning("放棄逾時之訊息: %s", e, extra=self._log_fields(user_id, route, start))
+                self._refund(user_id, charged, used)
+                return self.TIMEOUT_MESSAGE
+            logger.error("處理訊息時出錯: %s", e, extra=self._log_fields(user_id, route, start))
+            return self.ERROR_MESSAGE
+
+    def _record_usage(self, user_id: str, used: List[Usage], usage: Usage) -> None:
+        """記入提供者之用量，並記於本則請求"""
+        used.append(usage)
+        self.usage_meter.record(user_id, usage)
+
+    def _refund(self, user_id: str, charged: bool, used: List[Usage]) -> None:
+        """遭拒或逾時而未耗用提供者之請求，退還其所計之請求數"""
+        if charged and not used:
+            self.usage_meter.refund(user_id)
+
+    def _priorities(self) -> Sequence[str]:
+        """可用之優先類別：API 處理器啟用排程時依其類別，否則為預設之類別"""
+        scheduler = getattr(self.api_handler, 'scheduler', None)
+        return scheduler.classes if isinstance(scheduler, PriorityScheduler) else PRIORITIES
+
+    @contextmanager
+    def _admitted(self, deadline: Optional[Deadline], priority: str) -> Iterator[None]:
+        """
+        取得入場名額；未設入場控制則不設限
+
+        異常：
+            DeadlineExceeded: 時限於等候中屆滿
+            BusyError: 佇列已滿，或等候逾 max_queue_wait
+        """
+        if self.admission is None:
+            yield
+            return
         try:
-            # 新增使用者訊息到歷史
-            self.conversation_manager.add_message(user_id, message)
+            self.admission.acquire(deadline.remaining() if deadline else None, priority)
+        except QueueTimeoutError:
+            # 等候為時限所截者屬逾時，非繁忙
+            if deadline is not None and deadline.expired:
+                raise DeadlineExceeded("時限已過：等候入場") from None
+            raise
+        try:
+            yield
+        finally:
+            self.admission.release()
+
+    def _route(self, user_id: str, message: str, race: Optional[bool]) -> Tuple[str, str]:
+        """
+        決定訊息之路由
+
+        返回：
+            (去除競速指令後之訊息, 路由："perplexity"、"race" 或 "gemini")
+        """
+        # 檢查競速指令
+        # 指令之後須為空白或訊息結尾，"/競速xyz" 不算
+        command = re.match(rf'{re.escape(self.RACE_COMMAND)}(?=\s|$)', message)
+        if command:
+            message = message[command.end():].strip()
+            race = True
+        if race is None:
+            race = user_id in self.race_users
+
+        # 檢查是否觸發 Perplexity 查詢
+        if TriggerFilter.is_triggered(message):
+            return message, 'perplexity'
+        return message, 'race' if race else 'gemini'
+
+    @staticmethod
+    def _log_fields(user_id: str, route: str, start: float) -> dict:
+        """結構化日誌之欄位"""
+        return {'user': user_id, 'route': route, 'latency_ms': round((time.perf_counter() - start) * 1000, 1)}
+
+    def _handle_message(
+        self,
+        user_id: str,
+        message: str,
+        route: str,
+        deadline: Optional[Deadline],
+        priority: str = INTERACTIVE,
+        on_usage: Optional[Callable[[Usage], None]] = None
+    ) -> str:
+        """
+        處理已獲入場之訊息：呼叫 API 並更新歷史
 
-            # 取得對話歷史
+        使用者訊息與回覆於取得回覆後一併寫入歷史，故逾時或失敗之交談不留痕跡。
+        on_usage 接收各次提供者呼叫之用量。
+        """
+        if route == 'perplexity':
+            # 提取查詢內容
+            query_content = TriggerFilter.extract_content(message)
+            if not query_content:
+                return self.EMPTY_QUERY_MESSAGE
+
+            # 調用 Perplexity API
+            response = self.api_handler.query_perplexity(
+                query_content, deadline=deadline, on_usage=on_usage, priority=priority
+            )
+        else:
+            # 取得對話歷史：即加入本則訊息後上限內所存之前文
             history = self.conversation_manager.get_history(user_id)
+            keep = self.conversation_manager.max_messages - 1
+            previous = history[-keep:] if keep > 0 else []
 
-            # 檢查是否觸發 Perplexity 查詢
-            if TriggerFilter.is_triggered(message):
-                # 提取查詢內容
-                query_content = TriggerFilter.extract_content(message)
-                if not query_content:
-                    return "請提供查詢內容。"
+            # 構建 Gemini 提示詞
+            history_str = "\n".join(previous) if previous else "（無歷史）"
+            prompt = f"對話歷史:\n{history_str}\n\n使用者訊息: {message}"
 
-                # 調用 Perplexity API
-                response = self.api_handler.query_perplexity(query_content)
+            if route == 'race':
+                # 同時詢問各參賽者，僅取勝者之回覆
+                timeout = deadline.remaining() if deadline else None
+                contenders = self._build_contenders(prompt, message, deadline, on_usage, priority)
+                winner, response = self.race_runner.race(contenders, timeout)
+                logger.info("競速勝者: %s", winner, extra={'user': user_id, 'route': route, 'provider': winner})
             else:
-                # 構建 Gemini 提示詞
-                history_str = "\n".join(history[:-1]) if len(history) > 1 else "（無歷史）"
-                prompt = f"對話歷史:\n{history_str}\n\n使用者訊息: {message}"
-
                 # 調用 Gemini API
-                response = self.api_handler.query_gemini(prompt)
+                response = self.api_handler.query_gemini(
+                    prompt, deadline=deadline, on_usage=on_usage, priority=priority
+                )
 
-            # 新增 AI 回覆到歷史
-            self.conversation_manager.add_message(user_id, response)
+        # 呼叫者已放棄者，不入歷史
+        if deadline is not None:
+            deadline.check("寫入對話歷史")
 
-            return response
+        # 新增使用者訊息與 AI 回覆到歷史
+        self.conversation_manager.add_message(user_id, message)
+        self.conversation_manager.add_message(user_id, response)
 
-        except Exception as e:
-            logger.error(f"處理訊息時出錯: {e}")
-            error_message = "抱歉，處理您的訊息時出現錯誤。請稍後再試。"
-            return error_message
+        return response
@@ -0,0 +1,109 @@
+"""
+競速路由 - 同時向多個提供者發問，先得佳答者勝
+此乃以成本換延遲之術
+"""
+
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 參賽者：(名稱, 無參數之呼叫)
+Contender = Tuple[str, Callable[[], str]]
+
+
+@dataclass
+class RaceStats:
+    """競速統計"""
+    races: int = 0  # 競速次數
+    wins: Counter = field(default_factory=Counter)  # 名稱 -> 勝場
+    entries: Counter = field(default_factory=Counter)  # 名稱 -> 參賽次數
+    failures: Counter = field(default_factory=Counter)  # 名稱 -> 失敗次數
+
+    def win_rate(self, name: str) -> float:
+        """某參賽者之勝率"""
+        entries = self.entries.get(name, 0)
+        return self.wins.get(name, 0) / entries if entries else 0.0
+
+    def to_dict(self) -> Dict[str, dict]:
+        """各參賽者之統計"""
+        return {
+            name: {
+                'entries': self.entries[name],
+                'wins': self.wins[name],
+                'failures': self.failures[name],
+                'win_rate': self.win_rate(name),
+            }
+            for name in self.entries
+        }
+
+
+class RaceRunner:
+    """
+    並行執行多個參賽者，返回首個成功之結果
+    落敗者若尚未開始則取消，已開始者任其完成而棄其結果
+    """
+
+    def __init__(self, max_workers: int = 32):
+        """
+        參數：
+            max_workers: 執行緒池大小
+        """
+        self.stats = RaceStats()  # 競速統計
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='race')
+        self._lock = threading.Lock()
+
+    def race(self, contenders: List[Contender], timeout: Optional[float] = None) -> Tuple[str, str]:
+        """
+        執行一場競速
+
+        參數：
+            contenders: 參賽者列表
+            timeout: 最長等候（秒）
+
+        返回：
+            (勝者名稱, 回應)
+
+        異常：
+            Exception: 全數失敗時拋出最後一個異常
+            TimeoutError: 逾時仍無成功者
+        """
+        if not contenders:
+            raise ValueError("競速至少需要一位參賽者")
+        futures: Dict[Future, str] = {
+            self._executor.submit(call): name for name, call in contenders
+        }
+        with self._lock:
+            self.stats.races += 1
+            self.stats.entries.update(name for name, _ in contenders)
+
+        pending = set(futures)
+        last_error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    raise TimeoutError("競速逾時，無參賽者完成")
+                for future in done:
+                    name = futures[future]
+                    error = future.exception()
+                    if error is None:
+                        with self._lock:
+                            self.stats.wins[name] += 1
+                        return name, future.result()
+                    with self._lock:
+                        self.stats.failures[name] += 1
+                    logger.warning("競速參賽者 %s 失敗: %s", name, error, extra={'provider': name})
+                    last_error = error
+            raise last_error
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def close(self) -> None:
+        """關閉執行緒池"""
+        self._executor.shutdown(wait=False)
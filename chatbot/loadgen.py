@@ -0,0 +1,560 @@
+"""
+開環負載產生器
+此乃壓力之試煉，以固定到達率驅動 ChatBot，量其飽和之點
+
+與 main.py 之「一問一答」閉環不同，此處請求依預定時刻送出，不待前者完成；
+延遲自「預定送出時刻」起算，以矯正協同遺漏（coordinated omission）。
+
+用法：
+    python -m chatbot.loadgen --rate 50 --duration 30
+    python -m chatbot.loadgen --rate 200 --traffic traffic.jsonl --url http://127.0.0.1:8000/chat
+    python -m chatbot.loadgen --rate 300 --batch-ratio 0.8 --scheduler 16
+"""
+
+import argparse
+import functools
+import logging
+import math
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from chatbot import codec
+from chatbot.handlers import AdmissionController, ChatBot
+from chatbot.models import ConversationManager, Quota, Usage, UsageMeter
+from chatbot.profiling import RequestProfiler
+from chatbot.services import BATCH, INTERACTIVE, APIHandler
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TrafficRecord:
+    """單筆流量記錄"""
+    user_id: str  # 使用者識別
+    message: str  # 使用者訊息
+    priority: str = INTERACTIVE  # 優先類別
+
+
+@dataclass
+class RequestResult:
+    """單筆請求之結果"""
+    intended: float  # 預定送出時刻
+    started: float  # 實際開始時刻
+    finished: float  # 完成時刻
+    outcome: str  # 結果分類："ok" 或錯誤種類
+    priority: str = INTERACTIVE  # 優先類別
+
+
+def load_traffic(path: str) -> List[TrafficRecord]:
+    """
+    自 JSONL 檔案載入已錄製之流量
+
+    每行一個 JSON 物件，須含 user_id 與 message 欄位，可附 priority。
+
+    參數：
+        path: 檔案路徑
+
+    返回：
+        流量記錄列表
+    """
+    records = []
+    with open(path, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            data = codec.loads(line)
+            records.append(TrafficRecord(str(data['user_id']), data['message'], data.get('priority', INTERACTIVE)))
+    if not records:
+        raise ValueError(f"流量檔案無任何記錄: {path}")
+    return records
+
+
+def synthetic_traffic(
+    users: int = 100,
+    query_ratio: float = 0.2,
+    size: int = 1000,
+    seed: Optional[int] = None,
+    batch_ratio: float = 0.0
+) -> List[TrafficRecord]:
+    """
+    產生合成流量組合
+
+    參數：
+        users: 使用者數
+        query_ratio: 觸發 Perplexity 查詢之比例
+        size: 記錄數
+        seed: 亂數種子
+        batch_ratio: 標為批次流量之比例，其餘為互動流量
+
+    返回：
+        流量記錄列表
+    """
+    rng = random.Random(seed)
+    records = []
+    for i in range(size):
+        user_id = f"user{rng.randrange(users)}"
+        if rng.random() < query_ratio:
+            message = f"/請查詢 第 {i} 則新聞"
+        else:
+            message = f"請談談第 {i} 個主題"
+        priority = BATCH if batch_ratio and rng.random() < batch_ratio else INTERACTIVE
+        records.append(TrafficRecord(user_id, message, priority))
+    return records
+
+
+def arrival_offsets(
+    rate: float,
+    count: int,
+    process: str = 'poisson',
+    seed: Optional[int] = None
+) -> List[float]:
+    """
+    計算各請求相對於起點之預定送出時刻
+
+    參數：
+        rate: 到達率（每秒請求數）
+        count: 請求數
+        process: "poisson"（指數間隔）或 "uniform"（固定間隔）
+        seed: 亂數種子
+
+    返回：
+        遞增之時刻列表（秒）
+    """
+    if rate <= 0:
+        raise ValueError("到達率須大於 0")
+    rng = random.Random(seed)
+    offsets = []
+    t = 0.0
+    for _ in range(count):
+        offsets.append(t)
+        if process == 'poisson':
+            t += rng.expovariate(rate)
+        elif process == 'uniform':
+            t += 1.0 / rate
+        else:
+            raise ValueError(f"未知之到達過程: {process}")
+    return offsets
+
+
+class LatencyHistogram:
+    """
+    對數分桶之延遲直方圖
+    各桶上界相鄰比為 (1 + precision)，故百分位之相對誤差不逾 precision
+    """
+
+    def __init__(self, precision: float = 0.01):
+        """
+        參數：
+            precision: 相對精度
+        """
+        self._log_base = math.log1p(precision)  # 分桶之對數底
+        self.counts: Dict[int, int] = {}  # 桶索引 -> 次數
+        self.total = 0  # 總次數
+        self.min = math.inf  # 最小值（秒）
+        self.max = 0.0  # 最大值（秒）
+        self._sum = 0.0  # 總和（秒）
+
+    def record(self, seconds: float) -> None:
+        """記錄一筆延遲（秒）"""
+        micros = max(seconds * 1e6, 1.0)
+        index = int(math.log(micros) / self._log_base)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+        self._sum += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    @property
+    def mean(self) -> float:
+        """平均延遲（秒）"""
+        return self._sum / self.total if self.total else 0.0
+
+    def _upper_bound(self, index: int) -> float:
+        """桶上界（秒）"""
+        return math.exp((index + 1) * self._log_base) / 1e6
+
+    def percentile(self, p: float) -> float:
+        """
+        取得百分位延遲
+
+        參數：
+            p: 百分位（0-100）
+
+        返回：
+            延遲（秒）；無記錄時為 0
+        """
+        if not self.total:
+            return 0.0
+        target = max(1, math.ceil(self.total * p / 100.0))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._upper_bound(index), self.max)
+        return self.max
+
+    def buckets(self) -> List[Tuple[float, int]]:
+        """
+        以 2 之冪毫秒為界彙整各桶，供文字呈現
+
+        返回：
+            (上界秒數, 次數) 之列表
+        """
+        coarse: Dict[int, int] = {}
+        for index, count in self.counts.items():
+            millis = self._upper_bound(index) * 1000
+            exponent = max(0, math.ceil(math.log2(millis))) if millis > 1 else 0
+            coarse[exponent] = coarse.get(exponent, 0) + count
+        return [(2 ** e / 1000.0, coarse[e]) for e in sorted(coarse)]
+
+
+@dataclass
+class LoadReport:
+    """負載測試報告"""
+    offered_rate: float  # 預定到達率（每秒）
+    elapsed: float  # 實際耗時（秒）
+    sent: int  # 送出請求數
+    outcomes: Counter = field(default_factory=Counter)  # 結果分類計數
+    latency: LatencyHistogram = field(default_factory=LatencyHistogram)  # 矯正後延遲
+    service_time: LatencyHistogram = field(default_factory=LatencyHistogram)  # 未矯正之服務時間
+    dispatch_lag: float = 0.0  # 派送之最大落後（秒）
+    by_priority: Dict[str, LatencyHistogram] = field(default_factory=dict)  # 各優先類別之矯正後延遲
+
+    PERCENTILES = (50.0, 90.0, 99.0, 99.9)  # 報告之百分位
+
+    @property
+    def throughput(self) -> float:
+        """完成吞吐量（每秒）"""
+        return sum(self.outcomes.values()) / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def goodput(self) -> float:
+        """成功吞吐量（每秒）"""
+        return self.outcomes.get('ok', 0) / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self) -> dict:
+        """轉為可序列化之字典"""
+        def summary(histogram: LatencyHistogram) -> dict:
+            data = {f"p{p:g}": histogram.percentile(p) for p in self.PERCENTILES}
+            data['mean'] = histogram.mean
+            data['max'] = histogram.max
+            data['histogram'] = [[upper, count] for upper, count in histogram.buckets()]
+            return data
+
+        return {
+            'offered_rate': self.offered_rate,
+            'elapsed': self.elapsed,
+            'sent': self.sent,
+            'throughput': self.throughput,
+            'goodput': self.goodput,
+            'outcomes': dict(self.outcomes),
+            'dispatch_lag': self.dispatch_lag,
+            'latency': summary(self.latency),
+            'service_time': summary(self.service_time),
+            'by_priority': {name: summary(histogram) for name, histogram in self.by_priority.items()},
+        }
+
+    def format(self) -> str:
+        """轉為人可讀之文字報告"""
+        lines = [
+            f"預定到達率: {self.offered_rate:.1f}/s  送出: {self.sent}  耗時: {self.elapsed:.2f}s",
+            f"吞吐量: {self.throughput:.1f}/s  成功吞吐量: {self.goodput:.1f}/s",
+            "結果: " + ", ".join(f"{k}={v}" for k, v in sorted(self.outcomes.items())),
+        ]
+        for title, histogram in (("延遲（矯正後）", self.latency), ("服務時間（未矯正）", self.service_time)):
+            cells = "  ".join(f"p{p:g}={histogram.percentile(p) * 1000:.1f}ms" for p in self.PERCENTILES)
+            lines.append(f"{title}: {cells}  max={histogram.max * 1000:.1f}ms")
+        if len(self.by_priority) > 1:
+            for name, histogram in sorted(self.by_priority.items()):
+                cells = "  ".join(f"p{p:g}={histogram.percentile(p) * 1000:.1f}ms" for p in self.PERCENTILES)
+                lines.append(f"  {name}（{histogram.total}）: {cells}")
+        lines.append("延遲分佈（矯正後）:")
+        peak = max((count for _, count in self.latency.buckets()), default=0)
+        for upper, count in self.latency.buckets():
+            bar = '#' * max(1, round(40 * count / peak))
+            lines.append(f"  <= {upper * 1000:>8.0f}ms {count:>7} {bar}")
+        if self.dispatch_lag > 0.01:
+            lines.append(f"警告：派送最大落後 {self.dispatch_lag * 1000:.1f}ms，產生器本身可能已飽和")
+        return "\n".join(lines)
+
+
+def classify_reply(reply: str) -> str:
+    """
+    依 ChatBot 之回覆分類結果
+
+    ChatBot 吞下例外而回覆固定字串，故以回覆內容辨識失敗。
+    """
+    if reply == ChatBot.ERROR_MESSAGE:
+        return 'error'
+    if reply == ChatBot.BUSY_MESSAGE:
+        return 'busy'
+    if reply == ChatBot.TIMEOUT_MESSAGE:
+        return 'timeout'
+    if reply == ChatBot.QUOTA_MESSAGE:
+        return 'quota'
+    return 'ok'
+
+
+class InProcessTarget:
+    """於本行程內直接驅動 ChatBot"""
+
+    def __init__(self, chatbot: ChatBot, deadline: Optional[float] = None):
+        self.chatbot = chatbot  # 受測之聊天機器人
+        self.deadline = deadline  # 每則請求之時限（秒）
+
+    def __call__(self, record: TrafficRecord) -> str:
+        reply = self.chatbot.process_message(
+            record.user_id, record.message, deadline=self.deadline, priority=record.priority
+        )
+        return classify_reply(reply)
+
+
+class HttpTarget:
+    """
+    經服務端點驅動 ChatBot
+    以 POST 送出 {"user_id", "message"}，期待 JSON 回應 {"reply"}
+    """
+
+    def __init__(self, url: str, timeout: float = 30):
+        import requests
+
+        self.url = url  # 服務端點
+        self.timeout = timeout  # 超時時間（秒）
+        self._local = threading.local()  # 每執行緒一個連線池
+        self._requests = requests
+
+    def __call__(self, record: TrafficRecord) -> str:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        response = session.post(
+            self.url,
+            data=codec.dumps({'user_id': record.user_id, 'message': record.message, 'priority': record.priority}),
+            headers={'Content-Type': 'application/json'},
+            timeout=self.timeout
+        )
+        if response.status_code != 200:
+            return f"http_{response.status_code}"
+        return classify_reply(codec.loads(response.content).get('reply', ''))
+
+
+class SimulatedAPIHandler(APIHandler):
+    """
+    模擬之 API 處理器，不連外部服務
+    延遲呈指數分佈，並可依比例注入失敗
+    """
+
+    def __init__(self, latency: float = 0.05, error_rate: float = 0.0, seed: Optional[int] = None):
+        """
+        參數：
+            latency: 平均延遲（秒）
+            error_rate: 失敗比例
+            seed: 亂數種子
+        """
+        super().__init__(gemini_key='simulated', perplexity_key='simulated')
+        self.latency = latency  # 平均延遲（秒）
+        self.error_rate = error_rate  # 失敗比例
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _simulate(self, provider: str) -> str:
+        with self._lock:
+            delay = self._rng.expovariate(1.0 / self.latency) if self.latency > 0 else 0.0
+            failed = self._rng.random() < self.error_rate
+        time.sleep(delay)
+        if failed:
+            raise RuntimeError(f"{provider} 模擬失敗")
+        return f"{provider} 模擬回應"
+
+    def query_gemini(self, prompt: str, *args, deadline=None, on_usage=None, priority=INTERACTIVE, **kwargs) -> str:
+        return self._respond('gemini', prompt, deadline, on_usage, priority)
+
+    def query_perplexity(self, query: str, *args, deadline=None, on_usage=None, priority=INTERACTIVE, **kwargs) -> str:
+        return self._respond('perplexity', query, deadline, on_usage, priority)
+
+    def _respond(self, provider: str, prompt: str, deadline, on_usage, priority: str) -> str:
+        # 模擬之呼叫亦經排程，以量優先序之效
+        with self._scheduled(priority, deadline):
+            reply = self._simulate(provider)
+        if on_usage is not None:
+            # 粗估權杖數：約每四字元一個
+            on_usage(Usage(provider, len(prompt) // 4 + 1, len(reply) // 4 + 1))
+        return reply
+
+
+def simulated_chatbot(latency: float = 0.05, error_rate: float = 0.0, seed: Optional[int] = None) -> ChatBot:
+    """建立以模擬 API 驅動之 ChatBot；為模組層級函式，可供工作行程序列化"""
+    return ChatBot(SimulatedAPIHandler(latency, error_rate, seed), ConversationManager())
+
+
+def run_load(
+    target: Callable[[TrafficRecord], str],
+    traffic: List[TrafficRecord],
+    rate: float,
+    count: int,
+    arrival: str = 'poisson',
+    concurrency: int = 256,
+    seed: Optional[int] = None
+) -> LoadReport:
+    """
+    以開環方式施加負載
+
+    請求依預定時刻派送至執行緒池，不待前者完成；池滿時請求於池內排隊，
+    其等候時間計入矯正後延遲。
+
+    參數：
+        target: 受測目標，接受流量記錄並返回結果分類
+        traffic: 流量組合，依序循環重播
+        rate: 到達率（每秒請求數）
+        count: 請求總數
+        arrival: 到達過程，"poisson" 或 "uniform"
+        concurrency: 最大同時請求數
+        seed: 亂數種子
+
+    返回：
+        負載測試報告
+    """
+    offsets = arrival_offsets(rate, count, arrival, seed)
+    results: List[RequestResult] = []
+
+    def execute(record: TrafficRecord, intended: float) -> None:
+        started = time.perf_counter()
+        try:
+            outcome = target(record)
+        except Exception as e:
+            outcome = type(e).__name__
+        results.append(RequestResult(intended, started, time.perf_counter(), outcome, record.priority))
+
+    report = LoadReport(offered_rate=rate, elapsed=0.0, sent=count)
+    start = time.perf_counter() + 0.01
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='loadgen') as pool:
+        for i, offset in enumerate(offsets):
+            intended = start + offset
+            delay = intended - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                report.dispatch_lag = max(report.dispatch_lag, -delay)
+            pool.submit(execute, traffic[i % len(traffic)], intended)
+
+    for result in results:
+        report.outcomes[result.outcome] += 1
+        report.latency.record(result.finished - result.intended)
+        histogram = report.by_priority.get(result.priority)
+        if histogram is None:
+            histogram = report.by_priority[result.priority] = LatencyHistogram()
+        histogram.record(result.finished - result.intended)
+        report.service_time.record(result.finished - result.started)
+    last = max((r.finished for r in results), default=start)
+    report.elapsed = max(last - start, 1e-9)
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """命令行入口點"""
+    parser = argparse.ArgumentParser(description="開環負載產生器")
+    parser.add_argument('--rate', type=float, default=10.0, help="到達率（每秒請求數）")
+    parser.add_argument('--duration', type=float, default=10.0, help="持續秒數")
+    parser.add_argument('--requests', type=int, help="請求總數（優先於 --duration）")
+    parser.add_argument('--arrival', choices=['poisson', 'uniform'], default='poisson', help="到達過程")
+    parser.add_argument('--concurrency', type=int, default=256, help="最大同時請求數")
+    parser.add_argument('--traffic', help="已錄製流量之 JSONL 檔案")
+    parser.add_argument('--users', type=int, default=100, help="合成流量之使用者數")
+    parser.add_argument('--query-ratio', type=float, default=0.2, help="合成流量之查詢比例")
+    parser.add_argument('--batch-ratio', type=float, default=0.0, help="合成流量中批次流量之比例")
+    parser.add_argument('--url', help="服務端點；未指定則於本行程內驅動")
+    parser.add_argument('--live', action='store_true', help="本行程內使用真實 API（需祕鑰）")
+    parser.add_argument('--latency', type=float, default=50.0, help="模擬之平均延遲（毫秒）")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="模擬之失敗比例")
+    parser.add_argument('--deadline', type=float, help="本行程內每則請求之時限（秒）")
+    parser.add_argument('--max-in-flight', type=int, help="本行程內 ChatBot 之入場控制：最大同時處理數")
+    parser.add_argument('--max-queue', type=int, default=64, help="入場控制：佇列最大深度")
+    parser.add_argument('--max-queue-wait', type=float, default=5.0, help="入場控制：最長等候（秒）")
+    parser.add_argument('--scheduler', type=int, metavar='N', help="本行程內以優先序排程提供者呼叫，總名額 N")
+    parser.add_argument('--quota-requests', type=int, help="本行程內每使用者於時窗內之請求上限")
+    parser.add_argument('--quota-tokens', type=int, help="本行程內每使用者於時窗內之權杖上限")
+    parser.add_argument('--quota-window', type=float, default=60.0, help="用量時窗（秒）")
+    parser.add_argument('--workers', type=int, help="以一致性雜湊分片至此數之工作行程（模擬模式）")
+    parser.add_argument('--profile', type=int, metavar='N', help="本行程內剖析前 N 則請求")
+    parser.add_argument('--profile-mode', choices=RequestProfiler.MODES, default='cprofile', help="剖析模式")
+    parser.add_argument('--profile-dir', default='profiles', help="剖析結果之輸出目錄")
+    parser.add_argument('--seed', type=int, help="亂數種子")
+    parser.add_argument('--json', help="將報告以 JSON 寫入此檔案")
+    args = parser.parse_args(argv)
+
+    if args.traffic:
+        traffic = load_traffic(args.traffic)
+    else:
+        traffic = synthetic_traffic(args.users, args.query_ratio, seed=args.seed, batch_ratio=args.batch_ratio)
+
+    router = None
+    scheduler = None
+    profiler = None
+    if args.url:
+        target = HttpTarget(args.url)
+    else:
+        if args.live:
+            from chatbot.config import load_environment_variables
+
+            config = load_environment_variables()
+            api_handler = APIHandler(config['GEMINI_API_KEYS'], config['PERPLEXITY_API_KEYS'])
+        else:
+            api_handler = SimulatedAPIHandler(args.latency / 1000.0, args.error_rate, args.seed)
+        if args.scheduler:
+            scheduler = api_handler.enable_scheduling(args.scheduler)
+        admission = None
+        if args.max_in_flight:
+            admission = AdmissionController(args.max_in_flight, args.max_queue, args.max_queue_wait)
+        if args.workers and not args.live:
+            from chatbot.sharding import ShardedChatBot
+
+            chatbot = router = ShardedChatBot(
+                functools.partial(simulated_chatbot, args.latency / 1000.0, args.error_rate, args.seed),
+                workers=args.workers
+            )
+        else:
+            if args.profile:
+                profiler = RequestProfiler(args.profile_dir, args.profile_mode, args.profile)
+                profiler.start()
+            usage_meter = None
+            if args.quota_requests or args.quota_tokens:
+                usage_meter = UsageMeter(Quota(args.quota_requests, args.quota_tokens), window=args.quota_window)
+            chatbot = ChatBot(
+                api_handler, ConversationManager(),
+                admission=admission, profiler=profiler, usage_meter=usage_meter
+            )
+        target = InProcessTarget(chatbot, args.deadline)
+
+    count = args.requests or max(1, int(args.rate * args.duration))
+    try:
+        report = run_load(target, traffic, args.rate, count, args.arrival, args.concurrency, args.seed)
+    finally:
+        if router is not None:
+            router.close()
+        if profiler is not None:
+            # 請求數少於剖析名額者亦寫出結果
+            profiler.stop()
+    print(report.format())
+    if scheduler is not None:
+        print("排程（各類別）:")
+        for name, stats in scheduler.stats.items():
+            print(
+                f"  {name}: 獲名額={stats.admitted} 拒絕={stats.rejected} 逾時={stats.expired} "
+                f"佇列峰值={stats.peak_queued} 平均等候={stats.mean_wait * 1000:.1f}ms "
+                f"最長等候={stats.max_wait * 1000:.1f}ms"
+            )
+    if args.json:
+        with open(args.json, 'wb') as f:
+            f.write(codec.dumps(report.to_dict(), pretty=True))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+    main()
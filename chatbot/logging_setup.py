@@ -0,0 +1,149 @@
+"""
+非阻塞之結構化日誌
+此乃記錄之驛站，請求執行緒僅將記錄投入佇列，格式化與輸出交由背景執行緒
+
+請求路徑上僅做三事：層級判斷、限流判斷、非阻塞入佇列。佇列滿則丟棄並計數，
+故日誌洪流（如提供者中斷時之錯誤爆發）不致拖慢請求。
+
+用法：
+    listener = setup_logging(logging.INFO)
+    logger.error("Gemini API 呼叫失敗: %s", e, extra={'user': user_id, 'route': 'gemini', 'latency_ms': 812.4})
+    listener.stop()
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from typing import Dict, Optional, TextIO, Tuple
+
+# 自 extra 帶入 JSON 記錄之欄位
+STRUCTURED_FIELDS = ('user', 'route', 'latency_ms', 'provider', 'attempt', 'suppressed')
+
+
+class JsonFormatter(logging.Formatter):
+    """將記錄格式化為單行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for name in STRUCTURED_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    依 (記錄器, 訊息模板) 限流：每鍵以令牌桶放行，超額者丟棄
+    下一筆放行之記錄附 suppressed 欄位，記其間被略去之筆數
+
+    僅作用於 level 以上之記錄；以 %-模板記錄者，同一處之錯誤即同一鍵。
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 10, level: int = logging.WARNING):
+        """
+        參數：
+            rate: 每鍵每秒補充之令牌數
+            burst: 每鍵之令牌上限
+            level: 限流之最低層級
+        """
+        super().__init__()
+        self.rate = rate  # 每秒補充之令牌數
+        self.burst = burst  # 令牌上限
+        self.level = level  # 限流之最低層級
+        self._buckets: Dict[Tuple[str, str], list] = {}  # 鍵 -> [令牌, 上次補充時刻, 略去筆數]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.level:
+            return True
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1.0:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1.0
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    不阻塞之佇列處理器：佇列滿則丟棄並計數
+    不於呼叫者執行緒格式化，%-參數留待背景執行緒展開
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0  # 因佇列滿而丟棄之筆數
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(
+    level: int = logging.INFO,
+    json_format: bool = True,
+    stream: Optional[TextIO] = None,
+    queue_size: int = 10000,
+    error_rate: float = 1.0,
+    error_burst: int = 10
+) -> logging.handlers.QueueListener:
+    """
+    設定根記錄器：記錄經有界佇列交予背景執行緒輸出
+
+    參數：
+        level: 根記錄器層級
+        json_format: 是否輸出 JSON；否則為可讀之單行文字
+        stream: 輸出串流；預設 stderr
+        queue_size: 佇列容量，滿則丟棄
+        error_rate: 警告以上之記錄每處每秒放行數
+        error_burst: 警告以上之記錄每處可連續放行數
+
+    返回：
+        已啟動之 QueueListener；結束前應呼叫其 stop() 以排空佇列
+    """
+    output = logging.StreamHandler(stream or sys.stderr)
+    if json_format:
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(RateLimitFilter(error_rate, error_burst))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    return listener
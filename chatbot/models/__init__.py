@@ -3,6 +3,10 @@
 此乃資料之形態
 """
 
-from .conversation import ConversationManager, Message
+from .conversation import ConversationManager, Message, TierStats
+from .shared import SharedConversationManager
+from .snapshot import SnapshotReader, write_snapshot
+from .usage import Quota, Usage, UsageMeter, UsageTotals
 
-__all__ = ['ConversationManager', 'Message']
+__all__ = ['ConversationManager', 'Message', 'TierStats', 'SharedConversationManager', 'SnapshotReader', 'write_snapshot',
+           'Quota', 'Usage', 'UsageMeter', 'UsageTotals']
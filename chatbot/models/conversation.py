@@ -3,9 +3,17 @@
 此乃對話之記錄，承前啟後
 """
 
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Set
+
+from .snapshot import SnapshotReader, write_snapshot
+from .storage import get_codec, pack_history, unpack_history
 
 
 @dataclass
@@ -18,34 +26,265 @@ class Message:
     source: str  # 來源："user", "gemini", "perplexity"
 
 
+@dataclass
+class TierStats:
+    """冷熱分層統計"""
+    hot_users: int = 0  # 熱層使用者數
+    cold_users: int = 0  # 冷層使用者數（含溢寫至磁碟者）
+    spilled_users: int = 0  # 溢寫至磁碟之使用者數
+    cold_bytes: int = 0  # 冷層於記憶體中之壓縮位元組數
+    snapshot_users: int = 0  # 延遲載入之快照中之使用者數
+    demotions: int = 0  # 降層次數
+    promotions: int = 0  # 升層次數
+
+
 @dataclass
 class ConversationManager:
     """
     管理每個使用者的對話歷史
     限制為 2 個回合（4 條訊息）
+
+    可選冷熱分層：近期活躍者之歷史留於熱層（conversations），
+    閒置逾 idle_seconds 或超出 hot_capacity 之最久未用者降至冷層，
+    以壓縮位元組存於記憶體，或設 cold_dir 則溢寫至磁碟；下次取用時透明升回熱層。
+
+    snapshot() 與 restore() 將全部對話封存至二進位快照並復原；
+    延遲復原時，快照中之使用者於首次取用時方解碼。
     """
 
     max_exchanges: int = 2  # 最大回合數
-    conversations: Dict[str, List[str]] = field(default_factory=dict)  # 對話錄
+    conversations: Dict[str, List[str]] = field(default_factory=dict)  # 對話錄（熱層）
+    hot_capacity: Optional[int] = None  # 熱層最多使用者數；None 則不限
+    idle_seconds: Optional[float] = None  # 閒置逾此秒數即降層；None 則不依閒置
+    cold_dir: Optional[str] = None  # 冷層溢寫之目錄；None 則留於記憶體
+    compression: str = 'zlib'  # 冷層壓縮法："zlib"、"zstd" 或 "none"
+    cold: Dict[str, bytes] = field(default_factory=dict, repr=False)  # 冷層：壓縮之歷史
+    stats: TierStats = field(default_factory=TierStats, repr=False)  # 分層統計
+
+    def __post_init__(self):
+        if self.hot_capacity is not None and self.hot_capacity < 1:
+            raise ValueError("hot_capacity 須至少為 1")
+        if self.idle_seconds is not None and self.idle_seconds <= 0:
+            raise ValueError("idle_seconds 須為正數")
+        self._last_access: "OrderedDict[str, float]" = OrderedDict()  # 熱層使用者之最近取用時刻
+        self._spilled: Set[str] = set()  # 溢寫至磁碟之使用者；檔案路徑由使用者識別導出
+        self._snapshot: Optional[SnapshotReader] = None  # 延遲載入之快照
+        self._snapshot_removed: Set[str] = set()  # 已清除而不應自快照復原之使用者
+        self._lock = threading.RLock()
+        self._compress, self._decompress = get_codec(self.compression)
+        if self.cold_dir:
+            os.makedirs(self.cold_dir, exist_ok=True)
 
     @property
     def max_messages(self) -> int:
         """計算最大訊息數"""
         return self.max_exchanges * 2
 
+    @property
+    def tiering(self) -> bool:
+        """是否啟用冷熱分層"""
+        return self.hot_capacity is not None or self.idle_seconds is not None
+
     def add_message(self, user_id: str, content: str) -> None:
         """新增訊息到使用者的對話歷史"""
-        if user_id not in self.conversations:
-            self.conversations[user_id] = []
-        self.conversations[user_id].append(content)
-        # 超過上限時移除最舊訊息
-        if len(self.conversations[user_id]) > self.max_messages:
-            self.conversations[user_id] = self.conversations[user_id][-self.max_messages:]
+        with self._lock:
+            self._promote(user_id)
+            if user_id not in self.conversations:
+                self.conversations[user_id] = []
+            self.conversations[user_id].append(content)
+            # 超過上限時移除最舊訊息
+            if len(self.conversations[user_id]) > self.max_messages:
+                self.conversations[user_id] = self.conversations[user_id][-self.max_messages:]
+            if self.tiering:
+                self._touch(user_id)
+                self._enforce_tiers(keep=user_id)
 
     def get_history(self, user_id: str) -> List[str]:
         """取得使用者的對話歷史"""
-        return self.conversations.get(user_id, [])
+        with self._lock:
+            if self._promote(user_id) and self.tiering:
+                self._touch(user_id)
+                self._enforce_tiers(keep=user_id)
+            elif user_id in self.conversations and self.tiering:
+                self._touch(user_id)
+            return self.conversations.get(user_id, [])
 
     def clear_history(self, user_id: str) -> None:
         """清除使用者的對話歷史"""
-        self.conversations.pop(user_id, None)
+        with self._lock:
+            self.conversations.pop(user_id, None)
+            self._last_access.pop(user_id, None)
+            blob = self.cold.pop(user_id, None)
+            if blob is not None:
+                self.stats.cold_bytes -= len(blob)
+            if user_id in self._spilled:
+                self._spilled.discard(user_id)
+                self._remove_file(self._spill_path(user_id))
+            if self._snapshot is not None:
+                self._snapshot_removed.add(user_id)
+
+    def users(self) -> List[str]:
+        """列出所有持有歷史之使用者（含冷層與尚未載入之快照）"""
+        with self._lock:
+            users = list(self.conversations) + list(self.cold) + list(self._spilled)
+            if self._snapshot is not None:
+                present = set(users) | self._snapshot_removed
+                users.extend(u for u in self._snapshot.user_ids() if u not in present)
+            return users
+
+    def snapshot(self, path: str) -> int:
+        """
+        將全部對話（含冷層與尚未載入之快照）原子地寫入快照
+
+        參數：
+            path: 快照路徑
+
+        返回：
+            寫入之使用者數
+        """
+        with self._lock:
+            items = [(user_id, list(history)) for user_id, history in self.conversations.items()]
+            for user_id, blob in self.cold.items():
+                items.append((user_id, unpack_history(self._decompress(blob))[0]))
+            for user_id in self._spilled:
+                with open(self._spill_path(user_id), 'rb') as f:
+                    items.append((user_id, unpack_history(self._decompress(f.read()))[0]))
+            if self._snapshot is not None:
+                present = set(self.conversations) | set(self.cold) | set(self._spilled) | self._snapshot_removed
+                items.extend(item for item in self._snapshot.items() if item[0] not in present)
+        return write_snapshot(path, items)
+
+    def restore(self, path: str, lazy: bool = True, verify: bool = True) -> int:
+        """
+        自快照復原對話；已在記憶體中之使用者不受覆蓋
+
+        參數：
+            path: 快照路徑
+            lazy: 是否延遲解碼（以 mmap 映射，使用者於首次取用時方載入）
+            verify: 是否驗證整檔之檢查碼
+
+        返回：
+            快照中之使用者數
+
+        異常：
+            SnapshotError: 快照毀損或版本不符
+        """
+        reader = SnapshotReader(path, verify=verify)
+        with self._lock:
+            if self._snapshot is not None:
+                self._snapshot.close()
+                self._snapshot = None
+            self._snapshot_removed.clear()
+            if lazy:
+                self._snapshot = reader
+                return len(reader)
+            for user_id, history in reader.items():
+                if user_id not in self.conversations and user_id not in self.cold and user_id not in self._spilled:
+                    self.conversations[user_id] = history
+                    if self.tiering:
+                        self._touch(user_id)
+            if self.tiering:
+                self._enforce_tiers()
+        reader.close()
+        return len(reader)
+
+    def demote_idle(self, now: Optional[float] = None) -> int:
+        """
+        將閒置或超額之熱層使用者降至冷層
+
+        參數：
+            now: 當前時刻（time.monotonic() 之刻度）
+
+        返回：
+            降層之使用者數
+        """
+        with self._lock:
+            return self._enforce_tiers(now)
+
+    def tier_stats(self) -> TierStats:
+        """取得分層統計之快照"""
+        with self._lock:
+            self.stats.hot_users = len(self.conversations)
+            self.stats.cold_users = len(self.cold) + len(self._spilled)
+            self.stats.spilled_users = len(self._spilled)
+            self.stats.snapshot_users = len(self._snapshot) if self._snapshot is not None else 0
+            return TierStats(**vars(self.stats))
+
+    def _touch(self, user_id: str) -> None:
+        """記錄熱層使用者之取用時刻"""
+        self._last_access[user_id] = time.monotonic()
+        self._last_access.move_to_end(user_id)
+
+    def _enforce_tiers(self, now: Optional[float] = None, keep: Optional[str] = None) -> int:
+        """自最久未用者起降層，直至熱層不超額且無閒置者；keep 為正在取用之使用者，不予降層"""
+        now = time.monotonic() if now is None else now
+        demoted = 0
+        while self._last_access:
+            user_id, last = next(iter(self._last_access.items()))
+            if user_id == keep:
+                # 正在取用者方才記錄，居於最末；輪至其時餘者皆已處理
+                break
+            over_capacity = self.hot_capacity is not None and len(self._last_access) > self.hot_capacity
+            idle = self.idle_seconds is not None and now - last >= self.idle_seconds
+            if not (over_capacity or idle):
+                break
+            self._demote(user_id)
+            demoted += 1
+        return demoted
+
+    def _demote(self, user_id: str) -> None:
+        """將使用者自熱層移至冷層"""
+        del self._last_access[user_id]
+        history = self.conversations.pop(user_id, None)
+        if history is None:
+            return
+        blob = self._compress(pack_history(history))
+        if self.cold_dir:
+            with open(self._spill_path(user_id), 'wb') as f:
+                f.write(blob)
+            self._spilled.add(user_id)
+        else:
+            self.cold[user_id] = blob
+            self.stats.cold_bytes += len(blob)
+        self.stats.demotions += 1
+
+    def _promote(self, user_id: str) -> bool:
+        """若使用者在冷層，解壓並移回熱層；返回是否升層"""
+        if user_id in self.conversations:
+            return False
+        blob = self.cold.pop(user_id, None)
+        if blob is not None:
+            self.stats.cold_bytes -= len(blob)
+        elif user_id in self._spilled:
+            self._spilled.discard(user_id)
+            path = self._spill_path(user_id)
+            with open(path, 'rb') as f:
+                blob = f.read()
+            self._remove_file(path)
+        else:
+            return self._load_from_snapshot(user_id)
+        self.conversations[user_id], _ = unpack_history(self._decompress(blob))
+        self.stats.promotions += 1
+        return True
+
+    def _load_from_snapshot(self, user_id: str) -> bool:
+        """若使用者在延遲載入之快照中，解碼至熱層；返回是否載入"""
+        if self._snapshot is None or user_id in self._snapshot_removed:
+            return False
+        history = self._snapshot.get(user_id)
+        if history is None:
+            return False
+        self.conversations[user_id] = history
+        self._snapshot_removed.add(user_id)  # 此後以記憶體中者為準
+        return True
+
+    def _spill_path(self, user_id: str) -> str:
+        """使用者溢寫之檔案路徑"""
+        return os.path.join(self.cold_dir, hashlib.sha1(user_id.encode('utf-8', 'surrogatepass')).hexdigest())
+
+    @staticmethod
+    def _remove_file(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,267 @@
+"""
+共享記憶體之對話儲存
+此乃眾行程共用之記錄，預先 fork 之工作者皆可服務任一使用者，不需黏著路由
+
+佈局（小端序），位於一塊 multiprocessing.shared_memory 中：
+    標頭    每分段之驅逐次數 u64 × stripes
+    槽位    slots 個定長槽位，均分為 stripes 段；每段各有一把跨行程鎖
+            槽頭    狀態 u8 | 保留 u8 | 使用者長度 u16 | 環首 u16 | 訊息數 u16 | 雜湊 u64 | 最近取用 f64（time.monotonic()，各行程同一時鐘）
+            使用者  max_user_bytes 位元組之 UTF-8
+            環形緩衝 max_messages 則，每則為 長度 u32 | max_message_bytes 位元組之 UTF-8
+
+使用者依雜湊定其分段，於段內以線性探測定址；段滿則驅逐段內最久未用者。
+逾 max_message_bytes 之訊息於 UTF-8 字元邊界截斷。
+"""
+
+import hashlib
+import multiprocessing
+import struct
+import sys
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import List, Optional, Tuple
+
+_SLOT = struct.Struct('<BxHHHQd')  # 槽頭
+_LENGTH = struct.Struct('<I')  # 單則訊息之位元組數
+_COUNTER = struct.Struct('<Q')  # 驅逐次數
+
+_EMPTY = 0  # 未曾使用
+_USED = 1  # 使用中
+_DELETED = 2  # 已清除（探測時不中斷）
+
+_attach_lock = threading.Lock()
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """
+    附掛既有之共享記憶體，不向本行程之 resource_tracker 登記
+
+    登記者於其追蹤行程結束時 unlink 該段，故僅建立者應登記。Python 3.13 起以 track=False 略過；
+    此前附掛亦必登記，而事後 unregister 會連同建立者之登記一併除去（子行程與父行程共用追蹤行程），
+    故附掛期間略過該段之登記。
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    with _attach_lock:
+        register = resource_tracker.register
+
+        def skip_own(resource: str, rtype: str) -> None:
+            if rtype != 'shared_memory' or resource.lstrip('/') != name.lstrip('/'):
+                register(resource, rtype)
+
+        resource_tracker.register = skip_own
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+def _truncate_utf8(data: bytes, limit: int) -> bytes:
+    """於 UTF-8 字元邊界截斷至 limit 位元組以內"""
+    if len(data) <= limit:
+        return data
+    while limit > 0 and (data[limit] & 0xC0) == 0x80:
+        limit -= 1
+    return data[:limit]
+
+
+class SharedConversationManager:
+    """
+    以共享記憶體為底之對話歷史管理，介面同 ConversationManager
+
+    於父行程建立後再 fork 工作者，或作為參數傳予 multiprocessing.Process，
+    各行程即共用同一份對話。建立者負責 unlink()。
+    """
+
+    def __init__(
+        self,
+        max_exchanges: int = 2,
+        slots: int = 4096,
+        stripes: int = 64,
+        max_user_bytes: int = 64,
+        max_message_bytes: int = 2048,
+        name: Optional[str] = None,
+        start_method: Optional[str] = None
+    ):
+        """
+        參數：
+            max_exchanges: 最大回合數
+            slots: 槽位總數，即可同時保存之使用者數上限
+            stripes: 分段數（每段一把鎖）；須整除 slots
+            max_user_bytes: 使用者識別之最大位元組數
+            max_message_bytes: 單則訊息之最大位元組數，逾者截斷
+            name: 共享記憶體名稱；None 則自動命名
+            start_method: 工作行程之啟動方式（"fork"、"spawn"、"forkserver"），鎖須與之同源；None 取平台預設
+
+        異常：
+            ValueError: slots 不能為 stripes 整除
+        """
+        if slots <= 0 or stripes <= 0 or slots % stripes:
+            raise ValueError(f"slots ({slots}) 須為 stripes ({stripes}) 之正整數倍")
+        self.max_exchanges = max_exchanges  # 最大回合數
+        self.slots = slots  # 槽位總數
+        self.stripes = stripes  # 分段數
+        self.max_user_bytes = max_user_bytes  # 使用者識別之最大位元組數
+        self.max_message_bytes = max_message_bytes  # 單則訊息之最大位元組數
+        self.slot_size = _SLOT.size + max_user_bytes + self.max_messages * (_LENGTH.size + max_message_bytes)  # 每槽位元組數
+        self._header_size = stripes * _COUNTER.size
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=self._header_size + slots * self.slot_size)
+        context = multiprocessing.get_context(start_method)
+        self._locks = [context.Lock() for _ in range(stripes)]
+
+    @property
+    def max_messages(self) -> int:
+        """計算最大訊息數"""
+        return self.max_exchanges * 2
+
+    @property
+    def name(self) -> str:
+        """共享記憶體名稱"""
+        return self._shm.name
+
+    @property
+    def evictions(self) -> int:
+        """因段滿而驅逐之使用者數（跨行程累計）"""
+        buf = self._shm.buf
+        return sum(_COUNTER.unpack_from(buf, i * _COUNTER.size)[0] for i in range(self.stripes))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shm'] = self._shm.name
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._shm = _attach(state['_shm'])
+
+    def _locate(self, user_id: str) -> Tuple[bytes, int, int]:
+        """返回 (使用者位元組, 雜湊, 分段)"""
+        key = user_id.encode('utf-8', 'surrogatepass')
+        if len(key) > self.max_user_bytes:
+            raise ValueError(f"使用者識別過長: {len(key)} > {self.max_user_bytes} 位元組")
+        digest = hashlib.blake2b(key, digest_size=8).digest()
+        user_hash = int.from_bytes(digest, 'little')
+        return key, user_hash, user_hash % self.stripes
+
+    def _slot_offset(self, index: int) -> int:
+        return self._header_size + index * self.slot_size
+
+    def _find(self, key: bytes, user_hash: int, stripe: int, insert: bool) -> Tuple[Optional[int], bool]:
+        """
+        於分段內線性探測（須持有該段之鎖）
+
+        返回：
+            (槽位索引, 是否已存在)；不插入且未找到時為 (None, False)
+        """
+        buf = self._shm.buf
+        per_stripe = self.slots // self.stripes
+        base = stripe * per_stripe
+        start = (user_hash // self.stripes) % per_stripe
+        free = None
+        for i in range(per_stripe):
+            index = base + (start + i) % per_stripe
+            offset = self._slot_offset(index)
+            state, user_length, _, _, slot_hash, _ = _SLOT.unpack_from(buf, offset)
+            if state == _EMPTY:
+                if free is None:
+                    free = index
+                break
+            if state == _DELETED:
+                if free is None:
+                    free = index
+                continue
+            if slot_hash == user_hash and buf[offset + _SLOT.size:offset + _SLOT.size + user_length] == key:
+                return index, True
+        if not insert:
+            return None, False
+        if free is None:
+            free = self._evict(base, per_stripe, stripe)
+        return free, False
+
+    def _evict(self, base: int, per_stripe: int, stripe: int) -> int:
+        """驅逐段內最久未用之使用者，返回其槽位"""
+        buf = self._shm.buf
+        victim = min(
+            range(base, base + per_stripe),
+            key=lambda index: _SLOT.unpack_from(buf, self._slot_offset(index))[5]
+        )
+        counter_offset = stripe * _COUNTER.size
+        _COUNTER.pack_into(buf, counter_offset, _COUNTER.unpack_from(buf, counter_offset)[0] + 1)
+        return victim
+
+    def _entry_offset(self, slot_offset: int, position: int) -> int:
+        return slot_offset + _SLOT.size + self.max_user_bytes + position * (_LENGTH.size + self.max_message_bytes)
+
+    def add_message(self, user_id: str, content: str) -> None:
+        """新增訊息到使用者的對話歷史；超過上限時覆寫最舊訊息"""
+        key, user_hash, stripe = self._locate(user_id)
+        data = _truncate_utf8(content.encode('utf-8', 'surrogatepass'), self.max_message_bytes)
+        buf = self._shm.buf
+        with self._locks[stripe]:
+            index, found = self._find(key, user_hash, stripe, insert=True)
+            offset = self._slot_offset(index)
+            if found:
+                _, _, head, count, _, _ = _SLOT.unpack_from(buf, offset)
+            else:
+                head, count = 0, 0
+                buf[offset + _SLOT.size:offset + _SLOT.size + len(key)] = key
+            if count < self.max_messages:
+                position = (head + count) % self.max_messages
+                count += 1
+            else:
+                position = head
+                head = (head + 1) % self.max_messages
+            entry = self._entry_offset(offset, position)
+            _LENGTH.pack_into(buf, entry, len(data))
+            buf[entry + _LENGTH.size:entry + _LENGTH.size + len(data)] = data
+            _SLOT.pack_into(buf, offset, _USED, len(key), head, count, user_hash, time.monotonic())
+
+    def get_history(self, user_id: str) -> List[str]:
+        """取得使用者的對話歷史（副本）"""
+        key, user_hash, stripe = self._locate(user_id)
+        buf = self._shm.buf
+        with self._locks[stripe]:
+            index, found = self._find(key, user_hash, stripe, insert=False)
+            if not found:
+                return []
+            offset = self._slot_offset(index)
+            state, user_length, head, count, _, _ = _SLOT.unpack_from(buf, offset)
+            history = []
+            for i in range(count):
+                entry = self._entry_offset(offset, (head + i) % self.max_messages)
+                (length,) = _LENGTH.unpack_from(buf, entry)
+                history.append(bytes(buf[entry + _LENGTH.size:entry + _LENGTH.size + length]).decode('utf-8', 'surrogatepass'))
+            _SLOT.pack_into(buf, offset, state, user_length, head, count, user_hash, time.monotonic())
+        return history
+
+    def clear_history(self, user_id: str) -> None:
+        """清除使用者的對話歷史"""
+        key, user_hash, stripe = self._locate(user_id)
+        buf = self._shm.buf
+        with self._locks[stripe]:
+            index, found = self._find(key, user_hash, stripe, insert=False)
+            if found:
+                _SLOT.pack_into(buf, self._slot_offset(index), _DELETED, 0, 0, 0, 0, 0.0)
+
+    def users(self) -> List[str]:
+        """列出所有持有歷史之使用者"""
+        buf = self._shm.buf
+        per_stripe = self.slots // self.stripes
+        users = []
+        for stripe in range(self.stripes):
+            with self._locks[stripe]:
+                for index in range(stripe * per_stripe, (stripe + 1) * per_stripe):
+                    offset = self._slot_offset(index)
+                    state, user_length, _, _, _, _ = _SLOT.unpack_from(buf, offset)
+                    if state == _USED:
+                        users.append(bytes(buf[offset + _SLOT.size:offset + _SLOT.size + user_length]).decode('utf-8', 'surrogatepass'))
+        return users
+
+    def close(self) -> None:
+        """解除本行程之映射"""
+        self._shm.close()
+
+    def unlink(self) -> None:
+        """釋放共享記憶體（僅建立者應呼叫）"""
+        self._shm.unlink()
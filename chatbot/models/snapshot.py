@@ -0,0 +1,218 @@
+"""
+對話狀態之二進位快照
+此乃停機前之封存、啟動後之復原，令滾動部署不失前文
+
+檔案格式（小端序）：
+    標頭    magic(8) | 版本 u16 | 保留 u16 | 使用者數 u64 | 索引位置 u64
+    記錄    依使用者雜湊排序；每筆為 使用者長度 u32 | 使用者 UTF-8 | 歷史（見 storage.pack_history）
+    索引    雜湊 u64 × N，其後記錄位置 u64 × N
+    檢查碼  CRC32 u32，涵蓋其前之全部內容
+
+寫入經暫存檔與 rename 完成，故讀者所見非舊即新，不見半成之檔；記錄逐筆寫入，峰值記憶體不隨檔案倍增。
+讀取以 mmap 映射，僅查索引，歷史於取用時方解碼。
+"""
+
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from chatbot.exceptions import SnapshotError
+from .storage import pack_history, unpack_history
+
+MAGIC = b'CBSNAP\x00\x01'  # 檔案標識
+VERSION = 1  # 格式版本
+
+_HEADER = struct.Struct('<8sHHQQ')
+_USER_LENGTH = struct.Struct('<I')
+_U64 = struct.Struct('<Q')
+_CRC = struct.Struct('<I')
+_CRC_BLOCK = 1 << 16  # 計算檢查碼時每次讀回之位元組數
+
+
+def user_hash(user_id: str) -> int:
+    """使用者識別之 64 位元雜湊"""
+    digest = hashlib.blake2b(user_id.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    return _U64.unpack(digest)[0]
+
+
+def write_snapshot(path: str, items: Iterable[Tuple[str, List[str]]]) -> int:
+    """
+    原子地寫入快照
+
+    參數：
+        path: 目標路徑
+        items: (使用者, 對話歷史) 之序列
+
+    返回：
+        寫入之使用者數
+    """
+    # 僅排序雜湊與歷史之參照；記錄逐筆編碼寫入，不於記憶體中另組整檔
+    records = sorted(
+        ((user_hash(user_id), user_id, history) for user_id, history in items), key=lambda record: record[:2]
+    )
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.snapshot-', dir=directory)
+    try:
+        with os.fdopen(fd, 'w+b') as f:
+            # 標頭之索引位置待記錄寫畢方知，先留其位
+            f.seek(_HEADER.size)
+            offsets = []
+            for _, user_id, history in records:
+                offsets.append(f.tell())
+                user = user_id.encode('utf-8', 'surrogatepass')
+                f.write(_USER_LENGTH.pack(len(user)))
+                f.write(user)
+                f.write(pack_history(history))
+            index_offset = f.tell()
+            f.write(struct.pack(f'<{len(records)}Q', *(h for h, _, _ in records)))
+            f.write(struct.pack(f'<{len(records)}Q', *offsets))
+            f.seek(0)
+            f.write(_HEADER.pack(MAGIC, VERSION, 0, len(records), index_offset))
+            # 檢查碼涵蓋標頭，故於補上標頭後分塊讀回計算
+            f.seek(0)
+            crc = 0
+            block = memoryview(bytearray(_CRC_BLOCK))
+            while True:
+                read = f.readinto(block)
+                if not read:
+                    break
+                crc = zlib.crc32(block[:read], crc)
+            f.write(_CRC.pack(crc))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    _fsync_directory(directory)
+    return len(records)
+
+
+def _fsync_directory(directory: str) -> None:
+    """令 rename 落盤（不支援之平台略過）"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class _U64Array:
+    """以 mmap 為底之 u64 唯讀序列，供 bisect 查找"""
+
+    def __init__(self, buffer, offset: int, length: int):
+        self._buffer = buffer
+        self._offset = offset
+        self._length = length
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index: int) -> int:
+        return _U64.unpack_from(self._buffer, self._offset + index * 8)[0]
+
+
+class SnapshotReader:
+    """
+    以 mmap 讀取快照；開啟時僅驗證檢查碼與標頭，歷史於查詢時方解碼
+    """
+
+    def __init__(self, path: str, verify: bool = True):
+        """
+        參數：
+            path: 快照路徑
+            verify: 是否驗證整檔之 CRC32
+
+        異常：
+            SnapshotError: 檔案毀損或版本不符
+        """
+        self.path = path  # 快照路徑
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < _HEADER.size + _CRC.size:
+                raise SnapshotError(f"快照過短: {path}")
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, _, count, index_offset = _HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC:
+                raise SnapshotError(f"非快照檔案: {path}")
+            if version != VERSION:
+                raise SnapshotError(f"不支援之快照版本: {version}")
+            if index_offset + count * 16 + _CRC.size != size:
+                raise SnapshotError(f"快照長度不符: {path}")
+            if verify:
+                (expected,) = _CRC.unpack_from(self._mm, size - _CRC.size)
+                if zlib.crc32(memoryview(self._mm)[:size - _CRC.size]) != expected:
+                    raise SnapshotError(f"快照檢查碼不符: {path}")
+        except Exception:
+            self._mm.close()
+            raise
+        self.count = count  # 使用者數
+        self._hashes = _U64Array(self._mm, index_offset, count)
+        self._offsets = _U64Array(self._mm, index_offset + count * 8, count)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _read_record(self, offset: int) -> Tuple[str, int]:
+        """讀取記錄之使用者，返回 (使用者, 歷史之位置)"""
+        (length,) = _USER_LENGTH.unpack_from(self._mm, offset)
+        start = offset + _USER_LENGTH.size
+        user_id = self._mm[start:start + length].decode('utf-8', 'surrogatepass')
+        return user_id, start + length
+
+    def get(self, user_id: str) -> Optional[List[str]]:
+        """
+        查詢使用者之歷史
+
+        參數：
+            user_id: 使用者識別
+
+        返回：
+            對話歷史；不在快照中則為 None
+        """
+        target = user_hash(user_id)
+        index = bisect.bisect_left(self._hashes, target)
+        while index < self.count and self._hashes[index] == target:
+            found, history_offset = self._read_record(self._offsets[index])
+            if found == user_id:
+                return unpack_history(self._mm, history_offset)[0]
+            index += 1
+        return None
+
+    def items(self) -> Iterator[Tuple[str, List[str]]]:
+        """依序產出全部 (使用者, 對話歷史)"""
+        offset = _HEADER.size
+        for _ in range(self.count):
+            user_id, history_offset = self._read_record(offset)
+            history, offset = unpack_history(self._mm, history_offset)
+            yield user_id, history
+
+    def user_ids(self) -> Iterator[str]:
+        """依序產出全部使用者，不解碼歷史"""
+        offset = _HEADER.size
+        for _ in range(self.count):
+            user_id, history_offset = self._read_record(offset)
+            (count,) = struct.unpack_from('<H', self._mm, history_offset)
+            offset = history_offset + 2
+            for _ in range(count):
+                (length,) = _USER_LENGTH.unpack_from(self._mm, offset)
+                offset += _USER_LENGTH.size + length
+            yield user_id
+
+    def close(self) -> None:
+        """解除映射"""
+        self._mm.close()
@@ -0,0 +1,80 @@
+"""
+對話歷史之緊湊編碼
+此乃存藏之法，以長度前綴之位元組承載歷史，並可壓縮
+"""
+
+import struct
+import zlib
+from typing import Callable, List, Tuple
+
+_COUNT = struct.Struct('<H')  # 訊息數
+_LENGTH = struct.Struct('<I')  # 單則訊息之位元組數
+
+
+def pack_history(history: List[str]) -> bytes:
+    """
+    將對話歷史編為位元組
+
+    格式：訊息數（u16），其後每則為長度（u32）與 UTF-8 內容。
+
+    參數：
+        history: 對話歷史
+
+    返回：
+        編碼後之位元組
+    """
+    parts = [_COUNT.pack(len(history))]
+    for message in history:
+        data = message.encode('utf-8', 'surrogatepass')
+        parts.append(_LENGTH.pack(len(data)))
+        parts.append(data)
+    return b''.join(parts)
+
+
+def unpack_history(buffer, offset: int = 0) -> Tuple[List[str], int]:
+    """
+    自位元組解出對話歷史
+
+    參數：
+        buffer: 位元組或支援緩衝區協定之物件（如 mmap）
+        offset: 起始位置
+
+    返回：
+        (對話歷史, 結束位置)
+    """
+    (count,) = _COUNT.unpack_from(buffer, offset)
+    offset += _COUNT.size
+    history = []
+    for _ in range(count):
+        (length,) = _LENGTH.unpack_from(buffer, offset)
+        offset += _LENGTH.size
+        history.append(bytes(buffer[offset:offset + length]).decode('utf-8', 'surrogatepass'))
+        offset += length
+    return history, offset
+
+
+def get_codec(name: str) -> Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]:
+    """
+    取得壓縮與解壓函式
+
+    參數：
+        name: "zlib"、"zstd"（需安裝 zstandard）或 "none"
+
+    返回：
+        (壓縮函式, 解壓函式)
+
+    異常：
+        ValueError: 未知之壓縮法
+        ImportError: 選用 zstd 而未安裝 zstandard
+    """
+    if name == 'zlib':
+        return (lambda data: zlib.compress(data, 6)), zlib.decompress
+    if name == 'zstd':
+        import zstandard
+
+        compressor = zstandard.ZstdCompressor(level=3)
+        decompressor = zstandard.ZstdDecompressor()
+        return compressor.compress, decompressor.decompress
+    if name == 'none':
+        return bytes, bytes
+    raise ValueError(f"未知之壓縮法: {name}")
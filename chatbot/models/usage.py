@@ -0,0 +1,244 @@
+"""
+每使用者之用量計量
+此乃用度之帳簿，以滾動時窗記各使用者之請求數與權杖數，並據以限額
+
+每位使用者僅存一組定長之桶（請求數、輸入權杖、輸出權杖，各為 u32），時窗滑動時清空過期之桶並自合計扣除，
+故查詢與記帳皆為常數時間；預設 12 桶者每人約 150 位元組之桶。
+時窗內已無用量之使用者於記帳時順帶回收（每滑過一桶至多掃描一次），亦可以 prune() 即時回收。
+"""
+
+import threading
+import time
+from array import array
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from chatbot.exceptions import QuotaExceededError
+
+
+@dataclass(frozen=True)
+class Usage:
+    """單次提供者呼叫之用量"""
+    provider: str  # 提供者："gemini"、"perplexity"
+    input_tokens: int = 0  # 輸入權杖數
+    output_tokens: int = 0  # 輸出權杖數
+
+
+@dataclass
+class UsageTotals:
+    """時窗內之用量合計"""
+    requests: int = 0  # 請求數
+    input_tokens: int = 0  # 輸入權杖數
+    output_tokens: int = 0  # 輸出權杖數
+
+    @property
+    def tokens(self) -> int:
+        """權杖總數"""
+        return self.input_tokens + self.output_tokens
+
+
+@dataclass(frozen=True)
+class Quota:
+    """時窗內之限額；None 則不限"""
+    max_requests: Optional[int] = None  # 最大請求數
+    max_tokens: Optional[int] = None  # 最大權杖數（輸入與輸出合計）
+
+
+class _Window:
+    """單一使用者之滾動時窗：三列環形之桶與其合計"""
+
+    __slots__ = ('buckets', 'totals', 'head')
+
+    def __init__(self, size: int, head: int):
+        self.buckets = array('I', [0]) * (3 * size)  # [請求數 × size, 輸入 × size, 輸出 × size]
+        self.totals = [0, 0, 0]  # 各列之合計
+        self.head = head  # 最新之桶序號（時間 // 桶寬）
+
+
+class UsageMeter:
+    """
+    以滾動時窗計量各使用者之用量，並於呼叫提供者前檢查限額
+    """
+
+    def __init__(
+        self,
+        quota: Optional[Quota] = None,
+        window: float = 3600.0,
+        buckets: int = 12,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        參數：
+            quota: 每使用者之限額；None 則僅計量
+            window: 時窗長度（秒）
+            buckets: 時窗分桶數；愈多則滑動愈平順
+            clock: 時鐘
+        """
+        self.quota = quota  # 每使用者之限額
+        self.window = window  # 時窗長度（秒）
+        self.buckets = buckets  # 分桶數
+        self.overrides: Dict[str, Quota] = {}  # 個別使用者之限額
+        self.rejected = 0  # 因超額而拒絕之請求數
+        self._width = window / buckets
+        self._clock = clock
+        self._windows: Dict[str, _Window] = {}
+        self._swept = self._bucket()  # 最近一次回收閒置者時之桶序號
+        self._lock = threading.Lock()
+
+    def _bucket(self) -> int:
+        return int(self._clock() // self._width)
+
+    def _advance(self, user_id: str, now: int, create: bool) -> Optional[_Window]:
+        """取得使用者之時窗，並清空已滑出之桶"""
+        window = self._windows.get(user_id)
+        if window is None:
+            if not create:
+                return None
+            window = self._windows[user_id] = _Window(self.buckets, now)
+            return window
+        steps = now - window.head
+        if steps <= 0:
+            return window
+        size = self.buckets
+        if steps >= size:
+            window.buckets = array('I', [0]) * (3 * size)
+            window.totals = [0, 0, 0]
+        else:
+            for bucket in range(window.head + 1, now + 1):
+                slot = bucket % size
+                for row in range(3):
+                    index = row * size + slot
+                    window.totals[row] -= window.buckets[index]
+                    window.buckets[index] = 0
+        window.head = now
+        return window
+
+    def _add(self, user_id: str, requests: int, input_tokens: int, output_tokens: int) -> None:
+        now = self._bucket()
+        if now != self._swept:
+            # 桶已滑動：順帶回收閒置者，免計量器隨曾來之使用者無限增長
+            self._sweep(now)
+        window = self._advance(user_id, now, create=True)
+        slot = now % self.buckets
+        for row, amount in enumerate((requests, input_tokens, output_tokens)):
+            if amount:
+                window.buckets[row * self.buckets + slot] += amount
+                window.totals[row] += amount
+
+    def quota_for(self, user_id: str) -> Optional[Quota]:
+        """使用者適用之限額"""
+        return self.overrides.get(user_id, self.quota)
+
+    def admit(self, user_id: str) -> None:
+        """
+        檢查限額，未超額則計入一次請求；其後遭拒而未呼叫提供者者以 refund() 退還
+
+        參數：
+            user_id: 使用者識別
+
+        異常：
+            QuotaExceededError: 時窗內之請求數或權杖數已達限額
+        """
+        quota = self.quota_for(user_id)
+        with self._lock:
+            if quota is not None:
+                window = self._advance(user_id, self._bucket(), create=False)
+                if window is not None:
+                    requests, input_tokens, output_tokens = window.totals
+                    exceeded = None
+                    if quota.max_requests is not None and requests >= quota.max_requests:
+                        exceeded = f"請求數已達 {quota.max_requests}"
+                    elif quota.max_tokens is not None and input_tokens + output_tokens >= quota.max_tokens:
+                        exceeded = f"權杖數已達 {quota.max_tokens}"
+                    if exceeded:
+                        self.rejected += 1
+                        raise QuotaExceededError(
+                            f"使用者 {user_id} 之{exceeded}（{self.window:.0f} 秒內）",
+                            retry_after=self._retry_after(window)
+                        )
+            self._add(user_id, 1, 0, 0)
+
+    def refund(self, user_id: str) -> None:
+        """
+        退還 admit() 所計之一次請求；供入場、排程或時限所拒而未及呼叫提供者之請求
+
+        自最新之非零桶扣除；已滑出時窗者無可退還。
+
+        參數：
+            user_id: 使用者識別
+        """
+        with self._lock:
+            window = self._advance(user_id, self._bucket(), create=False)
+            if window is None:
+                return
+            for age in range(self.buckets):
+                slot = (window.head - age) % self.buckets
+                if window.buckets[slot]:
+                    window.buckets[slot] -= 1
+                    window.totals[0] -= 1
+                    return
+
+    def _retry_after(self, window: _Window) -> float:
+        """最舊之非空桶滑出時窗所需之秒數"""
+        size = self.buckets
+        for age in range(size - 1, -1, -1):
+            slot = (window.head - age) % size
+            if any(window.buckets[row * size + slot] for row in range(3)):
+                expires = (window.head - age + size) * self._width
+                return max(0.0, expires - self._clock())
+        return 0.0
+
+    def record(self, user_id: str, usage: Usage) -> None:
+        """
+        記入一次提供者呼叫之權杖用量
+
+        參數：
+            user_id: 使用者識別
+            usage: 用量
+        """
+        with self._lock:
+            self._add(user_id, 0, usage.input_tokens, usage.output_tokens)
+
+    def totals(self, user_id: str) -> UsageTotals:
+        """使用者於時窗內之用量合計"""
+        with self._lock:
+            window = self._advance(user_id, self._bucket(), create=False)
+            return UsageTotals(*window.totals) if window is not None else UsageTotals()
+
+    def top(self, n: int = 10, by: str = 'tokens') -> List[Tuple[str, UsageTotals]]:
+        """
+        用量最多之使用者
+
+        參數：
+            n: 人數
+            by: 排序依據："tokens" 或 "requests"
+        """
+        with self._lock:
+            now = self._bucket()
+            totals = [
+                (user_id, UsageTotals(*self._advance(user_id, now, create=False).totals))
+                for user_id in list(self._windows)
+            ]
+        totals.sort(key=lambda item: getattr(item[1], by), reverse=True)
+        return totals[:n]
+
+    def prune(self) -> int:
+        """
+        移除時窗內已無用量之使用者，以回收記憶體
+
+        返回：
+            移除之使用者數
+        """
+        with self._lock:
+            return self._sweep(self._bucket())
+
+    def _sweep(self, now: int) -> int:
+        """移除時窗內已無用量之使用者（須持有 self._lock）；返回移除之數"""
+        self._swept = now
+        idle = [user_id for user_id in list(self._windows) if not any(self._advance(user_id, now, False).totals)]
+        for user_id in idle:
+            del self._windows[user_id]
+        return len(idle)
+
+    def __len__(self) -> int:
+        return len(self._windows)
@@ -0,0 +1,327 @@
+"""
+按需剖析與配置追蹤
+此乃線上之診察，於不重新部署之下量度緩慢之所在
+
+RequestProfiler 掛於 ChatBot，啟動後剖析其後 N 則 process_message，完成即寫檔：
+    cprofile     以 cProfile 剖析各請求，彙總為 .prof（供 pstats/snakeviz）與 .txt 摘要
+    sample       背景執行緒定時取樣請求執行緒之呼叫堆疊，寫為 .collapsed（供 flamegraph），開銷低
+    tracemalloc  各請求前後取快照，記其配置增量最多之程式位置，寫為 .txt
+
+剖析僅涵蓋處理請求之執行緒；競速等轉交執行緒池之工作不在其內。
+cprofile 模式下同時僅剖析一則請求，其間並行之請求照常處理而不剖析；
+tracemalloc 為全域追蹤，並行之請求彼此之配置可能相混。
+
+用法：
+    profiler = RequestProfiler('profiles', mode='cprofile', requests=200)
+    chatbot = ChatBot(api_handler, manager, profiler=profiler)
+    profiler.install_signal()   # kill -USR1 <pid> 開始／提前結束
+"""
+
+import cProfile
+import io
+import itertools
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Callable, List, Optional, Set, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class _Session:
+    """一次剖析之狀態；結束後方寫出，故新一次剖析可於前次寫出之前開始"""
+
+    def __init__(self, number: int, mode: str, requests: int):
+        self.number = number  # 本剖析器之第幾次剖析，用於檔名
+        self.mode = mode  # 剖析模式
+        self.remaining = requests  # 尚待剖析之請求數
+        self.in_flight = 0  # 剖析中之請求數
+        self.profiled = 0  # 已剖析之請求數
+        self.closed = False  # 不再受理新請求
+        self.profiles: List[cProfile.Profile] = []  # cprofile 模式之各請求剖析
+        self.stacks: Counter = Counter()  # sample 模式之堆疊計數
+        self.threads: Set[int] = set()  # sample 模式下處理請求之執行緒
+        self.done = threading.Event()  # 取樣執行緒之停止旗標
+        self.sampler: Optional[threading.Thread] = None  # 取樣執行緒
+        self.allocations: List[str] = []  # tracemalloc 模式之逐請求摘要
+        self.allocation_totals: Counter = Counter()  # tracemalloc 模式之合計
+
+
+class RequestProfiler:
+    """
+    剖析其後 N 則請求，完成後將結果寫入 output_dir
+
+    結束（名額用盡或 stop()）後不再受理新請求；已在剖析中者完成時方寫出結果。
+    cProfile 同時僅容一個剖析器（Python 3.12 起並行啟用即拋出 ValueError），故 cprofile 模式下
+    已有請求剖析中時，並行之請求不剖析亦不計入名額，以免剖析使流量依序執行。
+    """
+
+    MODES = ('cprofile', 'sample', 'tracemalloc')  # 支援之模式
+
+    def __init__(
+        self,
+        output_dir: str = 'profiles',
+        mode: str = 'cprofile',
+        requests: int = 100,
+        top: int = 30,
+        sample_interval: float = 0.005
+    ):
+        """
+        參數：
+            output_dir: 輸出目錄
+            mode: 預設模式，見 MODES
+            requests: 每次剖析之請求數
+            top: 摘要列出之項數
+            sample_interval: 取樣模式之取樣間隔（秒）
+
+        異常：
+            ValueError: 未知之模式
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"未知之剖析模式: {mode}")
+        self.output_dir = output_dir  # 輸出目錄
+        self.mode = mode  # 預設模式
+        self.requests = requests  # 每次剖析之請求數
+        self.top = top  # 摘要列出之項數
+        self.sample_interval = sample_interval  # 取樣間隔（秒）
+        self.outputs: List[str] = []  # 已寫出之檔案
+        self._lock = threading.RLock()  # 訊號處理器可能於持鎖之主執行緒中執行
+        self._cprofile_lock = threading.Lock()  # cProfile 之剖析器同時僅容一個
+        self._session: Optional[_Session] = None  # 受理中之剖析；結束後為 None
+        self._tracing = 0  # 尚未寫出之 tracemalloc 剖析數
+        self._started_tracemalloc = False  # tracemalloc 是否由本剖析器啟動
+        self._sessions = itertools.count(1)  # 剖析之序號，使同一秒內結束者檔名不同
+
+    @property
+    def active(self) -> bool:
+        """是否正在受理剖析"""
+        return self._session is not None
+
+    def start(self, requests: Optional[int] = None, mode: Optional[str] = None) -> bool:
+        """
+        開始剖析其後之請求
+
+        參數：
+            requests: 請求數；預設為 self.requests
+            mode: 模式；預設為 self.mode
+
+        返回：
+            是否開始（已在剖析中則為 False）
+        """
+        mode = mode or self.mode
+        if mode not in self.MODES:
+            raise ValueError(f"未知之剖析模式: {mode}")
+        with self._lock:
+            if self._session is not None:
+                return False
+            session = _Session(next(self._sessions), mode, requests or self.requests)
+            if mode == 'tracemalloc':
+                # 前次剖析或仍待寫出，追蹤至最後一次寫出方停
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    self._started_tracemalloc = True
+                self._tracing += 1
+            if mode == 'sample':
+                session.sampler = threading.Thread(
+                    target=self._sample_loop, args=(session,), name='profiler-sampler', daemon=True
+                )
+                session.sampler.start()
+            self._session = session
+        logger.info("開始剖析 %d 則請求（%s）", session.remaining, mode)
+        return True
+
+    def stop(self) -> Optional[str]:
+        """
+        結束剖析；無剖析中之請求則即刻寫出結果，否則待其完成時寫出
+
+        返回：
+            輸出檔案路徑；未在剖析中或尚待請求完成則為 None
+        """
+        with self._lock:
+            session = self._session
+            if session is None:
+                return None
+            self._close(session)
+            finished = session.in_flight == 0
+        return self._finish(session) if finished else None
+
+    def _close(self, session: _Session) -> None:
+        """不再受理新請求（須持有 self._lock）"""
+        session.closed = True
+        session.remaining = 0
+        if self._session is session:
+            self._session = None
+
+    def run(self, func: Callable[..., T], *args) -> T:
+        """
+        執行請求；剖析中且名額未滿者予以剖析
+
+        參數：
+            func: 處理請求之函式
+            args: 其參數，首項為使用者識別
+        """
+        with self._lock:
+            session = self._session
+            if session is not None and session.mode == 'cprofile' and not self._cprofile_lock.acquire(blocking=False):
+                # 已有請求剖析中：此則照常處理而不剖析，亦不計入名額
+                session = None
+            if session is not None:
+                session.remaining -= 1
+                session.in_flight += 1
+                if session.remaining <= 0:
+                    self._close(session)
+        if session is None:
+            return func(*args)
+        try:
+            if session.mode == 'cprofile':
+                return self._run_cprofile(session, func, args)
+            if session.mode == 'sample':
+                return self._run_sampled(session, func, args)
+            return self._run_traced(session, func, args)
+        finally:
+            with self._lock:
+                session.in_flight -= 1
+                session.profiled += 1
+                finished = session.closed and session.in_flight == 0
+            if finished:
+                self._finish(session)
+
+    def _run_cprofile(self, session: _Session, func: Callable[..., T], args: tuple) -> T:
+        """以 cProfile 剖析請求；呼叫者已取得 self._cprofile_lock，於此釋出"""
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args)
+        finally:
+            self._cprofile_lock.release()
+            with self._lock:
+                session.profiles.append(profile)
+
+    def _run_sampled(self, session: _Session, func: Callable[..., T], args: tuple) -> T:
+        ident = threading.get_ident()
+        with self._lock:
+            session.threads.add(ident)
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                session.threads.discard(ident)
+
+    def _run_traced(self, session: _Session, func: Callable[..., T], args: tuple) -> T:
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        before = tracemalloc.take_snapshot().filter_traces(ignore)
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            after = tracemalloc.take_snapshot().filter_traces(ignore)
+            growth = [stat for stat in after.compare_to(before, 'lineno') if stat.size_diff > 0]
+            lines = [f"# 請求 user={args[0] if args else '?'} 耗時 {elapsed * 1000:.1f}ms"]
+            for stat in growth[:self.top]:
+                frame = stat.traceback[0]
+                lines.append(f"{stat.size_diff:>10} B {stat.count_diff:>6} 次  {frame.filename}:{frame.lineno}")
+            with self._lock:
+                session.allocations.append("\n".join(lines))
+                for stat in growth:
+                    frame = stat.traceback[0]
+                    session.allocation_totals[f"{frame.filename}:{frame.lineno}"] += stat.size_diff
+
+    def _sample_loop(self, session: _Session) -> None:
+        """定時取樣請求執行緒之堆疊，直至該次剖析寫出"""
+        while not session.done.is_set():
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(session.threads)
+            stacks = []
+            for ident in threads:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if stack:
+                    stacks.append(";".join(reversed(stack)))
+            del frames
+            with self._lock:
+                session.stacks.update(stacks)
+            session.done.wait(self.sample_interval)
+
+    def _finish(self, session: _Session) -> Optional[str]:
+        """停止取樣與追蹤，寫出結果；僅於最後一則剖析中之請求完成後呼叫一次"""
+        session.done.set()
+        if session.sampler is not None and session.sampler is not threading.current_thread():
+            session.sampler.join()
+        if session.mode == 'tracemalloc':
+            with self._lock:
+                self._tracing -= 1
+                if not self._tracing and self._started_tracemalloc:
+                    tracemalloc.stop()
+                    self._started_tracemalloc = False
+        return self._write(session)
+
+    def _write(self, session: _Session) -> Optional[str]:
+        """寫出一次剖析之結果"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        mode = session.mode
+        name = f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{session.number}-{mode}"
+        base = os.path.join(self.output_dir, name)
+        if mode == 'cprofile':
+            if not session.profiles:
+                return None
+            stats = pstats.Stats(session.profiles[0])
+            for profile in session.profiles[1:]:
+                stats.add(profile)
+            path = base + '.prof'
+            stats.dump_stats(path)
+            summary = io.StringIO()
+            pstats.Stats(path, stream=summary).sort_stats('cumulative').print_stats(self.top)
+            with open(base + '.txt', 'w', encoding='utf-8') as f:
+                f.write(f"# {session.profiled} 則請求\n")
+                f.write(summary.getvalue())
+        elif mode == 'sample':
+            path = base + '.collapsed'
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in session.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        else:
+            path = base + '.txt'
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(f"# {session.profiled} 則請求之配置增量最多者（合計）\n")
+                for site, size in session.allocation_totals.most_common(self.top):
+                    f.write(f"{size:>10} B  {site}\n")
+                f.write("\n")
+                f.write("\n\n".join(session.allocations))
+                f.write("\n")
+        with self._lock:
+            self.outputs.append(path)
+        logger.info("剖析完成，共 %d 則請求，已寫入 %s", session.profiled, path)
+        return path
+
+    def install_signal(self, signum: Optional[int] = None) -> None:
+        """
+        安裝訊號處理器：收到訊號時開始剖析，剖析中再收到則提前結束
+
+        參數：
+            signum: 訊號；預設為 SIGUSR1（須於主執行緒呼叫，不支援之平台略過）
+        """
+        signum = signum if signum is not None else getattr(signal, 'SIGUSR1', None)
+        if signum is None:
+            logger.warning("此平台不支援 SIGUSR1，略過剖析訊號")
+            return
+
+        def handler(_signum, _frame):
+            if self.active:
+                self.stop()
+            else:
+                self.start()
+
+        signal.signal(signum, handler)
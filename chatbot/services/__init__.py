@@ -3,6 +3,24 @@
 此乃外部服務之介面
 """
 
-from .api_handler import APIHandler
+from .api_handler import APIHandler, preload_sdks
+from .batcher import FakeBatchEndpoint, GeminiBatchBackend, MicroBatcher
+from .key_pool import ApiKey, KeyPool
+from .scheduler import BACKGROUND, BATCH, INTERACTIVE, PRIORITIES, ClassStats, PriorityClass, PriorityScheduler
 
-__all__ = ['APIHandler']
+__all__ = [
+    'APIHandler',
+    'preload_sdks',
+    'MicroBatcher',
+    'GeminiBatchBackend',
+    'FakeBatchEndpoint',
+    'KeyPool',
+    'ApiKey',
+    'PriorityScheduler',
+    'PriorityClass',
+    'ClassStats',
+    'INTERACTIVE',
+    'BATCH',
+    'BACKGROUND',
+    'PRIORITIES',
+]
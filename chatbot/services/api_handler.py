@@ -4,88 +4,416 @@ API 處理層 - 統一管理 Gemini 與 Perplexity API 呼叫
 """
 
 import logging
-from typing import Optional
+import math
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Sequence, Union
+
+from chatbot import codec
+from chatbot.deadline import Deadline
+from chatbot.exceptions import DeadlineExceeded, QueueTimeoutError
+from chatbot.models import Usage
+from .batcher import GeminiBatchBackend, MicroBatcher
+from .key_pool import ApiKey, KeyPool, KeySpec
+from .scheduler import INTERACTIVE, PriorityClass, PriorityScheduler
 
 logger = logging.getLogger(__name__)
 
 
+def preload_sdks(background: bool = True) -> Optional[threading.Thread]:
+    """
+    預先載入重型 SDK（google.genai 與 requests）
+
+    參數：
+        background: 是否於背景執行緒載入
+
+    返回：
+        背景載入之執行緒；同步載入時返回 None
+    """
+    def _load():
+        try:
+            import requests  # noqa: F401
+            from google import genai  # noqa: F401
+        except Exception as e:
+            logger.warning("預先載入 SDK 失敗: %s", e)
+
+    if not background:
+        _load()
+        return None
+    thread = threading.Thread(target=_load, name='sdk-preload', daemon=True)
+    thread.start()
+    return thread
+
+
+def _gemini_usage(response) -> Usage:
+    """自 Gemini 回應取出用量；思考權杖計入輸出"""
+    metadata = getattr(response, 'usage_metadata', None)
+    if metadata is None:
+        return Usage('gemini')
+    output_tokens = (getattr(metadata, 'candidates_token_count', None) or 0) + \
+        (getattr(metadata, 'thoughts_token_count', None) or 0)
+    return Usage('gemini', getattr(metadata, 'prompt_token_count', None) or 0, output_tokens)
+
+
+def _provider_fields(provider: str, start: float) -> dict:
+    """結構化日誌之欄位"""
+    return {'provider': provider, 'latency_ms': round((time.perf_counter() - start) * 1000, 1)}
+
+
 class APIHandler:
     """
     統一管理 Gemini 與 Perplexity API 呼叫
     """
 
-    def __init__(self, gemini_key: str, perplexity_key: str):
+    GEMINI_MODEL: str = 'gemini-2.5-flash-lite'  # Gemini 模型名
+    PERPLEXITY_MODEL: str = 'sonar'  # Perplexity 模型名
+    PERPLEXITY_URL: str = 'https://api.perplexity.ai/chat/completions'  # Perplexity 端點
+
+    def __init__(
+        self,
+        gemini_key: Union[str, Sequence[KeySpec], KeyPool],
+        perplexity_key: Union[str, Sequence[KeySpec], KeyPool],
+        key_strategy: str = 'least_in_flight'
+    ):
         """
         初始化 API 處理器
         
         參數：
-            gemini_key: Gemini 祕鑰
-            perplexity_key: Perplexity 祕鑰
+            gemini_key: Gemini 祕鑰；多把祕鑰則為列表（可附權重）或祕鑰池
+            perplexity_key: Perplexity 祕鑰；同上
+            key_strategy: 多把祕鑰之選鑰策略，見 KeyPool.STRATEGIES
         """
-        self.gemini_key = gemini_key  # Gemini 祕鑰
-        self.perplexity_key = perplexity_key  # Perplexity 祕鑰
+        self.gemini_keys = KeyPool.coerce(gemini_key, 'gemini', key_strategy)  # Gemini 祕鑰池
+        self.perplexity_keys = KeyPool.coerce(perplexity_key, 'perplexity', key_strategy)  # Perplexity 祕鑰池
         self.timeout = 30  # 超時時間（秒）
+        self.max_retries = 0  # 失敗後之重試次數
+        self.retry_backoff = 0.5  # 首次重試前之退避（秒），其後倍增
+        self._gemini_clients: Dict[str, object] = {}  # 各祕鑰之 Gemini 客戶端，首次使用時建立
+        self._session = None  # Perplexity 連線池，首次使用時建立
+        self._client_lock = threading.Lock()
+        self.gemini_batcher: Optional[MicroBatcher] = None  # Gemini 微批次處理器，預設停用
+        self.scheduler: Optional[PriorityScheduler] = None  # 優先序排程器，預設停用
+
+    def _get_gemini_client(self, api_key: str):
+        """
+        取得（必要時建立）某祕鑰共用之 Gemini 客戶端
+
+        參數：
+            api_key: 祕鑰；呼叫者須先自祕鑰池租用
+        """
+        client = self._gemini_clients.get(api_key)
+        if client is None:
+            with self._client_lock:
+                client = self._gemini_clients.get(api_key)
+                if client is None:
+                    from google import genai
+
+                    client = self._gemini_clients[api_key] = genai.Client(api_key=api_key)
+        return client
+
+    def _get_session(self):
+        """取得（必要時建立）共用之 HTTP 連線池，以重用 TLS 連線"""
+        if self._session is None:
+            with self._client_lock:
+                if self._session is None:
+                    import requests
+
+                    self._session = requests.Session()
+        return self._session
+
+    def prewarm(self) -> Dict[str, float]:
+        """
+        預熱兩端之連線：建立客戶端、解析 DNS 並完成 TLS 握手
+
+        Gemini 以輕量之模型查詢暖各祕鑰之客戶端自身之連線池，遭拒之祕鑰隨即停用；
+        Perplexity 以 HEAD 請求於共用連線池中建立連線，回應狀態不拘。
+        預熱失敗僅記錄警告，不阻止啟動。
+
+        返回：
+            各步驟耗時（秒）
+        """
+        timings = {}
+
+        start = time.perf_counter()
+        for key in self.gemini_keys.keys:
+            try:
+                self._get_gemini_client(key.secret).models.get(model=self.GEMINI_MODEL)
+            except Exception as e:
+                self.gemini_keys.report(key, e)
+                logger.warning("Gemini 預熱失敗（%s）: %s", key.label, e, extra={'provider': 'gemini'})
+        timings['gemini'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        try:
+            self._get_session().head(self.PERPLEXITY_URL, timeout=self.timeout)
+        except Exception as e:
+            logger.warning("Perplexity 預熱失敗: %s", e, extra={'provider': 'perplexity'})
+        timings['perplexity'] = time.perf_counter() - start
+
+        return timings
+
+    def enable_scheduling(
+        self,
+        max_concurrency: int = 16,
+        classes: Optional[Sequence[PriorityClass]] = None
+    ) -> PriorityScheduler:
+        """
+        啟用優先序排程：提供者呼叫之名額依請求之優先類別分配
+
+        參數：
+            max_concurrency: 同時進行之提供者呼叫數
+            classes: 各類別之設定；預設為互動、批次、背景三類
+
+        返回：
+            優先序排程器
+        """
+        self.scheduler = PriorityScheduler(max_concurrency, classes)
+        return self.scheduler
+
+    @contextmanager
+    def _scheduled(self, priority: str, deadline: Optional[Deadline]) -> Iterator[None]:
+        """
+        取得排程之名額；未啟用排程則不設限
+
+        異常：
+            DeadlineExceeded: 呼叫者之時限於等候中屆滿
+            BusyError: 佇列已滿，或類別之等候上限先於時限屆滿
+        """
+        if self.scheduler is None:
+            yield
+            return
+        try:
+            self.scheduler.acquire(priority, deadline.remaining() if deadline else None)
+        except QueueTimeoutError:
+            # 等候為時限所截者屬逾時，非繁忙
+            if deadline is not None and deadline.expired:
+                raise DeadlineExceeded("時限已過：等候排程名額") from None
+            raise
+        try:
+            yield
+        finally:
+            self.scheduler.release(priority)
+
+    def _call_with_retries(
+        self,
+        call: Callable[[ApiKey, float], str],
+        keys: KeyPool,
+        deadline: Optional[Deadline],
+        priority: str = INTERACTIVE
+    ) -> str:
+        """
+        依剩餘時限執行呼叫，失敗時退避重試
+
+        每次嘗試先依優先類別取得排程之名額，再自祕鑰池租用一把祕鑰，超時為 min(self.timeout, 剩餘時限)；
+        因祕鑰遭限流或遭拒而失敗者，即刻換鑰再試（至多各鑰一次），不計入重試次數；
+        其餘失敗則釋出名額後退避重試，剩餘時限不足以退避時不再重試。
+
+        參數：
+            call: 接受祕鑰與超時秒數之呼叫
+            keys: 祕鑰池
+            deadline: 呼叫者之時限
+            priority: 優先類別
+
+        返回：
+            呼叫之結果
+
+        異常：
+            DeadlineExceeded: 嘗試前或等候排程時時限已過
+            BusyError: 排程之佇列已滿或等候逾類別之上限
+            Exception: 最後一次嘗試之異常
+        """
+        attempt = 0
+        failovers = len(keys) - 1
+        while True:
+            with self._scheduled(priority, deadline):
+                timeout = deadline.timeout(self.timeout) if deadline else self.timeout
+                key = None
+                try:
+                    with keys.lease() as key:
+                        return call(key, timeout)
+                except DeadlineExceeded:
+                    raise
+                except Exception as e:
+                    if key is not None and failovers > 0 and KeyPool.is_key_error(e):
+                        failovers -= 1
+                        logger.warning("祕鑰 %s 失效，換鑰再試: %s", key.label, e, extra={'provider': keys.provider})
+                        continue
+                    backoff = self.retry_backoff * (2 ** attempt)
+                    if attempt >= self.max_retries or (deadline and deadline.remaining() <= backoff):
+                        raise
+                    attempt += 1
+                    logger.warning(
+                        "API 呼叫失敗，%.1f 秒後第 %d 次重試: %s", backoff, attempt, e, extra={'attempt': attempt}
+                    )
+            time.sleep(backoff)
 
-    def query_gemini(self, prompt: str) -> str:
+    def query_gemini(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        on_usage: Optional[Callable[[Usage], None]] = None,
+        priority: str = INTERACTIVE
+    ) -> str:
         """
         查詢 Gemini API
         
         參數：
             prompt: 提示詞
+            model: 模型名；預設為 GEMINI_MODEL
+            deadline: 呼叫者之時限；各次嘗試之超時不逾其剩餘時間
+            on_usage: 呼叫成功時接收其權杖用量；經微批次送出者不回報
+            priority: 優先類別；啟用排程時據以分配名額，啟用微批次時非互動者經批次送出
         
         返回：
             Gemini 之回應
         
         異常：
+            DeadlineExceeded: 時限已過
             Exception: API 呼叫失敗時
         """
-        try:
-            from google import genai
+        if self.gemini_batcher is not None and priority != INTERACTIVE and model is None:
+            # 非互動流量以延遲換吞吐
+            return self._await_batched(self.gemini_batcher.submit(prompt), deadline)
+
+        from google.genai import types
 
-            client = genai.Client(api_key=self.gemini_key)
-            response = client.models.generate_content(
-                model='gemini-2.5-flash-lite',
-                contents=[prompt]
+        def call(key: ApiKey, timeout: float) -> str:
+            response = self._get_gemini_client(key.secret).models.generate_content(
+                model=model or self.GEMINI_MODEL,
+                contents=[prompt],
+                # SDK 之超時以毫秒計，且視 0 為不設超時，故至少為 1
+                config=types.GenerateContentConfig(
+                    http_options=types.HttpOptions(timeout=max(1, math.ceil(timeout * 1000)))
+                )
             )
+            if on_usage is not None:
+                on_usage(_gemini_usage(response))
             return response.text
+
+        start = time.perf_counter()
+        try:
+            return self._call_with_retries(call, self.gemini_keys, deadline, priority)
         except Exception as e:
-            logger.error(f"Gemini API 呼叫失敗: {e}")
+            logger.error("Gemini API 呼叫失敗: %s", e, extra=_provider_fields('gemini', start))
             raise
 
-    def query_perplexity(self, query: str) -> str:
+    @staticmethod
+    def _await_batched(future: Future, deadline: Optional[Deadline]) -> str:
+        """等候微批次之結果，不逾呼叫者之時限"""
+        try:
+            return future.result(deadline.remaining() if deadline else None)
+        except FutureTimeoutError:
+            future.cancel()
+            raise DeadlineExceeded("時限已過：等候批次結果") from None
+
+    def enable_gemini_batching(
+        self,
+        max_batch_size: int = 32,
+        max_wait: float = 0.05,
+        backend=None,
+        poll_interval: float = 5.0
+    ) -> MicroBatcher:
+        """
+        啟用 Gemini 微批次處理，供非互動流量使用
+
+        參數：
+            max_batch_size: 單批之最大請求數
+            max_wait: 聚合時窗（秒）
+            backend: 批次後端；預設經 Gemini 批次介面送出
+            poll_interval: 預設後端之作業輪詢間隔（秒）
+
+        返回：
+            微批次處理器
+        """
+        if self.gemini_batcher is not None:
+            self.gemini_batcher.close()
+        if backend is None:
+            backend = GeminiBatchBackend(
+                self._get_gemini_client, self.GEMINI_MODEL, poll_interval, keys=self.gemini_keys
+            )
+        self.gemini_batcher = MicroBatcher(backend, max_batch_size, max_wait)
+        return self.gemini_batcher
+
+    def submit_gemini(self, prompt: str) -> Future:
+        """
+        以微批次提交 Gemini 請求；未啟用批次時即時查詢
+
+        參數：
+            prompt: 提示詞
+
+        返回：
+            承載 Gemini 回應之 Future
+        """
+        if self.gemini_batcher is not None:
+            return self.gemini_batcher.submit(prompt)
+        future: Future = Future()
+        try:
+            future.set_result(self.query_gemini(prompt))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def close(self) -> None:
+        """釋放批次處理器與連線池"""
+        if self.gemini_batcher is not None:
+            self.gemini_batcher.close()
+            self.gemini_batcher = None
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def query_perplexity(
+        self,
+        query: str,
+        deadline: Optional[Deadline] = None,
+        on_usage: Optional[Callable[[Usage], None]] = None,
+        priority: str = INTERACTIVE
+    ) -> str:
         """
         查詢 Perplexity API
         
         參數：
             query: 查詢內容
+            deadline: 呼叫者之時限；各次嘗試之超時不逾其剩餘時間
+            on_usage: 呼叫成功時接收其權杖用量
+            priority: 優先類別；啟用排程時據以分配名額
         
         返回：
             Perplexity 之回應
         
         異常：
+            DeadlineExceeded: 時限已過
             Exception: API 呼叫失敗時
         """
-        try:
-            import requests
-
-            headers = {
-                "Authorization": f"Bearer {self.perplexity_key}",
-                "Content-Type": "application/json",
-            }
-            payload = {
-                "model": "sonar",
-                "messages": [
-                    {"role": "user", "content": query}
-                ],
-            }
-            response = requests.post(
-                "https://api.perplexity.ai/chat/completions",
-                json=payload,
-                headers=headers,
-                timeout=self.timeout
+        payload = codec.dumps({
+            "model": self.PERPLEXITY_MODEL,
+            "messages": [
+                {"role": "user", "content": query}
+            ],
+        })
+
+        def call(key: ApiKey, timeout: float) -> str:
+            response = self._get_session().post(
+                self.PERPLEXITY_URL,
+                data=payload,
+                headers={"Authorization": f"Bearer {key.secret}", "Content-Type": "application/json"},
+                timeout=timeout
             )
             response.raise_for_status()
-            return response.json()["choices"][0]["message"]["content"]
+            self.perplexity_keys.observe(key, response.headers)
+            # 僅解出回覆內容與用量，略過 citations 等大欄位
+            content = codec.chat_content(response.content)
+            if on_usage is not None:
+                usage = codec.chat_usage(response.content) or {}
+                on_usage(Usage('perplexity', usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0)))
+            return content
+
+        start = time.perf_counter()
+        try:
+            return self._call_with_retries(call, self.perplexity_keys, deadline, priority)
         except Exception as e:
-            logger.error(f"Perplexity API 呼叫失敗: {e}")
+            logger.error("Perplexity API 呼叫失敗: %s", e, extra=_provider_fields('perplexity', start))
             raise
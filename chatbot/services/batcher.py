@@ -0,0 +1,287 @@
+"""
+微批次處理器 - 聚合零散之 Gemini 請求，經批次介面一併送出
+此乃聚沙成塔之法，以延遲換吞吐
+"""
+
+import itertools
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from .key_pool import KeyPool
+
+logger = logging.getLogger(__name__)
+
+# 批次後端：接受一組提示詞，返回等長之結果列表（字串或例外）
+BatchBackend = Callable[[List[str]], Sequence[Union[str, BaseException]]]
+
+_CLOSE = object()  # 關閉信號
+
+
+@dataclass
+class BatchStats:
+    """批次統計"""
+    batches: int = 0  # 已送出批次數
+    items: int = 0  # 已送出請求數
+    failed_batches: int = 0  # 整批失敗數
+    max_batch_size: int = 0  # 曾見之最大批次
+
+    @property
+    def mean_batch_size(self) -> float:
+        """平均批次大小"""
+        return self.items / self.batches if self.batches else 0.0
+
+
+class MicroBatcher:
+    """
+    於短時窗內或達上限時聚合請求，交由批次後端處理，並將結果送回各呼叫者之 Future
+    """
+
+    def __init__(
+        self,
+        backend: BatchBackend,
+        max_batch_size: int = 32,
+        max_wait: float = 0.05,
+        max_inflight_batches: int = 4
+    ):
+        """
+        初始化微批次處理器
+
+        參數：
+            backend: 批次後端
+            max_batch_size: 單批之最大請求數
+            max_wait: 首筆請求到達後之最長等候（秒）
+            max_inflight_batches: 同時送出之最大批次數
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size 須至少為 1")
+        self.backend = backend  # 批次後端
+        self.max_batch_size = max_batch_size  # 單批上限
+        self.max_wait = max_wait  # 聚合時窗（秒）
+        self.stats = BatchStats()  # 批次統計
+        self._queue: "queue.Queue" = queue.Queue()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_inflight_batches, thread_name_prefix='batch-dispatch'
+        )
+        self._stats_lock = threading.Lock()
+        self._submit_lock = threading.Lock()  # 提交與關閉互斥，關閉信號之後不再有請求入列
+        self._closed = False
+        self._collector = threading.Thread(target=self._collect, name='batch-collector', daemon=True)
+        self._collector.start()
+
+    def submit(self, prompt: str) -> Future:
+        """
+        提交一筆請求
+
+        參數：
+            prompt: 提示詞
+
+        返回：
+            將承載回應之 Future
+
+        異常：
+            RuntimeError: 批次處理器已關閉時
+        """
+        future: Future = Future()
+        with self._submit_lock:
+            if self._closed:
+                raise RuntimeError("微批次處理器已關閉")
+            self._queue.put((prompt, future))
+        return future
+
+    def close(self, wait: bool = True) -> None:
+        """
+        關閉批次處理器；已提交之請求仍會送出
+
+        參數：
+            wait: 是否等候所有批次完成
+        """
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_CLOSE)
+        if wait:
+            self._collector.join()
+        self._executor.shutdown(wait=wait)
+
+    def _collect(self) -> None:
+        """聚合迴圈：首筆到達後，收集至時窗屆滿或批次額滿"""
+        closing = False
+        while not closing:
+            item = self._queue.get()
+            if item is _CLOSE:
+                break
+            batch: List[Tuple[str, Future]] = [item]
+            window_end = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = window_end - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _CLOSE:
+                    closing = True
+                    break
+                batch.append(item)
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch: List[Tuple[str, Future]]) -> None:
+        """送出一批，並將結果分發至各 Future"""
+        live = [(prompt, future) for prompt, future in batch if future.set_running_or_notify_cancel()]
+        if not live:
+            return
+        with self._stats_lock:
+            self.stats.batches += 1
+            self.stats.items += len(live)
+            self.stats.max_batch_size = max(self.stats.max_batch_size, len(live))
+        try:
+            results = list(self.backend([prompt for prompt, _ in live]))
+            if len(results) != len(live):
+                raise RuntimeError(f"批次結果數不符: 送出 {len(live)}，收到 {len(results)}")
+        except Exception as e:
+            logger.error("批次送出失敗: %s", e)
+            with self._stats_lock:
+                self.stats.failed_batches += 1
+            for _, future in live:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(live, results):
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+class GeminiBatchBackend:
+    """
+    經 Gemini 批次介面（client.batches）處理一批提示詞
+    以內嵌請求建立批次作業，輪詢至終態後取回各回應
+    """
+
+    TERMINAL_STATES = {
+        'JOB_STATE_SUCCEEDED', 'JOB_STATE_FAILED', 'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED',
+    }  # 作業終態
+
+    def __init__(
+        self,
+        client_factory: Callable[..., object],
+        model: str,
+        poll_interval: float = 5.0,
+        timeout: float = 24 * 3600,
+        keys: Optional[KeyPool] = None
+    ):
+        """
+        參數：
+            client_factory: 返回 genai 客戶端（或相容物件）之函式；設有 keys 則接受祕鑰
+            model: 模型名
+            poll_interval: 輪詢間隔（秒）
+            timeout: 作業之最長等候（秒）
+            keys: 祕鑰池；設有則每批租用一把祕鑰至作業結束，遭限流或遭拒者依池之規則暫停
+        """
+        self.client_factory = client_factory  # 客戶端工廠
+        self.model = model  # 模型名
+        self.poll_interval = poll_interval  # 輪詢間隔（秒）
+        self.timeout = timeout  # 最長等候（秒）
+        self.keys = keys  # 祕鑰池
+
+    def __call__(self, prompts: List[str]) -> List[Union[str, BaseException]]:
+        if self.keys is None:
+            return self._run(self.client_factory(), prompts)
+        with self.keys.lease() as key:
+            return self._run(self.client_factory(key.secret), prompts)
+
+    def _run(self, client, prompts: List[str]) -> List[Union[str, BaseException]]:
+        """建立批次作業並輪詢至終態"""
+        requests = [{'contents': [{'parts': [{'text': p}], 'role': 'user'}]} for p in prompts]
+        job = client.batches.create(model=self.model, src=requests)
+        deadline = time.monotonic() + self.timeout
+        while job.state.name not in self.TERMINAL_STATES:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"批次作業逾時: {job.name}")
+            time.sleep(self.poll_interval)
+            job = client.batches.get(name=job.name)
+        if job.state.name != 'JOB_STATE_SUCCEEDED':
+            raise RuntimeError(f"批次作業失敗: {job.name} ({job.state.name})")
+
+        results: List[Union[str, BaseException]] = []
+        for inlined in job.dest.inlined_responses:
+            if getattr(inlined, 'error', None):
+                results.append(RuntimeError(f"批次請求失敗: {inlined.error}"))
+            else:
+                results.append(inlined.response.text)
+        return results
+
+
+class FakeBatchEndpoint:
+    """
+    本地模擬之批次端點，形同 genai 客戶端之 batches 介面，供測試之用
+
+    作業建立 latency 秒後，於下次查詢時結算為成功；
+    responder 拋出例外之請求，其結果帶 error 欄位。
+    """
+
+    def __init__(
+        self,
+        responder: Optional[Callable[[str], str]] = None,
+        latency: float = 0.0,
+        fail_jobs: bool = False
+    ):
+        """
+        參數：
+            responder: 由提示詞產生回應之函式
+            latency: 作業處理耗時（秒）
+            fail_jobs: 是否令整批作業失敗
+        """
+        self.responder = responder or (lambda prompt: f"回應: {prompt}")  # 回應函式
+        self.latency = latency  # 作業耗時（秒）
+        self.fail_jobs = fail_jobs  # 是否令作業失敗
+        self.jobs: Dict[str, SimpleNamespace] = {}  # 作業名 -> 作業
+        self.batch_sizes: List[int] = []  # 各批之請求數
+        self.batches = self  # 形同 client.batches
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def create(self, model: str, src: List[dict], config: Optional[dict] = None) -> SimpleNamespace:
+        """建立批次作業"""
+        with self._lock:
+            name = f"batches/fake-{next(self._ids)}"
+            self.batch_sizes.append(len(src))
+        prompts = [request['contents'][0]['parts'][0]['text'] for request in src]
+        job = SimpleNamespace(
+            name=name,
+            model=model,
+            state=SimpleNamespace(name='JOB_STATE_PENDING'),
+            dest=None,
+            ready_at=time.monotonic() + self.latency,
+            prompts=prompts,
+        )
+        self.jobs[name] = job
+        return self._refresh(job)
+
+    def get(self, name: str) -> SimpleNamespace:
+        """查詢批次作業"""
+        return self._refresh(self.jobs[name])
+
+    def _refresh(self, job: SimpleNamespace) -> SimpleNamespace:
+        if job.dest is not None or time.monotonic() < job.ready_at:
+            return job
+        if self.fail_jobs:
+            job.state = SimpleNamespace(name='JOB_STATE_FAILED')
+            job.dest = SimpleNamespace(inlined_responses=[])
+            return job
+        responses = []
+        for prompt in job.prompts:
+            try:
+                text = self.responder(prompt)
+                responses.append(SimpleNamespace(response=SimpleNamespace(text=text), error=None))
+            except Exception as e:
+                responses.append(SimpleNamespace(response=None, error=str(e)))
+        job.dest = SimpleNamespace(inlined_responses=responses)
+        job.state = SimpleNamespace(name='JOB_STATE_SUCCEEDED')
+        return job
@@ -0,0 +1,276 @@
+"""
+API 金鑰池 - 以多把祕鑰分攤同一提供者之速率上限
+此乃多鑰輪值之法，增鑰即增量
+
+每次呼叫自池中租用一把祕鑰：預設取處理中請求最少者（依權重折算），亦可用平滑加權輪詢。
+祕鑰遭限流（429）則依 Retry-After 或指數退避暫停使用，遭拒（401/403）則長時停用；
+提供者回報之剩餘請求數歸零時，該鑰亦暫不取用，直至其重置。
+"""
+
+import itertools
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
+
+from chatbot.exceptions import NoAvailableKeyError
+
+logger = logging.getLogger(__name__)
+
+# 祕鑰，或 (祕鑰, 權重)
+KeySpec = Union[str, Tuple[str, float]]
+
+_DURATION = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_UNITS = {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """解析秒數或 "1m30s"、"250ms" 形式之時長；無法解析則為 None"""
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    if not parts or ''.join(n + u for n, u in parts) != value:
+        return None
+    return sum(float(n) * _UNITS[u] for n, u in parts)
+
+
+def status_of(error: BaseException) -> Optional[int]:
+    """
+    取出異常所帶之 HTTP 狀態碼
+
+    requests 之 HTTPError 置於 response.status_code，google-genai 之 APIError 置於 code。
+    """
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status is None:
+        status = getattr(error, 'code', None)
+    return status if isinstance(status, int) else None
+
+
+def _retry_after_of(error: BaseException) -> Optional[float]:
+    """取出異常之回應所帶之 Retry-After（秒）"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    value = headers.get('Retry-After') if headers is not None else None
+    return _parse_duration(value) if isinstance(value, str) else None
+
+
+@dataclass(eq=False)
+class ApiKey:
+    """池中之一把祕鑰與其狀態"""
+    secret: str = field(repr=False)  # 祕鑰
+    label: str  # 日誌用之標籤，僅含祕鑰末四碼
+    weight: float = 1.0  # 權重
+    in_flight: int = 0  # 處理中之請求數
+    requests: int = 0  # 已租用次數
+    throttled: int = 0  # 遭限流（429）次數
+    rejected: int = 0  # 遭拒（401/403）次數
+    strikes: int = 0  # 連續遭限流次數，決定退避長短
+    ejected_until: float = 0.0  # 暫停使用至此時刻
+    remaining: Optional[int] = None  # 提供者回報之剩餘請求數
+    reset_at: float = 0.0  # 剩餘請求數重置之時刻
+    current: float = 0.0  # 平滑加權輪詢之目前權值
+
+    def blocked_until(self, now: float) -> float:
+        """可再取用之時刻；可用則為 now"""
+        until = max(now, self.ejected_until)
+        if self.remaining == 0:
+            until = max(until, self.reset_at)
+        return until
+
+
+class KeyPool:
+    """
+    一個提供者之祕鑰池
+    """
+
+    STRATEGIES = ('least_in_flight', 'weighted')  # 選鑰策略
+    THROTTLED: int = 429  # 限流之狀態碼
+    REJECTED = (401, 403)  # 祕鑰無效或無權之狀態碼
+
+    def __init__(
+        self,
+        keys: Sequence[KeySpec],
+        provider: str = 'api',
+        strategy: str = 'least_in_flight',
+        throttle_cooldown: float = 5.0,
+        max_cooldown: float = 300.0,
+        reject_cooldown: float = 600.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        參數：
+            keys: 祕鑰，或 (祕鑰, 權重)
+            provider: 提供者名稱，用於日誌與異常訊息
+            strategy: "least_in_flight"（處理中最少者，依權重折算）或 "weighted"（平滑加權輪詢）
+            throttle_cooldown: 遭限流且無 Retry-After 時之首次暫停（秒），連續遭限流則倍增
+            max_cooldown: 遭限流時暫停之上限（秒）
+            reject_cooldown: 遭拒時之停用時間（秒）
+            clock: 時鐘
+        """
+        if not keys:
+            raise ValueError(f"{provider} 須至少有一把祕鑰")
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"未知之選鑰策略: {strategy}")
+        self.provider = provider  # 提供者名稱
+        self.strategy = strategy  # 選鑰策略
+        self.throttle_cooldown = throttle_cooldown  # 遭限流之首次暫停（秒）
+        self.max_cooldown = max_cooldown  # 遭限流之暫停上限（秒）
+        self.reject_cooldown = reject_cooldown  # 遭拒之停用時間（秒）
+        self.keys: List[ApiKey] = []  # 祕鑰與其狀態
+        for index, spec in enumerate(keys):
+            secret, weight = (spec, 1.0) if isinstance(spec, str) else spec
+            if weight <= 0:
+                raise ValueError("祕鑰之權重須為正數")
+            self.keys.append(ApiKey(secret, f"{provider}#{index}…{secret[-4:]}", float(weight)))
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._rotation = itertools.count()  # 最少處理中策略之同分輪替
+
+    @classmethod
+    def coerce(
+        cls,
+        keys: Union[str, Sequence[KeySpec], 'KeyPool'],
+        provider: str,
+        strategy: str = 'least_in_flight'
+    ) -> 'KeyPool':
+        """將單一祕鑰、祕鑰列表或祕鑰池統一為祕鑰池"""
+        if isinstance(keys, KeyPool):
+            return keys
+        if isinstance(keys, str):
+            keys = [keys]
+        return cls(keys, provider, strategy)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def available(self) -> int:
+        """目前可取用之祕鑰數"""
+        with self._lock:
+            now = self._clock()
+            return sum(1 for key in self.keys if key.blocked_until(now) <= now)
+
+    def _choose(self) -> ApiKey:
+        now = self._clock()
+        candidates = [key for key in self.keys if key.blocked_until(now) <= now]
+        if not candidates:
+            retry_after = min(key.blocked_until(now) for key in self.keys) - now
+            raise NoAvailableKeyError(
+                f"{self.provider} 之祕鑰皆暫停使用，{retry_after:.1f} 秒後恢復", retry_after
+            )
+        if self.strategy == 'weighted':
+            # 平滑加權輪詢：各鑰累加其權重，取最大者並扣除總權重
+            total = sum(key.weight for key in candidates)
+            for key in candidates:
+                key.current += key.weight
+            chosen = max(candidates, key=lambda key: key.current)
+            chosen.current -= total
+            return chosen
+        # 起點輪替，使同分者輪流受選
+        offset = next(self._rotation) % len(candidates)
+        rotated = candidates[offset:] + candidates[:offset]
+        return min(rotated, key=lambda key: key.in_flight / key.weight)
+
+    def select(self) -> ApiKey:
+        """
+        選取一把祕鑰而不計入處理中，亦不記錄呼叫之結果；實際呼叫宜用 lease()
+
+        異常：
+            NoAvailableKeyError: 祕鑰皆暫停使用
+        """
+        with self._lock:
+            return self._choose()
+
+    @contextmanager
+    def lease(self) -> Iterator[ApiKey]:
+        """
+        租用一把祕鑰，離開時歸還；區塊內之異常依其狀態碼決定是否暫停該鑰
+
+        用法：
+            with pool.lease() as key:
+                call(key.secret)
+
+        異常：
+            NoAvailableKeyError: 祕鑰皆暫停使用
+        """
+        with self._lock:
+            key = self._choose()
+            key.in_flight += 1
+            key.requests += 1
+        try:
+            yield key
+        except BaseException as e:
+            with self._lock:
+                key.in_flight -= 1
+            self.report(key, e)
+            raise
+        else:
+            with self._lock:
+                key.in_flight -= 1
+            self.report(key)
+
+    @classmethod
+    def is_key_error(cls, error: BaseException) -> bool:
+        """異常是否因祕鑰本身（遭限流或遭拒），換鑰即可能成功"""
+        status = status_of(error)
+        return status == cls.THROTTLED or status in cls.REJECTED
+
+    def report(self, key: ApiKey, error: Optional[BaseException] = None) -> bool:
+        """
+        記錄一次呼叫之結果
+
+        參數：
+            key: 所用之祕鑰
+            error: 呼叫之異常；None 表示成功
+
+        返回：
+            是否因該鑰本身而失敗（遭限流或遭拒），換鑰即可能成功
+        """
+        if error is None:
+            if key.strikes:
+                with self._lock:
+                    key.strikes = 0
+            return False
+        status = status_of(error)
+        if status == self.THROTTLED:
+            with self._lock:
+                key.throttled += 1
+                key.strikes += 1
+                cooldown = _retry_after_of(error)
+                if cooldown is None:
+                    cooldown = min(self.max_cooldown, self.throttle_cooldown * 2 ** (key.strikes - 1))
+                key.ejected_until = max(key.ejected_until, self._clock() + cooldown)
+            logger.warning("祕鑰 %s 遭限流，暫停 %.1f 秒", key.label, cooldown, extra={'provider': self.provider})
+            return True
+        if status in self.REJECTED:
+            with self._lock:
+                key.rejected += 1
+                key.ejected_until = self._clock() + self.reject_cooldown
+            logger.error(
+                "祕鑰 %s 遭拒（%d），停用 %.0f 秒", key.label, status, self.reject_cooldown,
+                extra={'provider': self.provider}
+            )
+            return True
+        return False
+
+    def observe(self, key: ApiKey, headers: Mapping[str, str]) -> None:
+        """
+        依回應標頭記錄該鑰之剩餘請求數（x-ratelimit-remaining-requests 與 x-ratelimit-reset-requests）
+
+        參數：
+            key: 所用之祕鑰
+            headers: 回應標頭
+        """
+        remaining = headers.get('x-ratelimit-remaining-requests')
+        if not isinstance(remaining, str) or not remaining.strip().isdigit():
+            return
+        reset = headers.get('x-ratelimit-reset-requests')
+        reset_after = _parse_duration(reset) if isinstance(reset, str) else None
+        with self._lock:
+            key.remaining = int(remaining)
+            key.reset_at = self._clock() + (reset_after if reset_after is not None else self.throttle_cooldown)
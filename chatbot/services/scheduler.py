@@ -0,0 +1,217 @@
+"""
+優先序排程器 - 於提供者呼叫之前依請求之類別分配名額
+此乃輕重緩急之序，先應對話，後辦雜務
+
+請求分屬互動（interactive）、批次（batch）、背景（background）等類別。名額有限時依加權公平排隊：
+各類別之虛擬時間每獲一名額即增 1/權重，名額釋出時交予虛擬時間最小之等候類別，
+故互動請求優先，而批次與背景工作仍依權重分得名額，不致餓死。
+各類別另有同時處理數之上限；批次與背景之上限合計小於總名額，為互動請求保留餘裕。
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from chatbot.exceptions import BusyError, QueueTimeoutError
+
+INTERACTIVE = 'interactive'  # 互動之對話
+BATCH = 'batch'  # 批次重播與離線作業
+BACKGROUND = 'background'  # 摘要、快取預熱等背景工作
+PRIORITIES = (INTERACTIVE, BATCH, BACKGROUND)  # 預設之類別，依優先序
+
+
+@dataclass(frozen=True)
+class PriorityClass:
+    """優先類別之設定"""
+    name: str  # 類別名稱
+    weight: float = 1.0  # 權重；名額競爭時依此比例分配
+    max_concurrency: Optional[int] = None  # 同時處理數上限；None 則僅受總名額所限
+    max_queue: int = 1024  # 佇列最大深度；0 則不排隊
+    max_queue_wait: float = 60.0  # 佇列中之最長等候（秒）
+
+
+@dataclass
+class ClassStats:
+    """單一類別之排程統計"""
+    admitted: int = 0  # 已獲名額數
+    rejected: int = 0  # 佇列已滿而速拒之數
+    expired: int = 0  # 等候逾時而捨棄之數
+    in_flight: int = 0  # 處理中之數
+    queued: int = 0  # 佇列中之數
+    peak_queued: int = 0  # 佇列之峰值
+    total_wait: float = 0.0  # 獲名額前之累計等候（秒）
+    max_wait: float = 0.0  # 獲名額前之最長等候（秒）
+
+    @property
+    def mean_wait(self) -> float:
+        """平均等候（秒）"""
+        return self.total_wait / self.admitted if self.admitted else 0.0
+
+
+def default_classes(max_concurrency: int) -> List[PriorityClass]:
+    """
+    預設之三個類別：互動不設上限；批次至多半數、背景至多四分之一之名額
+
+    參數：
+        max_concurrency: 總名額
+    """
+    return [
+        PriorityClass(INTERACTIVE, weight=8.0, max_queue_wait=10.0),
+        PriorityClass(BATCH, weight=2.0, max_concurrency=max(1, max_concurrency // 2)),
+        PriorityClass(BACKGROUND, weight=1.0, max_concurrency=max(1, max_concurrency // 4)),
+    ]
+
+
+class _Waiter:
+    """佇列中之一筆請求"""
+
+    __slots__ = ('event', 'enqueued')
+
+    def __init__(self):
+        self.event = threading.Event()  # 獲名額時設定
+        self.enqueued = time.monotonic()  # 入佇列之時刻
+
+
+class _ClassState:
+    """單一類別之執行期狀態"""
+
+    __slots__ = ('spec', 'stats', 'waiters', 'vtime')
+
+    def __init__(self, spec: PriorityClass):
+        self.spec = spec  # 類別設定
+        self.stats = ClassStats()  # 排程統計
+        self.waiters: Deque[_Waiter] = deque()  # 等候者，類別內先來先得
+        self.vtime = 0.0  # 虛擬時間
+
+    def has_room(self) -> bool:
+        limit = self.spec.max_concurrency
+        return limit is None or self.stats.in_flight < limit
+
+
+class PriorityScheduler:
+    """
+    依優先類別與權重分配提供者呼叫之名額
+    """
+
+    def __init__(self, max_concurrency: int = 16, classes: Optional[Sequence[PriorityClass]] = None):
+        """
+        參數：
+            max_concurrency: 總名額，即同時進行之提供者呼叫數
+            classes: 各類別之設定，同分時排前者優先；預設見 default_classes()
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency 須至少為 1")
+        if classes is None:
+            classes = default_classes(max_concurrency)
+        if not classes:
+            raise ValueError("須至少有一個優先類別")
+        self.max_concurrency = max_concurrency  # 總名額
+        self.in_flight = 0  # 處理中之總數
+        self._classes: Dict[str, _ClassState] = {}
+        for spec in classes:
+            if spec.weight <= 0:
+                raise ValueError(f"類別 {spec.name} 之權重須為正數")
+            self._classes[spec.name] = _ClassState(spec)
+        self._vclock = 0.0  # 最近一次分配時之虛擬時間
+        self._lock = threading.Lock()
+
+    @property
+    def classes(self) -> Tuple[str, ...]:
+        """各類別之名稱，依設定之順序"""
+        return tuple(self._classes)
+
+    @property
+    def stats(self) -> Dict[str, ClassStats]:
+        """各類別之排程統計；為取用當下之副本"""
+        with self._lock:
+            return {name: replace(state.stats) for name, state in self._classes.items()}
+
+    def _state(self, priority: str) -> _ClassState:
+        state = self._classes.get(priority)
+        if state is None:
+            raise ValueError(f"未知之優先類別: {priority}")
+        return state
+
+    def _grant(self, state: _ClassState) -> None:
+        """計入一次分配，推進其虛擬時間"""
+        self._vclock = max(self._vclock, state.vtime)
+        state.vtime += 1.0 / state.spec.weight
+        state.stats.in_flight += 1
+        self.in_flight += 1
+
+    def acquire(self, priority: str = INTERACTIVE, timeout: Optional[float] = None) -> None:
+        """
+        取得一個名額
+
+        參數：
+            priority: 優先類別
+            timeout: 本次等候上限（秒）；與類別之 max_queue_wait 取其短
+
+        異常：
+            ValueError: 未知之優先類別
+            BusyError: 類別之佇列已滿
+            QueueTimeoutError: 等候逾時
+        """
+        state = self._state(priority)
+        with self._lock:
+            if self.in_flight < self.max_concurrency and state.has_room() and not state.waiters:
+                self._grant(state)
+                state.stats.admitted += 1
+                return
+            if len(state.waiters) >= state.spec.max_queue:
+                state.stats.rejected += 1
+                raise BusyError(f"{priority} 佇列已滿")
+            if not state.waiters:
+                # 閒置後重新活躍之類別不得以累積之落後搶占名額
+                state.vtime = max(state.vtime, self._vclock)
+            waiter = _Waiter()
+            state.waiters.append(waiter)
+            state.stats.queued = len(state.waiters)
+            state.stats.peak_queued = max(state.stats.peak_queued, state.stats.queued)
+
+        wait = state.spec.max_queue_wait if timeout is None else min(timeout, state.spec.max_queue_wait)
+        granted = waiter.event.wait(max(0.0, wait))
+        with self._lock:
+            if not granted and not waiter.event.is_set():
+                state.waiters.remove(waiter)
+                state.stats.queued = len(state.waiters)
+                state.stats.expired += 1
+                raise QueueTimeoutError(f"{priority} 等候逾 {wait:.3f} 秒")
+            # 名額已由釋出者轉交並計入
+            waited = time.monotonic() - waiter.enqueued
+            state.stats.admitted += 1
+            state.stats.total_wait += waited
+            state.stats.max_wait = max(state.stats.max_wait, waited)
+
+    def release(self, priority: str = INTERACTIVE) -> None:
+        """釋出名額，並依虛擬時間轉交等候之類別"""
+        state = self._state(priority)
+        with self._lock:
+            state.stats.in_flight -= 1
+            self.in_flight -= 1
+            self._dispatch()
+
+    def _dispatch(self) -> None:
+        """將空出之名額交予虛擬時間最小、且未達其上限之等候類別"""
+        while self.in_flight < self.max_concurrency:
+            chosen = None
+            for state in self._classes.values():
+                if state.waiters and state.has_room() and (chosen is None or state.vtime < chosen.vtime):
+                    chosen = state
+            if chosen is None:
+                return
+            self._grant(chosen)
+            chosen.waiters.popleft().event.set()
+            chosen.stats.queued = len(chosen.waiters)
+
+    @contextmanager
+    def slot(self, priority: str = INTERACTIVE, timeout: Optional[float] = None) -> Iterator[None]:
+        """以上下文管理取得並釋出名額"""
+        self.acquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self.release(priority)
@@ -0,0 +1,402 @@
+"""
+一致性雜湊分片 - 將使用者分派至多個工作行程
+此乃分而治之之法，越過 GIL 之限，而各使用者之對話仍歸一處
+
+每個工作行程各有其 ChatBot 與 ConversationManager；前端路由器以一致性雜湊
+將 user_id 對應至工作者。增減工作者時僅少數使用者易主，其對話隨之遷移；
+遷移期間僅易主者之訊息暫候，其餘使用者照常處理。
+"""
+
+import bisect
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import threading
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from chatbot.deadline import Deadline
+from chatbot.handlers import ChatBot
+
+logger = logging.getLogger(__name__)
+
+
+def _ring_hash(key: str) -> int:
+    """雜湊環上之位置"""
+    digest = hashlib.blake2b(key.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class HashRing:
+    """
+    一致性雜湊環；每個節點以多個虛擬節點分佈於環上，以均衡負載
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = 128):
+        """
+        參數：
+            nodes: 初始節點
+            replicas: 每節點之虛擬節點數
+        """
+        self.replicas = replicas  # 每節點之虛擬節點數
+        self._points: List[int] = []  # 環上位置，遞增
+        self._owners: List[str] = []  # 與 _points 對應之節點
+        self.nodes: List[str] = []  # 節點
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str) -> None:
+        """加入節點"""
+        if node in self.nodes:
+            raise ValueError(f"節點已存在: {node}")
+        self.nodes.append(node)
+        for i in range(self.replicas):
+            point = _ring_hash(f"{node}#{i}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node: str) -> None:
+        """移除節點"""
+        self.nodes.remove(node)
+        kept = [(p, o) for p, o in zip(self._points, self._owners) if o != node]
+        self._points = [p for p, _ in kept]
+        self._owners = [o for _, o in kept]
+
+    def copy(self) -> 'HashRing':
+        """複製雜湊環"""
+        ring = HashRing(replicas=self.replicas)
+        ring._points, ring._owners, ring.nodes = list(self._points), list(self._owners), list(self.nodes)
+        return ring
+
+    def get(self, key: str) -> str:
+        """
+        取得鍵之所屬節點
+
+        異常：
+            LookupError: 環上無節點
+        """
+        if not self._points:
+            raise LookupError("雜湊環上無節點")
+        index = bisect.bisect(self._points, _ring_hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+def _worker_main(conn, chatbot_factory: Callable[[], ChatBot], threads: int) -> None:
+    """
+    工作行程之主迴圈
+
+    訊息處理交由執行緒池並行（提供者呼叫多為 I/O 等候），
+    成員變更之指令則於主迴圈內依序執行。
+    """
+    chatbot = chatbot_factory()
+    manager = chatbot.conversation_manager
+    send_lock = threading.Lock()
+    executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='shard')
+
+    def reply(request_id: int, status: str, result) -> None:
+        with send_lock:
+            conn.send((request_id, status, result))
+
+    def process(request_id: int, user_id: str, message: str, kwargs: dict, expires_at: Optional[float]) -> None:
+        try:
+            if expires_at is not None:
+                # 時限以牆鐘之絕對時刻傳來，佇列與傳遞所耗之時間不致重計
+                kwargs['deadline'] = Deadline.from_wall_clock(expires_at)
+            reply(request_id, 'ok', chatbot.process_message(user_id, message, **kwargs))
+        except Exception as e:
+            reply(request_id, 'error', f"{type(e).__name__}: {e}")
+
+    while True:
+        try:
+            request_id, command, args = conn.recv()
+        except EOFError:
+            break
+        if command == 'process':
+            executor.submit(process, request_id, *args)
+            continue
+        try:
+            if command == 'users':
+                result = manager.users()
+            elif command == 'export':
+                result = {user_id: list(manager.get_history(user_id)) for user_id in args[0]}
+            elif command == 'import':
+                for user_id, history in args[0].items():
+                    manager.clear_history(user_id)
+                    for content in history:
+                        manager.add_message(user_id, content)
+                result = len(args[0])
+            elif command == 'drop':
+                for user_id in args[0]:
+                    manager.clear_history(user_id)
+                result = len(args[0])
+            elif command == 'stop':
+                executor.shutdown(wait=True)
+                reply(request_id, 'ok', None)
+                break
+            else:
+                raise ValueError(f"未知之指令: {command}")
+            reply(request_id, 'ok', result)
+        except Exception as e:
+            reply(request_id, 'error', f"{type(e).__name__}: {e}")
+    conn.close()
+
+
+class _Worker:
+    """
+    路由器端之工作行程代理
+    請求附以編號送出，由讀取執行緒將回覆配回各自之 Future，故同一工作者可並行處理多則訊息
+    """
+
+    def __init__(self, name: str, context, chatbot_factory: Callable[[], ChatBot], threads: int):
+        self.name = name  # 工作者名稱
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, chatbot_factory, threads),
+            name=f"chatbot-{name}",
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self._pending: Dict[int, Future] = {}
+        self._ids = itertools.count()
+        self._send_lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_replies, name=f"shard-reader-{name}", daemon=True)
+        self._reader.start()
+
+    def _read_replies(self) -> None:
+        while True:
+            try:
+                request_id, status, result = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            future = self._pending.pop(request_id)
+            if status == 'ok':
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(f"工作者 {self.name} 執行失敗: {result}"))
+        for future in list(self._pending.values()):
+            future.set_exception(RuntimeError(f"工作者 {self.name} 已終止"))
+        self._pending.clear()
+
+    def call(self, command: str, *args):
+        future: Future = Future()
+        with self._send_lock:
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+            self.conn.send((request_id, command, args))
+        return future.result()
+
+    def stop(self) -> None:
+        try:
+            self.call('stop')
+        except (OSError, RuntimeError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+
+class ShardedChatBot:
+    """
+    前端路由器：以一致性雜湊將使用者分派至工作行程，介面同 ChatBot.process_message
+
+    chatbot_factory 於各工作行程內呼叫，以建立其專屬之 ChatBot，須為可序列化之模組層級函式。
+    工作行程預設以 forkserver（不支援之平台則 spawn）啟動：路由器於首個工作者之後即有讀取執行緒，
+    其後再 fork 則子行程可能繼承他執行緒所持之鎖。
+
+    路由僅於查得所屬工作者時持鎖，訊息之往返不持鎖。增減工作者時雜湊環即刻更替，
+    僅易主之使用者暫候：待其處理中之訊息完成、對話遷至新主後，方以新主處理，其餘使用者不受影響。
+    """
+
+    START_METHODS = ('forkserver', 'spawn')  # 預設之行程啟動方式，依序取平台所支援者
+    MIGRATION_BATCH = 64  # 每批遷移之使用者數；每批完成即放行
+
+    def __init__(
+        self,
+        chatbot_factory: Callable[[], ChatBot],
+        workers: int = 0,
+        replicas: int = 128,
+        start_method: Optional[str] = None,
+        threads_per_worker: int = 32
+    ):
+        """
+        參數：
+            chatbot_factory: 建立 ChatBot 之函式
+            workers: 初始工作行程數；0 則取 CPU 核心數
+            replicas: 每工作者之虛擬節點數
+            start_method: 行程啟動方式（"forkserver"、"spawn"、"fork"）；None 取 START_METHODS 中平台所支援者。
+                "fork" 僅宜於路由器尚無他執行緒時使用
+            threads_per_worker: 每工作行程並行處理訊息之執行緒數
+        """
+        self.chatbot_factory = chatbot_factory  # ChatBot 工廠
+        self.ring = HashRing(replicas=replicas)  # 一致性雜湊環
+        self.routed: Counter = Counter()  # 工作者 -> 已路由之訊息數
+        self.migrated = 0  # 累計遷移之使用者數
+        self.threads_per_worker = threads_per_worker  # 每工作行程之執行緒數
+        if start_method is None:
+            supported = multiprocessing.get_all_start_methods()
+            start_method = next(method for method in self.START_METHODS if method in supported)
+        self._context = multiprocessing.get_context(start_method)
+        self._workers: Dict[str, _Worker] = {}
+        self._names = (f"w{i}" for i in itertools.count())
+        self._cond = threading.Condition()  # 保護路由之狀態；訊息之往返不持之
+        self._in_flight: Counter = Counter()  # 使用者 -> 處理中之訊息數
+        self._previous: Optional[HashRing] = None  # 成員變更前之雜湊環；易主者於列出待遷者前暫候
+        self._moving: Set[str] = set()  # 對話尚待遷移之使用者
+        self._membership = threading.Lock()  # 成員變更依序為之
+        for _ in range(workers or multiprocessing.cpu_count()):
+            self.add_worker()
+
+    @property
+    def workers(self) -> List[str]:
+        """現有工作者名稱"""
+        return list(self.ring.nodes)
+
+    def owner(self, user_id: str) -> str:
+        """使用者之所屬工作者"""
+        return self.ring.get(user_id)
+
+    def _held(self, user_id: str) -> bool:
+        """使用者之訊息是否須待遷移（須持有 self._cond）"""
+        if user_id in self._moving:
+            return True
+        return self._previous is not None and self._previous.get(user_id) != self.ring.get(user_id)
+
+    def process_message(self, user_id: str, message: str, **kwargs) -> str:
+        """
+        將訊息路由至所屬工作者處理
+
+        參數：
+            user_id: 使用者識別
+            message: 使用者訊息
+            kwargs: 轉交 ChatBot.process_message 之參數（須可序列化）；deadline 以絕對時刻轉交
+
+        返回：
+            聊天機器人之回應
+        """
+        deadline = Deadline.coerce(kwargs.pop('deadline', None))
+        expires_at = deadline.wall_clock() if deadline is not None else None
+        with self._cond:
+            while self._held(user_id):
+                self._cond.wait()
+            name = self.ring.get(user_id)
+            worker = self._workers[name]
+            self._in_flight[user_id] += 1
+            self.routed[name] += 1
+        try:
+            return worker.call('process', user_id, message, kwargs, expires_at)
+        finally:
+            with self._cond:
+                self._in_flight[user_id] -= 1
+                if not self._in_flight[user_id]:
+                    del self._in_flight[user_id]
+                    self._cond.notify_all()
+
+    def add_worker(self, name: Optional[str] = None) -> str:
+        """
+        加入工作行程，並將改歸其所屬之使用者遷入
+
+        參數：
+            name: 工作者名稱；預設自動命名
+
+        返回：
+            工作者名稱
+        """
+        name = name or next(self._names)
+        worker = _Worker(name, self._context, self.chatbot_factory, self.threads_per_worker)
+        with self._membership:
+            with self._cond:
+                sources = list(self._workers.values())
+                self._workers[name] = worker
+                self._change_ring(lambda ring: ring.add(name))
+            self._rebalance(sources)
+        logger.info("已加入工作者 %s，共 %d 個", name, len(self._workers))
+        return name
+
+    def remove_worker(self, name: str) -> None:
+        """
+        移除工作行程，其使用者之對話遷至新的所屬工作者
+
+        參數：
+            name: 工作者名稱
+        """
+        with self._membership:
+            with self._cond:
+                if len(self._workers) == 1:
+                    raise ValueError("不可移除最後一個工作者")
+                source = self._workers[name]
+                self._change_ring(lambda ring: ring.remove(name))
+            self._rebalance([source])
+            with self._cond:
+                del self._workers[name]
+        source.stop()
+        logger.info("已移除工作者 %s，共 %d 個", name, len(self._workers))
+
+    def _change_ring(self, change: Callable[[HashRing], None]) -> None:
+        """更替雜湊環，並記下變更前者以辨認易主之使用者（須持有 self._cond）"""
+        self._previous = self.ring.copy()
+        change(self.ring)
+
+    def _rebalance(self, sources: List[_Worker]) -> None:
+        """
+        將易主者之對話自各來源工作者遷至新主
+
+        先待易主者處理中之訊息完成（其或於舊主建立對話），再列出待遷者；
+        未在其列之易主者（尚無對話）即可放行，其餘者逐一遷移後放行。
+        """
+        try:
+            with self._cond:
+                moved = self._previous
+                while any(moved.get(u) != self.ring.get(u) for u in self._in_flight):
+                    self._cond.wait()
+            moving: Dict[_Worker, Dict[str, List[str]]] = {}
+            for source in sources:
+                for user_id in source.call('users'):
+                    target = self.ring.get(user_id)
+                    if target != source.name:
+                        moving.setdefault(source, {}).setdefault(target, []).append(user_id)
+            with self._cond:
+                self._moving = {u for targets in moving.values() for users in targets.values() for u in users}
+                self._previous = None
+                self._cond.notify_all()
+            for source, targets in moving.items():
+                self._migrate(source, targets)
+        finally:
+            with self._cond:
+                self._previous = None
+                self._moving.clear()
+                self._cond.notify_all()
+
+    def _migrate(self, source: _Worker, moving: Dict[str, List[str]]) -> None:
+        """將使用者之對話自來源工作者移至各目標工作者（先匯入後刪除），每批完成即放行其使用者"""
+        for target_name, user_ids in moving.items():
+            for start in range(0, len(user_ids), self.MIGRATION_BATCH):
+                batch = user_ids[start:start + self.MIGRATION_BATCH]
+                histories = source.call('export', batch)
+                self._workers[target_name].call('import', histories)
+                source.call('drop', batch)
+                with self._cond:
+                    self.migrated += len(batch)
+                    self._moving.difference_update(batch)
+                    self._cond.notify_all()
+
+    def distribution(self) -> Dict[str, int]:
+        """各工作者持有之使用者數"""
+        with self._cond:
+            workers = dict(self._workers)
+        return {name: len(worker.call('users')) for name, worker in workers.items()}
+
+    def close(self) -> None:
+        """停止所有工作行程"""
+        with self._membership:
+            with self._cond:
+                workers, self._workers = list(self._workers.values()), {}
+                for worker in workers:
+                    self.ring.remove(worker.name)
+        for worker in workers:
+            worker.stop()
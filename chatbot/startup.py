@@ -0,0 +1,55 @@
+"""
+啟動階段計時
+此乃啟動之帳簿，記各階段之耗時
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+
+class StartupReport:
+    """
+    記錄啟動各階段之耗時，並產生分項報告
+    """
+
+    def __init__(self):
+        self._origin = time.perf_counter()  # 計時起點
+        self.phases: List[Tuple[str, float]] = []  # (階段名, 耗時秒數)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        計時一個啟動階段
+
+        參數：
+            name: 階段名
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def record(self, name: str, seconds: float) -> None:
+        """直接記錄一個階段之耗時（如預熱之分項）"""
+        self.phases.append((name, seconds))
+
+    @property
+    def total(self) -> float:
+        """自建立至今之總耗時（秒）"""
+        return time.perf_counter() - self._origin
+
+    def to_dict(self) -> Dict[str, float]:
+        """轉為字典"""
+        data = dict(self.phases)
+        data['total'] = self.total
+        return data
+
+    def format(self) -> str:
+        """轉為人可讀之文字報告"""
+        lines = ["啟動耗時分項:"]
+        for name, seconds in self.phases:
+            lines.append(f"  {name:<20} {seconds * 1000:>9.1f}ms")
+        lines.append(f"  {'total':<20} {self.total * 1000:>9.1f}ms")
+        return "\n".join(lines)
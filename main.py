@@ -3,8 +3,16 @@
 此乃系統之啟動門戶，驗證祕鑰之有無
 """
 
+import argparse
+import atexit
 import logging
+import os
+import queue
+import signal
 import sys
+import threading
+import time
+from typing import Callable, Optional
 
 from chatbot import (
     load_environment_variables,
@@ -12,66 +20,238 @@ from chatbot import (
     ConversationManager,
     APIHandler,
 )
+from chatbot.exceptions import SnapshotError
+from chatbot.logging_setup import setup_logging
+from chatbot.profiling import RequestProfiler
+from chatbot.services import KeyPool, preload_sdks
+from chatbot.startup import StartupReport
 
-# 配置日誌
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 
-def main():
+class Termination:
+    """
+    SIGTERM 之旗標
+
+    滾動部署以 SIGTERM 終止行程；處理器僅設旗標，由互動迴圈於等候輸入時察覺，
+    處理中之訊息完成後正常退出並封存對話。
+    """
+
+    def __init__(self):
+        self.requested = False  # 是否已收到終止訊號
+
+    def install(self) -> None:
+        """安裝處理器（須於主執行緒呼叫）"""
+        signal.signal(signal.SIGTERM, self._handle)
+
+    def _handle(self, _signum, _frame) -> None:
+        # 處理器中不取鎖、不記日誌：主執行緒或正持有之
+        self.requested = True
+
+
+class InputReader:
+    """
+    於背景執行緒讀取標準輸入
+
+    主執行緒阻塞於 input() 時，於系統呼叫之前抵達之訊號不致中斷之，終止訊號遂遭延宕；
+    故改由背景執行緒讀取，主執行緒定時察看旗標。
+    """
+
+    POLL_INTERVAL = 0.2  # 察看終止旗標之間隔（秒）
+
+    def __init__(self, prompt: str):
+        """
+        參數：
+            prompt: 提示字串
+        """
+        self.prompt = prompt  # 提示字串
+        self._wanted = threading.Event()  # 主執行緒待讀下一行
+        self._lines: "queue.Queue[Optional[str]]" = queue.Queue()  # 讀得之行；None 表示輸入已結束
+        # 非終端之輸入另開串流讀取：sys.stdin 之鎖若於退出時為背景執行緒所持，直譯器無法收尾
+        self._stream = None if sys.stdin.isatty() else open(
+            sys.stdin.fileno(), 'r', encoding=sys.stdin.encoding, closefd=False
+        )
+        threading.Thread(target=self._read_loop, name='stdin-reader', daemon=True).start()
+
+    def _readline(self) -> str:
+        if self._stream is None:
+            return input(self.prompt)  # 終端保留行編輯
+        sys.stdout.write(self.prompt)
+        sys.stdout.flush()
+        line = self._stream.readline()
+        if not line:
+            raise EOFError
+        return line.rstrip('\n')
+
+    def _read_loop(self) -> None:
+        while True:
+            self._wanted.wait()
+            self._wanted.clear()
+            try:
+                line = self._readline()
+            except EOFError:
+                self._lines.put(None)
+                return
+            self._lines.put(line)
+
+    def read(self, stop: Callable[[], bool]) -> Optional[str]:
+        """
+        讀取一行
+
+        參數：
+            stop: 等候中定時呼叫，為真則放棄等候
+
+        返回：
+            讀得之行；輸入已結束或 stop() 為真則為 None
+        """
+        self._wanted.set()
+        while not stop():
+            try:
+                return self._lines.get(timeout=self.POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return None
+
+
+def restore_snapshot(conversation_manager: ConversationManager, path: str) -> int:
+    """
+    自快照復原對話；快照毀損或版本不符則移至一旁，以空白之對話啟動
+
+    參數：
+        conversation_manager: 對話管理器
+        path: 快照路徑
+
+    返回：
+        復原之使用者數
+    """
+    try:
+        return conversation_manager.restore(path)
+    except SnapshotError as e:
+        aside = f"{path}.bad-{time.strftime('%Y%m%d-%H%M%S')}"
+        os.replace(path, aside)
+        logger.error("快照無法復原: %s；已移至 %s，以空白之對話啟動", e, aside)
+        return 0
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """解析命令行參數"""
+    parser = argparse.ArgumentParser(description="聊天機器人")
+    parser.add_argument('--prewarm', action='store_true', help="就緒前預熱兩端之連線")
+    parser.add_argument('--snapshot', help="對話快照路徑：啟動時復原，退出時封存")
+    parser.add_argument('--log-format', choices=['json', 'text'], default='json', help="日誌格式")
+    parser.add_argument('--log-level', default='INFO', help="日誌層級")
+    parser.add_argument('--profile', type=int, metavar='N', help="剖析啟動後之前 N 則請求")
+    parser.add_argument('--profile-mode', choices=RequestProfiler.MODES, default='cprofile', help="剖析模式")
+    parser.add_argument('--profile-dir', default='profiles', help="剖析結果之輸出目錄")
+    parser.add_argument('--key-strategy', choices=KeyPool.STRATEGIES, default='least_in_flight',
+                        help="多把祕鑰之選鑰策略")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
     """
     主程式入口點
     驗證環境變數，初始化系統
     """
+    args = parse_args(argv)
+
+    # 配置日誌：記錄經佇列交予背景執行緒輸出，退出時排空
+    listener = setup_logging(getattr(logging, args.log_level.upper()), json_format=args.log_format == 'json')
+    atexit.register(listener.stop)
+
+    startup = StartupReport()
     try:
+        # 重型 SDK 於背景載入，與環境變數驗證並行
+        with startup.phase('sdk_preload_start'):
+            preload_thread = preload_sdks(background=True)
+
         # 驗證環境變數
         logger.info("驗證環境變數中...")
-        config = load_environment_variables()
+        with startup.phase('config'):
+            config = load_environment_variables()
         logger.info("環境變數驗證成功")
 
         # 初始化各元件
         logger.info("初始化系統元件中...")
-        api_handler = APIHandler(
-            gemini_key=config['GEMINI_API_KEY'],
-            perplexity_key=config['PERPLEXITY_API_KEY']
-        )
-        conversation_manager = ConversationManager()
-        chatbot = ChatBot(api_handler, conversation_manager)
+        with startup.phase('components'):
+            api_handler = APIHandler(
+                gemini_key=config['GEMINI_API_KEYS'],
+                perplexity_key=config['PERPLEXITY_API_KEYS'],
+                key_strategy=args.key_strategy
+            )
+            conversation_manager = ConversationManager()
+            # 剖析器：--profile 即時啟動，或以 SIGUSR1 按需啟停
+            profiler = RequestProfiler(args.profile_dir, args.profile_mode, args.profile or 100)
+            profiler.install_signal()
+            if args.profile:
+                profiler.start()
+            chatbot = ChatBot(api_handler, conversation_manager, profiler=profiler)
+        if args.snapshot and os.path.exists(args.snapshot):
+            with startup.phase('snapshot_restore'):
+                restored = restore_snapshot(conversation_manager, args.snapshot)
+            logger.info("已自快照復原 %d 位使用者之對話", restored)
+        with startup.phase('sdk_preload_wait'):
+            preload_thread.join()
         logger.info("系統初始化完成")
 
+        # 預熱連線
+        if args.prewarm:
+            logger.info("預熱連線中...")
+            for provider, seconds in api_handler.prewarm().items():
+                startup.record(f'prewarm_{provider}', seconds)
+
+        logger.info("系統就緒\n%s", startup.format())
+
         # 簡單之互動迴圈
+        termination = Termination()
+        termination.install()
+        reader = InputReader("\n[汝曰]: ")
         logger.info("聊天機器人已啟動，請輸入訊息（輸入 'quit' 以退出）")
         user_id = "default_user"
 
-        while True:
-            try:
-                user_input = input("\n[汝曰]: ").strip()
-                if not user_input:
-                    continue
-                if user_input.lower() == 'quit':
-                    logger.info("使用者要求退出")
-                    break
+        try:
+            while True:
+                try:
+                    user_input = reader.read(lambda: termination.requested)
+                    if termination.requested:
+                        logger.info("收到終止訊號，封存後退出")
+                        break
+                    if user_input is None:
+                        logger.info("輸入已結束")
+                        break
+                    user_input = user_input.strip()
+                    if not user_input:
+                        continue
+                    if user_input.lower() == 'quit':
+                        logger.info("使用者要求退出")
+                        break
 
-                # 處理訊息
-                response = chatbot.process_message(user_id, user_input)
-                print(f"[機器人]: {response}")
+                    # 處理訊息
+                    response = chatbot.process_message(user_id, user_input)
+                    print(f"[機器人]: {response}")
 
-            except KeyboardInterrupt:
-                logger.info("使用者中斷程式")
-                break
-            except Exception as e:
-                logger.error(f"處理訊息時出錯: {e}")
-                print("抱歉，處理您的訊息時出現錯誤。請稍後再試。")
+                except KeyboardInterrupt:
+                    logger.info("使用者中斷程式")
+                    break
+                except Exception as e:
+                    logger.error("處理訊息時出錯: %s", e)
+                    print("抱歉，處理您的訊息時出現錯誤。請稍後再試。")
+        finally:
+            # 正常退出、中斷或異常皆寫出未完成之剖析，並封存對話供下次啟動復原
+            profiler.stop()
+            if args.snapshot:
+                try:
+                    saved = conversation_manager.snapshot(args.snapshot)
+                    logger.info("已封存 %d 位使用者之對話至 %s", saved, args.snapshot)
+                except Exception as e:
+                    logger.error("封存對話失敗: %s", e)
 
     except SystemExit as e:
         # 環境變數驗證失敗，已由 load_environment_variables() 記錄錯誤並終止
         logger.error("應用程式因環境變數驗證失敗而終止")
         sys.exit(e.code)
     except Exception as e:
-        logger.error(f"應用程式啟動失敗: {e}")
+        logger.error("應用程式啟動失敗: %s", e)
         sys.exit(1)
 
 
@@ -3,21 +3,31 @@
 此乃一個簡潔之對話系統，藉 Gemini 模型與用戶往來
 """
 
+import threading
+
 from dotenv import dotenv_values
-from google import genai
-from google.genai import types
 
 # 初始化配置
 config = dotenv_values()
 GOOGLE_API_KEY = config.get("GOOGLE_API_KEY")  # 祕鑰
-client = genai.Client(api_key=GOOGLE_API_KEY)  # 客戶端
 MODEL_ID = "gemini-2.5-flash"  # 模型名
+_client = None  # 客戶端，首次問答時方建立
 
 # 對話狀態
 chat_log = []  # 對話錄
 backtrace = 2  # 回溯數
 
 
+def get_client():
+    """取客戶端 - 首用方建，免啟動之遲滯"""
+    global _client
+    if _client is None:
+        from google import genai
+
+        _client = genai.Client(api_key=GOOGLE_API_KEY)
+    return _client
+
+
 def ask(sys_msg, user_msg):
     """
     問答之門，承前啟後
@@ -30,9 +40,10 @@ def ask(sys_msg, user_msg):
         AI 之回應
     """
     global chat_log
+    from google.genai import types
     
     # 建對話
-    chat = client.chats.create(
+    chat = get_client().chats.create(
         model=MODEL_ID,
         history=chat_log,
         config=types.GenerateContentConfig(
@@ -53,6 +64,7 @@ def main():
     """主程序 - 循問答，至無言止"""
     sys_msg = '繁體中文小助理'  # 預設角色
     print(f'AI 角色設定為: {sys_msg}\n')
+    threading.Thread(target=get_client, daemon=True).start()  # 候用戶輸入時建客戶端
     
     try:
         while True:
@@ -0,0 +1,135 @@
+"""
+入場控制之測試
+此乃驗證量力而行之試煉
+"""
+
+import threading
+import time
+from unittest.mock import Mock
+
+import pytest
+
+from chatbot.exceptions import BusyError, QueueTimeoutError
+from chatbot.handlers import AdmissionController, ChatBot
+from chatbot.models import ConversationManager
+from chatbot.services import BACKGROUND, BATCH, INTERACTIVE, APIHandler
+
+
+class TestAdmissionController:
+    """入場控制器測試"""
+
+    def test_admits_within_concurrency(self):
+        """驗證未達上限時即刻入場"""
+        controller = AdmissionController(max_concurrency=2, max_queue=0)
+        controller.acquire()
+        controller.acquire()
+        assert controller.stats.in_flight == 2
+        controller.release()
+        controller.release()
+        assert controller.stats.in_flight == 0
+
+    def test_rejects_fast_when_queue_full(self):
+        """驗證佇列已滿時即刻拒絕"""
+        controller = AdmissionController(max_concurrency=1, max_queue=0)
+        controller.acquire()
+        start = time.monotonic()
+        with pytest.raises(BusyError):
+            controller.acquire()
+        assert time.monotonic() - start < 0.1
+        assert controller.stats.rejected == 1
+
+    def test_queued_request_expires(self):
+        """驗證等候逾時者被捨棄"""
+        controller = AdmissionController(max_concurrency=1, max_queue=1, max_queue_wait=0.05)
+        controller.acquire()
+        with pytest.raises(QueueTimeoutError):
+            controller.acquire()
+        assert controller.stats.expired == 1
+        assert controller.stats.queued == 0
+
+    def test_slot_handed_to_queue_head(self):
+        """驗證名額釋出時轉交佇列之首"""
+        controller = AdmissionController(max_concurrency=1, max_queue=4, max_queue_wait=1)
+        controller.acquire()
+        order = []
+
+        def waiter(i):
+            controller.acquire()
+            order.append(i)
+            controller.release()
+
+        threads = []
+        for i in range(3):
+            t = threading.Thread(target=waiter, args=(i,))
+            t.start()
+            threads.append(t)
+            time.sleep(0.02)  # 確保排隊次序
+        controller.release()
+        for t in threads:
+            t.join()
+
+        assert order == [0, 1, 2]
+        assert controller.stats.in_flight == 0
+        assert controller.stats.admitted == 4
+
+    def test_weighted_handoff_does_not_starve_background(self):
+        """驗證名額依權重交錯分配：互動請求多得，背景請求於互動請求積壓時仍得入場"""
+        controller = AdmissionController(
+            max_concurrency=1, max_queue=16, max_queue_wait=2, weights={INTERACTIVE: 3, BACKGROUND: 1}
+        )
+        controller.acquire(priority=BACKGROUND)
+        order = []
+
+        def waiter(priority):
+            controller.acquire(priority=priority)
+            order.append(priority)
+            controller.release()
+
+        threads = []
+        for i, priority in enumerate([BACKGROUND] * 4 + [INTERACTIVE] * 6):
+            t = threading.Thread(target=waiter, args=(priority,))
+            t.start()
+            threads.append(t)
+            while controller.stats.queued < i + 1:  # 確保排隊次序
+                time.sleep(0.001)
+        controller.release()
+        for t in threads:
+            t.join()
+
+        assert ''.join(p[0] for p in order) == "iiiibiibbb"
+        assert controller.stats.expired == 0
+        assert controller.stats.in_flight == 0
+        assert controller.stats.queued == 0
+
+    def test_unlisted_priority_admitted(self):
+        """驗證未列權重之類別以權重 1 排隊"""
+        controller = AdmissionController(max_concurrency=1, max_queue=1, weights={BATCH: 2})
+        controller.acquire(priority='urgent')
+        controller.release()
+        assert controller.stats.admitted == 1
+        with pytest.raises(ValueError):
+            AdmissionController(weights={BATCH: 0})
+
+
+class TestChatBotAdmission:
+    """ChatBot 入場控制整合測試"""
+
+    def test_busy_reply_and_no_history(self):
+        """驗證過載時回覆忙碌，且被拒之訊息不入歷史"""
+        gate = threading.Event()
+        api_handler = Mock(spec=APIHandler)
+        api_handler.query_gemini = Mock(side_effect=lambda prompt, **kwargs: gate.wait(1) and "好")
+        conversation_manager = ConversationManager()
+        chatbot = ChatBot(api_handler, conversation_manager,
+                          admission=AdmissionController(max_concurrency=1, max_queue=0))
+
+        worker = threading.Thread(target=chatbot.process_message, args=("u1", "第一則"))
+        worker.start()
+        time.sleep(0.05)
+
+        assert chatbot.process_message("u2", "第二則") == ChatBot.BUSY_MESSAGE
+        assert conversation_manager.get_history("u2") == []
+
+        gate.set()
+        worker.join()
+        assert chatbot.admission.stats.in_flight == 0
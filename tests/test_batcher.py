@@ -0,0 +1,170 @@
+"""
+微批次處理器之測試
+此乃驗證聚沙成塔之試煉
+"""
+
+import threading
+import time
+
+import pytest
+
+from chatbot.services import BATCH, APIHandler, FakeBatchEndpoint, GeminiBatchBackend, MicroBatcher
+
+
+class TestMicroBatcher:
+    """微批次聚合測試"""
+
+    def test_results_routed_to_callers(self):
+        """驗證各結果送回對應之呼叫者"""
+        batcher = MicroBatcher(lambda prompts: [p.upper() for p in prompts], max_wait=0.01)
+        futures = [batcher.submit(f"q{i}") for i in range(10)]
+        assert [f.result(timeout=1) for f in futures] == [f"Q{i}" for i in range(10)]
+        batcher.close()
+
+    def test_batch_size_limit(self):
+        """驗證單批不逾上限"""
+        sizes = []
+
+        def backend(prompts):
+            sizes.append(len(prompts))
+            return prompts
+
+        batcher = MicroBatcher(backend, max_batch_size=4, max_wait=0.2)
+        futures = [batcher.submit(str(i)) for i in range(10)]
+        for f in futures:
+            f.result(timeout=2)
+        batcher.close()
+
+        assert max(sizes) <= 4
+        assert sum(sizes) == 10
+        assert batcher.stats.items == 10
+
+    def test_window_flushes_partial_batch(self):
+        """驗證時窗屆滿時送出未滿之批次"""
+        batcher = MicroBatcher(lambda prompts: prompts, max_batch_size=100, max_wait=0.02)
+        start = time.monotonic()
+        assert batcher.submit("一").result(timeout=1) == "一"
+        assert time.monotonic() - start < 0.5
+        batcher.close()
+
+    def test_per_item_and_batch_failures(self):
+        """驗證單筆失敗與整批失敗皆傳至 Future"""
+        batcher = MicroBatcher(lambda prompts: [ValueError("壞") if p == "bad" else p for p in prompts])
+        good, bad = batcher.submit("good"), batcher.submit("bad")
+        assert good.result(timeout=1) == "good"
+        with pytest.raises(ValueError):
+            bad.result(timeout=1)
+        batcher.close()
+
+        def broken(prompts):
+            raise ConnectionError("斷線")
+
+        batcher = MicroBatcher(broken)
+        with pytest.raises(ConnectionError):
+            batcher.submit("x").result(timeout=1)
+        batcher.close()
+        assert batcher.stats.failed_batches == 1
+
+    def test_submit_after_close(self):
+        """驗證關閉後提交拋出異常"""
+        batcher = MicroBatcher(lambda prompts: prompts)
+        batcher.close()
+        with pytest.raises(RuntimeError):
+            batcher.submit("x")
+
+    def test_submit_racing_close_never_strands_futures(self):
+        """驗證與關閉競爭之提交，或被拒絕，或得到結果"""
+        for _ in range(20):
+            batcher = MicroBatcher(lambda prompts: prompts, max_wait=0.001)
+            futures = []
+            start = threading.Barrier(3)
+
+            def submit():
+                start.wait()
+                for i in range(50):
+                    try:
+                        futures.append(batcher.submit(str(i)))
+                    except RuntimeError:
+                        return
+
+            threads = [threading.Thread(target=submit) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            start.wait()
+            batcher.close()
+            for thread in threads:
+                thread.join()
+            assert all(future.result(timeout=1) is not None for future in futures)
+
+
+class TestGeminiBatchBackend:
+    """批次介面後端測試（使用本地模擬端點）"""
+
+    def test_concurrent_callers_share_batches(self):
+        """驗證並行之呼叫者經同一批次作業取得各自之回應"""
+        endpoint = FakeBatchEndpoint(latency=0.01)
+        backend = GeminiBatchBackend(lambda: endpoint, 'gemini-test', poll_interval=0.005)
+        batcher = MicroBatcher(backend, max_batch_size=50, max_wait=0.05)
+
+        results = {}
+
+        def call(i):
+            results[i] = batcher.submit(f"問{i}").result(timeout=2)
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        batcher.close()
+
+        assert results == {i: f"回應: 問{i}" for i in range(20)}
+        assert len(endpoint.batch_sizes) < 20
+
+    def test_failed_job_and_item_errors(self):
+        """驗證作業失敗與單筆錯誤之處理"""
+        backend = GeminiBatchBackend(lambda: FakeBatchEndpoint(fail_jobs=True), 'm', poll_interval=0)
+        with pytest.raises(RuntimeError):
+            backend(["x"])
+
+        def responder(prompt):
+            if prompt == "bad":
+                raise ValueError("拒答")
+            return "好"
+
+        backend = GeminiBatchBackend(lambda: FakeBatchEndpoint(responder), 'm', poll_interval=0)
+        good, bad = backend(["good", "bad"])
+        assert good == "好"
+        assert isinstance(bad, RuntimeError)
+
+
+class TestAPIHandlerBatching:
+    """APIHandler 之批次整合測試"""
+
+    def test_submit_gemini_uses_batcher(self):
+        """驗證啟用批次後 submit_gemini 經批次端點處理"""
+        endpoint = FakeBatchEndpoint()
+        handler = APIHandler("g", "p")
+        handler._gemini_clients["g"] = endpoint
+        handler.enable_gemini_batching(max_wait=0.01, poll_interval=0)
+
+        assert handler.submit_gemini("你好").result(timeout=1) == "回應: 你好"
+        assert endpoint.batch_sizes == [1]
+        handler.close()
+
+    def test_submit_gemini_without_batching(self):
+        """驗證未啟用批次時即時查詢"""
+        handler = APIHandler("g", "p")
+        handler.query_gemini = lambda prompt: "即時"
+        assert handler.submit_gemini("你好").result() == "即時"
+
+    def test_non_interactive_query_routed_through_batcher(self):
+        """驗證啟用批次後，非互動之查詢經批次送出，互動之查詢照常即時"""
+        endpoint = FakeBatchEndpoint()
+        handler = APIHandler("g", "p")
+        handler._gemini_clients["g"] = endpoint
+        handler.enable_gemini_batching(max_wait=0.01, poll_interval=0)
+
+        assert handler.query_gemini("背景", priority=BATCH) == "回應: 背景"
+        assert endpoint.batch_sizes == [1]
+        handler.close()
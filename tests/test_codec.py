@@ -0,0 +1,122 @@
+"""
+JSON 編解碼層之測試
+此乃驗證各後端之譯文一致
+"""
+
+import json
+
+import pytest
+
+from chatbot import codec
+from chatbot.codec import get_json_codec
+
+
+def _available(name: str) -> bool:
+    try:
+        get_json_codec(name)
+    except ImportError:
+        return False
+    return True
+
+
+BACKENDS = [
+    pytest.param(name, marks=pytest.mark.skipif(not _available(name), reason=f"未安裝 {name}"))
+    for name in ('json', 'orjson', 'msgspec')
+]
+
+
+def perplexity_response(content: str = "量子糾纏乃兩粒子之關聯。", citations: int = 50) -> dict:
+    """仿 Perplexity 之回應：長串引用在前，choices 在後"""
+    return {
+        "id": "resp-1",
+        "model": "sonar",
+        "usage": {"prompt_tokens": 12, "completion_tokens": 345, "total_tokens": 357},
+        "citations": [f"https://example.com/article/{i}" for i in range(citations)],
+        "search_results": [
+            {"title": f"文章 {i}", "url": f"https://example.com/article/{i}", "snippet": "引文 \"choices\": [] " * 5}
+            for i in range(citations)
+        ],
+        "object": "chat.completion",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+    }
+
+
+@pytest.mark.parametrize("name", BACKENDS)
+class TestJsonCodec:
+    """各後端之編解碼測試"""
+
+    def test_round_trip(self, name):
+        """驗證編碼後解碼還原，非 ASCII 不轉義"""
+        backend = get_json_codec(name)
+        obj = {"user_id": "user1", "message": "你好", "n": [1, 2.5, None, True]}
+        data = backend.dumps(obj)
+        assert isinstance(data, bytes)
+        assert "你好".encode('utf-8') in data
+        assert backend.loads(data) == obj
+        assert backend.loads(data.decode('utf-8')) == obj
+        assert json.loads(backend.dumps(obj, pretty=True)) == obj
+
+    def test_chat_content_matches_full_parse(self, name):
+        """驗證僅取內容之結果與全量解析一致"""
+        backend = get_json_codec(name)
+        data = json.dumps(perplexity_response("答案含 \"choices\": 字樣")).encode('utf-8')
+        assert backend.chat_content(data) == "答案含 \"choices\": 字樣"
+
+    def test_chat_content_ignores_nested_choices_key(self, name):
+        """驗證巢狀之同名鍵不致誤取"""
+        backend = get_json_codec(name)
+        response = perplexity_response("正解")
+        response["search_results"][0]["choices"] = [{"message": {"content": "誘餌"}}]
+        response["trailer"] = {"choices": "非陣列"}
+        assert backend.chat_content(json.dumps(response)) == "正解"
+
+    def test_chat_content_ignores_well_formed_decoy_after_key(self, name):
+        """驗證頂層鍵之後、形態無誤之巢狀同名鍵不致誤取"""
+        backend = get_json_codec(name)
+        response = perplexity_response("正解")
+        response["trailer"] = {"choices": [{"message": {"content": "誘餌"}}], "usage": {"prompt_tokens": 1}}
+        data = json.dumps(response, ensure_ascii=False).encode('utf-8')
+        assert backend.chat_content(data) == "正解"
+        assert backend.chat_usage(data) == response["usage"]
+        assert codec._partial_value(b'{"a": {"usage": 1}, "usage": 2, "b": [{"usage": 3}]}', b'usage') == 2
+
+    def test_chat_content_across_window_boundary(self, name):
+        """驗證值跨越局部解碼之窗界時（含多位元組字元），結果仍與全量解析一致"""
+        backend = get_json_codec(name)
+        for pad in range(4):
+            content = "甲" * pad + "乙" * (codec._WINDOW // 3)
+            data = json.dumps({"choices": [{"message": {"content": content}}]}, ensure_ascii=False).encode('utf-8')
+            assert backend.chat_content(data) == content
+        # 窗末截斷之純量不得採信
+        data = json.dumps({"usage": {"prompt_tokens": 10 ** 4200}}).encode('utf-8')
+        assert codec._partial_value(data, b'usage') == {"prompt_tokens": 10 ** 4200}
+
+    def test_chat_usage(self, name):
+        """驗證僅取 usage，缺少或形態不符時為 None"""
+        backend = get_json_codec(name)
+        data = json.dumps(perplexity_response()).encode('utf-8')
+        assert backend.chat_usage(data) == {"prompt_tokens": 12, "completion_tokens": 345, "total_tokens": 357}
+        assert backend.chat_usage(json.dumps({"choices": []})) is None
+        assert backend.chat_usage(json.dumps({"usage": {"prompt_tokens": "12"}})) is None
+
+    @pytest.mark.parametrize("body", [
+        {"choices": []},
+        {"choices": [{"message": {}}]},
+        {"error": {"message": "rate limited"}},
+    ])
+    def test_chat_content_rejects_malformed(self, name, body):
+        """驗證缺少內容之回應引發 ValueError"""
+        with pytest.raises(ValueError):
+            get_json_codec(name).chat_content(json.dumps(body).encode('utf-8'))
+
+
+def test_default_backend_is_fastest_installed():
+    """驗證預設後端依序取 orjson、msgspec、標準庫"""
+    expected = next((name for name in ('orjson', 'msgspec') if _available(name)), 'json')
+    assert codec.BACKEND == expected
+
+
+def test_unknown_backend_rejected():
+    """驗證未知之後端被拒"""
+    with pytest.raises(ValueError):
+        get_json_codec("yaml")
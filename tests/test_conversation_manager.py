@@ -3,6 +3,11 @@
 此乃驗證對話記錄之試煉
 """
 
+import os
+import time
+
+import pytest
+
 from hypothesis import given, strategies as st
 from chatbot.models import ConversationManager
 
@@ -153,3 +158,214 @@ def test_property_7_user_isolation(user_id: str, messages: list):
     
     # 驗證歷史長度與訊息數相符
     assert len(history) == len(messages)
+
+
+class TestConversationTiering:
+    """冷熱分層測試"""
+
+    def test_capacity_demotes_least_recently_used(self):
+        """驗證熱層超額時最久未用者降至冷層"""
+        manager = ConversationManager(hot_capacity=2)
+        manager.add_message("a", "甲")
+        manager.add_message("b", "乙")
+        manager.get_history("a")  # a 較 b 新
+        manager.add_message("c", "丙")
+
+        assert set(manager.conversations) == {"a", "c"}
+        assert "b" in manager.cold
+        assert manager.tier_stats().demotions == 1
+
+    def test_cold_session_rehydrates_transparently(self):
+        """驗證冷層之歷史於下次取用時原樣升回"""
+        manager = ConversationManager(hot_capacity=1)
+        manager.add_message("a", "訊息1")
+        manager.add_message("a", "訊息2")
+        manager.add_message("b", "其他")
+
+        assert "a" not in manager.conversations
+        assert manager.get_history("a") == ["訊息1", "訊息2"]
+        manager.add_message("a", "訊息3")
+        assert manager.get_history("a") == ["訊息1", "訊息2", "訊息3"]
+        assert manager.tier_stats().promotions == 1
+
+    def test_idle_sessions_demoted(self):
+        """驗證閒置逾時者降層"""
+        manager = ConversationManager(idle_seconds=60)
+        manager.add_message("a", "甲")
+        manager.add_message("b", "乙")
+
+        demoted = manager.demote_idle(now=time.monotonic() + 61)
+
+        assert demoted == 2
+        stats = manager.tier_stats()
+        assert (stats.hot_users, stats.cold_users) == (0, 2)
+        assert stats.cold_bytes > 0
+
+    def test_spill_to_disk(self, tmp_path):
+        """驗證冷層溢寫至磁碟並於取用時讀回"""
+        manager = ConversationManager(hot_capacity=1, cold_dir=str(tmp_path))
+        manager.add_message("a", "甲" * 100)
+        manager.add_message("b", "乙")
+
+        assert manager.cold == {}
+        assert manager.tier_stats().spilled_users == 1
+        assert len(list(tmp_path.iterdir())) == 1
+        assert manager.get_history("a") == ["甲" * 100]
+        assert len(list(tmp_path.iterdir())) == 1  # a 升回而 b 降層
+
+    def test_accessed_user_not_demoted(self):
+        """驗證正在取用之使用者不因閒置門檻極短而隨即降層"""
+        manager = ConversationManager(hot_capacity=1, idle_seconds=1e-9)
+        manager.add_message("a", "甲")
+        assert manager.get_history("a") == ["甲"]
+        manager.add_message("b", "乙")
+        assert manager.get_history("a") == ["甲"]
+        assert manager.get_history("b") == ["乙"]
+
+    def test_rejects_invalid_tier_limits(self):
+        """驗證熱層容量須至少為 1、閒置門檻須為正數"""
+        with pytest.raises(ValueError):
+            ConversationManager(hot_capacity=0)
+        with pytest.raises(ValueError):
+            ConversationManager(idle_seconds=0)
+
+    def test_clear_history_removes_spilled_file(self, tmp_path):
+        """驗證清除歷史亦刪除溢寫之檔案"""
+        manager = ConversationManager(hot_capacity=1, cold_dir=str(tmp_path))
+        manager.add_message("a", "甲")
+        manager.add_message("b", "乙")
+        manager.clear_history("a")
+
+        assert list(tmp_path.iterdir()) == []
+        assert manager.get_history("a") == []
+        assert manager.users() == ["b"]
+
+    def test_clear_history_removes_cold_copy(self):
+        """驗證清除歷史亦移除冷層之副本"""
+        manager = ConversationManager(hot_capacity=1)
+        manager.add_message("a", "甲")
+        manager.add_message("b", "乙")
+        manager.clear_history("a")
+
+        assert manager.get_history("a") == []
+        assert manager.tier_stats().cold_bytes == 0
+
+
+@given(
+    histories=st.dictionaries(
+        st.text(min_size=1, max_size=5),
+        st.lists(st.text(max_size=30), min_size=1, max_size=6),
+        max_size=8
+    )
+)
+def test_property_tiering_preserves_history(histories: dict):
+    """
+    **Feature: perplexity-chatbot, 冷熱分層不改變歷史**
+
+    對任何使用者與訊息序列，啟用冷熱分層後所得之歷史應與未分層者相同。
+    """
+    plain = ConversationManager()
+    tiered = ConversationManager(hot_capacity=1)
+    for user_id, messages in histories.items():
+        for message in messages:
+            plain.add_message(user_id, message)
+            tiered.add_message(user_id, message)
+
+    for user_id in histories:
+        assert tiered.get_history(user_id) == plain.get_history(user_id)
+
+
+class TestConversationSnapshot:
+    """快照與復原測試"""
+
+    def _populated(self):
+        manager = ConversationManager(hot_capacity=2)
+        for i in range(5):
+            manager.add_message(f"user{i}", f"問{i}")
+            manager.add_message(f"user{i}", f"答{i}")
+        return manager
+
+    def test_round_trip_includes_cold_users(self, tmp_path):
+        """驗證快照涵蓋熱層與冷層，且復原後歷史一致"""
+        path = str(tmp_path / "state.snap")
+        assert self._populated().snapshot(path) == 5
+
+        for lazy in (True, False):
+            restored = ConversationManager()
+            assert restored.restore(path, lazy=lazy) == 5
+            for i in range(5):
+                assert restored.get_history(f"user{i}") == [f"問{i}", f"答{i}"]
+            assert restored.get_history("unknown") == []
+
+    def test_lazy_restore_decodes_on_demand(self, tmp_path):
+        """驗證延遲復原時使用者於取用時方載入"""
+        path = str(tmp_path / "state.snap")
+        self._populated().snapshot(path)
+
+        restored = ConversationManager()
+        restored.restore(path)
+        assert restored.conversations == {}
+        restored.get_history("user3")
+        assert list(restored.conversations) == ["user3"]
+
+    def test_snapshot_after_lazy_restore_keeps_unloaded_users(self, tmp_path):
+        """驗證延遲復原後再封存，未載入者與已清除者皆正確處理"""
+        first, second = str(tmp_path / "a.snap"), str(tmp_path / "b.snap")
+        self._populated().snapshot(first)
+
+        restored = ConversationManager()
+        restored.restore(first)
+        restored.add_message("user0", "新訊息")
+        restored.clear_history("user1")
+        assert restored.get_history("user1") == []
+        assert restored.snapshot(second) == 4
+
+        final = ConversationManager()
+        final.restore(second, lazy=False)
+        assert final.get_history("user0") == ["問0", "答0", "新訊息"]
+        assert final.get_history("user1") == []
+        assert final.get_history("user4") == ["問4", "答4"]
+
+    def test_corrupted_snapshot_rejected(self, tmp_path):
+        """驗證毀損之快照被拒"""
+        from chatbot.exceptions import SnapshotError
+
+        path = tmp_path / "state.snap"
+        self._populated().snapshot(str(path))
+        data = bytearray(path.read_bytes())
+        data[40] ^= 0xFF
+        path.write_bytes(bytes(data))
+
+        with pytest.raises(SnapshotError):
+            ConversationManager().restore(str(path))
+
+    def test_atomic_write_leaves_no_temp_files(self, tmp_path):
+        """驗證寫入後目錄中僅餘快照本身"""
+        path = tmp_path / "state.snap"
+        self._populated().snapshot(str(path))
+        self._populated().snapshot(str(path))
+        assert [p.name for p in tmp_path.iterdir()] == ["state.snap"]
+
+    def test_write_streams_records(self, tmp_path):
+        """驗證寫入快照時不於記憶體中另組整檔"""
+        import tracemalloc
+
+        from chatbot.models.snapshot import SnapshotReader, write_snapshot
+
+        path = str(tmp_path / "state.snap")
+        history = ["問" * 500, "答" * 500]  # 各使用者共用，故輸入本身僅佔少許記憶體
+        tracemalloc.start()
+        try:
+            write_snapshot(path, ((f"user{i}", history) for i in range(2000)))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        reader = SnapshotReader(path)
+        try:
+            assert len(reader) == 2000
+            assert reader.get("user1999") == history
+        finally:
+            reader.close()
+        assert peak < os.path.getsize(path) / 4
+
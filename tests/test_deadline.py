@@ -0,0 +1,173 @@
+"""
+端到端時限之測試
+此乃驗證逾時即止之試煉
+"""
+
+import time
+from unittest.mock import MagicMock, Mock
+
+import pytest
+
+from chatbot import codec
+from chatbot.deadline import Deadline
+from chatbot.exceptions import DeadlineExceeded
+from chatbot.handlers import AdmissionController, ChatBot
+from chatbot.models import ConversationManager
+from chatbot.services import APIHandler
+
+
+class TestDeadline:
+    """時限基本測試"""
+
+    def test_remaining_and_expiry(self):
+        """驗證剩餘時間與到期判定"""
+        deadline = Deadline.after(0.05)
+        assert 0 < deadline.remaining() <= 0.05
+        assert not deadline.expired
+        time.sleep(0.06)
+        assert deadline.expired
+        assert deadline.remaining() == 0.0
+        with pytest.raises(DeadlineExceeded):
+            deadline.check()
+
+    def test_timeout_is_capped(self):
+        """驗證超時取上限與剩餘時間之短者"""
+        assert Deadline.after(100).timeout(30) == 30
+        assert Deadline.after(1).timeout(30) <= 1
+
+    def test_coerce(self):
+        """驗證秒數與 None 之轉換"""
+        assert Deadline.coerce(None) is None
+        deadline = Deadline.after(1)
+        assert Deadline.coerce(deadline) is deadline
+        assert isinstance(Deadline.coerce(2.0), Deadline)
+
+
+class TestAPIHandlerDeadline:
+    """API 處理器之時限傳遞測試"""
+
+    def _handler(self, post):
+        handler = APIHandler("g", "p")
+        handler._session = MagicMock()
+        handler._session.post.side_effect = post
+        return handler
+
+    def test_remaining_time_becomes_timeout(self):
+        """驗證剩餘時限作為 HTTP 超時"""
+        response = MagicMock()
+        response.content = codec.dumps({"choices": [{"message": {"content": "答"}}]})
+        handler = self._handler(lambda *a, **k: response)
+
+        assert handler.query_perplexity("問", deadline=Deadline.after(2)) == "答"
+        assert handler._session.post.call_args.kwargs['timeout'] <= 2
+
+    def test_retries_share_the_deadline(self):
+        """驗證重試共用同一時限，且時限不足時不再重試"""
+        timeouts = []
+
+        def post(*args, timeout, **kwargs):
+            timeouts.append(timeout)
+            raise ConnectionError("斷線")
+
+        handler = self._handler(post)
+        handler.max_retries = 5
+        handler.retry_backoff = 0.05
+
+        with pytest.raises(ConnectionError):
+            handler.query_perplexity("問", deadline=Deadline.after(0.2))
+
+        assert 1 < len(timeouts) < 6
+        assert timeouts == sorted(timeouts, reverse=True)
+
+    def test_gemini_timeout_uses_sdk_types(self):
+        """驗證 Gemini 之超時以 SDK 之 HttpOptions 傳入，並為實際之客戶端所接受"""
+        genai = pytest.importorskip("google.genai")
+        client = genai.Client(api_key="g")
+        seen = {}
+
+        def request(method, path, request_dict, http_options=None):
+            seen['http_options'] = http_options
+            return genai.types.HttpResponse(headers={}, body=codec.dumps({
+                "candidates": [{"content": {"parts": [{"text": "答"}], "role": "model"}}]
+            }).decode())
+
+        client._api_client.request = request
+        handler = APIHandler("g", "p")
+        handler._gemini_clients["g"] = client
+
+        assert handler.query_gemini("問", deadline=Deadline.after(2)) == "答"
+        assert 0 < seen['http_options'].timeout <= 2000
+
+        # 不足一毫秒之餘裕仍設超時，而非被 SDK 視為不設
+        handler.timeout = 0.0004
+        assert handler.query_gemini("問") == "答"
+        assert seen['http_options'].timeout == 1
+
+    def test_scheduler_wait_cut_by_deadline(self):
+        """驗證排程等候為時限所截者屬逾時，而非繁忙"""
+        handler = self._handler(Mock())
+        scheduler = handler.enable_scheduling(max_concurrency=1)
+        scheduler.acquire()
+        with pytest.raises(DeadlineExceeded):
+            handler.query_perplexity("問", deadline=Deadline.after(0.02))
+        assert not handler._session.post.called
+
+    def test_expired_deadline_skips_call(self):
+        """驗證時限已過時不發出呼叫"""
+        handler = self._handler(Mock())
+        with pytest.raises(DeadlineExceeded):
+            handler.query_perplexity("問", deadline=Deadline(time.monotonic() - 1))
+        assert not handler._session.post.called
+
+
+class TestChatBotDeadline:
+    """ChatBot 時限測試"""
+
+    def _chatbot(self, delay, **kwargs):
+        def slow(prompt, **kw):
+            time.sleep(delay)
+            return "遲來之回應"
+
+        api_handler = Mock(spec=APIHandler)
+        api_handler.query_gemini = Mock(side_effect=slow)
+        conversation_manager = ConversationManager()
+        return ChatBot(api_handler, conversation_manager, **kwargs), conversation_manager
+
+    def test_late_reply_not_committed(self):
+        """驗證逾時之回覆不入歷史"""
+        chatbot, conversation_manager = self._chatbot(0.1)
+
+        assert chatbot.process_message("u1", "你好", deadline=0.02) == ChatBot.TIMEOUT_MESSAGE
+        assert conversation_manager.get_history("u1") == []
+
+    def test_reply_within_deadline(self):
+        """驗證時限內之回覆照常入歷史"""
+        chatbot, conversation_manager = self._chatbot(0.0)
+
+        assert chatbot.process_message("u1", "你好", deadline=1.0) == "遲來之回應"
+        assert conversation_manager.get_history("u1") == ["你好", "遲來之回應"]
+
+    def test_deadline_propagates_to_provider(self):
+        """驗證時限傳至提供者之呼叫"""
+        chatbot, _ = self._chatbot(0.0)
+        deadline = Deadline.after(5)
+        chatbot.process_message("u1", "你好", deadline=deadline)
+        assert chatbot.api_handler.query_gemini.call_args.kwargs['deadline'] is deadline
+
+    def test_queue_wait_bounded_by_deadline(self):
+        """驗證入場等候不逾時限；為時限所截者回覆逾時，而非繁忙"""
+        admission = AdmissionController(max_concurrency=1, max_queue=4, max_queue_wait=10)
+        chatbot, _ = self._chatbot(0.0, admission=admission)
+        admission.acquire()  # 佔滿名額
+
+        start = time.monotonic()
+        assert chatbot.process_message("u1", "你好", deadline=0.05) == ChatBot.TIMEOUT_MESSAGE
+        assert time.monotonic() - start < 1
+
+    def test_queue_limit_shorter_than_deadline_is_busy(self):
+        """驗證等候逾佇列上限而時限尚餘者回覆繁忙"""
+        admission = AdmissionController(max_concurrency=1, max_queue=4, max_queue_wait=0.01)
+        chatbot, _ = self._chatbot(0.0, admission=admission)
+        admission.acquire()
+
+        assert chatbot.process_message("u1", "你好", deadline=5) == ChatBot.BUSY_MESSAGE
@@ -171,6 +171,13 @@ class TestEndToEndMessageProcessing:
         assert "錯誤" in response or "抱歉" in response
         assert response != ""
 
+    def test_routing_error_returns_error_message(self, setup):
+        """驗證路由時之異常（如非字串之訊息）亦轉為友善之錯誤訊息"""
+        chatbot = setup['chatbot']
+
+        assert chatbot.process_message("test_user", None) == ChatBot.ERROR_MESSAGE
+        assert not setup['api_handler'].query_gemini.called
+
     def test_keyword_extraction_in_message_processing(self, setup):
         """
         驗證訊息處理中之關鍵字提取
@@ -0,0 +1,238 @@
+"""
+API 金鑰池之測試
+此乃驗證多鑰輪值
+"""
+
+from collections import Counter
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+
+from chatbot import codec
+from chatbot.config import load_environment_variables, parse_api_keys
+from chatbot.exceptions import BusyError, NoAvailableKeyError
+from chatbot.services import APIHandler, KeyPool
+
+
+class FakeClock:
+    """可手動推進之時鐘"""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class HTTPError(Exception):
+    """仿 requests.HTTPError：附回應之狀態碼與標頭"""
+
+    def __init__(self, status: int, headers: dict = None):
+        super().__init__(f"HTTP {status}")
+        self.response = SimpleNamespace(status_code=status, headers=headers or {})
+
+
+def _fail(pool: KeyPool, error: Exception) -> str:
+    """租用一把祕鑰並以異常結束，返回所用之祕鑰"""
+    with pytest.raises(type(error)):
+        with pool.lease() as key:
+            raise error
+    return key.secret
+
+
+class TestKeyPool:
+    """金鑰池測試"""
+
+    def test_least_in_flight_spreads_concurrent_leases(self):
+        """驗證處理中之請求平均分攤，權重高者分得較多"""
+        pool = KeyPool([("a", 2), "b", "c"])
+        leases = [pool.lease() for _ in range(8)]
+        chosen = Counter(lease.__enter__().secret for lease in leases)
+        assert chosen == {"a": 4, "b": 2, "c": 2}
+        for lease in leases:
+            lease.__exit__(None, None, None)
+        assert all(key.in_flight == 0 for key in pool.keys)
+
+    def test_least_in_flight_rotates_ties(self):
+        """驗證閒置時輪流取用"""
+        pool = KeyPool(["a", "b", "c"])
+        chosen = []
+        for _ in range(6):
+            with pool.lease() as key:
+                chosen.append(key.secret)
+        assert Counter(chosen) == {"a": 2, "b": 2, "c": 2}
+
+    def test_weighted_round_robin_is_smooth(self):
+        """驗證平滑加權輪詢之順序"""
+        pool = KeyPool([("a", 5), ("b", 1), ("c", 1)], strategy='weighted')
+        assert [pool.select().secret for _ in range(7)] == list("aabacaa")
+
+    def test_throttled_key_is_ejected_until_retry_after(self):
+        """驗證遭限流之祕鑰依 Retry-After 暫停，其間改用他鑰"""
+        clock = FakeClock()
+        pool = KeyPool(["a", "b"], clock=clock)
+        throttled = _fail(pool, HTTPError(429, {"Retry-After": "30"}))
+        assert pool.available == 1
+        assert all(pool.select().secret != throttled for _ in range(4))
+        clock.now += 30
+        assert pool.available == 2
+
+    def test_repeated_throttling_backs_off_exponentially(self):
+        """驗證無 Retry-After 者之暫停隨連續限流倍增，成功後歸零"""
+        clock = FakeClock()
+        pool = KeyPool(["a"], throttle_cooldown=2, clock=clock)
+        _fail(pool, HTTPError(429))
+        assert pool.keys[0].ejected_until == clock.now + 2
+        clock.now += 2
+        _fail(pool, HTTPError(429))
+        assert pool.keys[0].ejected_until == clock.now + 4
+        clock.now += 4
+        with pool.lease():
+            pass
+        assert pool.keys[0].strikes == 0
+
+    def test_rejected_key_is_disabled(self):
+        """驗證遭拒之祕鑰長時停用；他種錯誤不停用"""
+        pool = KeyPool(["a", "b"], reject_cooldown=600)
+        _fail(pool, ConnectionError("斷線"))
+        assert pool.available == 2
+        _fail(pool, HTTPError(401))
+        assert pool.available == 1
+        assert sum(key.rejected for key in pool.keys) == 1
+
+    def test_exhausted_pool_raises_busy(self):
+        """驗證祕鑰皆暫停時即刻拒絕，並告知最早恢復之時間"""
+        clock = FakeClock()
+        pool = KeyPool(["a", "b"], clock=clock)
+        _fail(pool, HTTPError(429, {"Retry-After": "10"}))
+        _fail(pool, HTTPError(429, {"Retry-After": "1m"}))
+        with pytest.raises(NoAvailableKeyError) as excinfo:
+            pool.select()
+        assert isinstance(excinfo.value, BusyError)
+        assert excinfo.value.retry_after == pytest.approx(10)
+
+    def test_observed_rate_limit_headers(self):
+        """驗證剩餘請求數歸零之祕鑰暫不取用，直至重置"""
+        clock = FakeClock()
+        pool = KeyPool(["a", "b"], clock=clock)
+        pool.observe(pool.keys[0], {"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "1m30s"})
+        pool.observe(pool.keys[1], {"x-ratelimit-remaining-requests": "12"})
+        assert pool.available == 1
+        clock.now += 90
+        assert pool.available == 2
+
+    def test_rejects_invalid_configuration(self):
+        """驗證空池、未知策略與非正權重被拒"""
+        with pytest.raises(ValueError):
+            KeyPool([])
+        with pytest.raises(ValueError):
+            KeyPool(["a"], strategy='random')
+        with pytest.raises(ValueError):
+            KeyPool([("a", 0)])
+
+
+class TestAPIHandlerKeys:
+    """API 處理器之多鑰測試"""
+
+    @staticmethod
+    def _response(status: int = 200, headers: dict = None):
+        response = MagicMock()
+        response.headers = headers or {}
+        response.content = codec.dumps({"choices": [{"message": {"content": "答"}}]})
+        if status != 200:
+            response.raise_for_status.side_effect = HTTPError(status, headers)
+        return response
+
+    def test_requests_spread_across_keys(self):
+        """驗證請求分攤於各祕鑰"""
+        handler = APIHandler("g", ["p1", "p2"])
+        handler._session = MagicMock()
+        handler._session.post.return_value = self._response()
+        for _ in range(4):
+            handler.query_perplexity("問")
+        used = Counter(call.kwargs['headers']['Authorization'] for call in handler._session.post.call_args_list)
+        assert used == {"Bearer p1": 2, "Bearer p2": 2}
+
+    def test_throttled_key_fails_over(self):
+        """驗證遭限流之祕鑰即刻換鑰再試，不計入重試次數"""
+        handler = APIHandler("g", ["p1", "p2"])
+        handler._session = MagicMock()
+        handler._session.post.side_effect = lambda *a, headers, **k: self._response(
+            429 if headers['Authorization'] == "Bearer p1" else 200
+        )
+        assert handler.max_retries == 0
+        assert [handler.query_perplexity("問") for _ in range(3)] == ["答"] * 3
+        assert handler.perplexity_keys.keys[0].throttled == 1
+        assert handler._session.post.call_count == 4
+
+    def test_single_key_is_not_retried(self):
+        """驗證僅有一把祕鑰時，遭限流即失敗"""
+        handler = APIHandler("g", "p")
+        handler._session = MagicMock()
+        handler._session.post.return_value = self._response(429)
+        with pytest.raises(HTTPError):
+            handler.query_perplexity("問")
+        with pytest.raises(NoAvailableKeyError):
+            handler.query_perplexity("問")
+        assert handler._session.post.call_count == 1
+
+    def test_batch_backend_leases_key(self):
+        """驗證批次作業租用祕鑰：期間計入處理中，遭限流者暫停"""
+        handler = APIHandler(["g1", "g2"], "p")
+        seen = []
+
+        def create(**kwargs):
+            seen.append([key.in_flight for key in handler.gemini_keys.keys])
+            raise HTTPError(429, {"Retry-After": "30"})
+
+        for secret in ("g1", "g2"):
+            handler._gemini_clients[secret] = MagicMock()
+            handler._gemini_clients[secret].batches.create.side_effect = create
+        backend = handler.enable_gemini_batching(max_wait=0).backend
+        with pytest.raises(HTTPError):
+            backend(["問"])
+        assert sorted(seen[0]) == [0, 1]
+        assert all(key.in_flight == 0 for key in handler.gemini_keys.keys)
+        assert handler.gemini_keys.available == 1
+        handler.gemini_batcher.close()
+
+    def test_gemini_client_per_key(self):
+        """驗證各祕鑰各有其 Gemini 客戶端"""
+        handler = APIHandler([("g1", 1), ("g2", 1)], "p")
+        for secret in ("g1", "g2"):
+            handler._gemini_clients[secret] = MagicMock()
+            handler._gemini_clients[secret].models.generate_content.return_value = SimpleNamespace(text=secret)
+        assert sorted(handler.query_gemini("問") for _ in range(2)) == ["g1", "g2"]
+
+
+class TestKeyConfig:
+    """祕鑰設定之解析測試"""
+
+    def test_parse_api_keys(self):
+        """驗證逗號分隔與明示之權重；冒號屬祕鑰本身"""
+        assert parse_api_keys("a, b;weight=2 ,,c; weight=0.5") == [("a", 1.0), ("b", 2.0), ("c", 0.5)]
+        assert parse_api_keys("key:with:colon,sk:2") == [("key:with:colon", 1.0), ("sk:2", 1.0)]
+        for invalid in ("a;weight=-1", "a;weight=x", "a;w=2", "a;2"):
+            with pytest.raises(ValueError):
+                parse_api_keys(invalid)
+
+    def test_plural_variable_takes_precedence(self, monkeypatch):
+        """驗證複數名之變數優先，單數名之變數亦可列多把；單數名之欄位仍為原字串"""
+        monkeypatch.setenv('GEMINI_API_KEY', "g0")
+        monkeypatch.setenv('GEMINI_API_KEYS', "g1,g2;weight=3")
+        monkeypatch.setenv('PERPLEXITY_API_KEY', "p1,p2")
+        monkeypatch.delenv('PERPLEXITY_API_KEYS', raising=False)
+        config = load_environment_variables()
+        assert config['GEMINI_API_KEY'] == "g0"
+        assert config['GEMINI_API_KEYS'] == [("g1", 1.0), ("g2", 3.0)]
+        assert config['PERPLEXITY_API_KEY'] == "p1,p2"
+        assert config['PERPLEXITY_API_KEYS'] == [("p1", 1.0), ("p2", 1.0)]
+
+    def test_malformed_keys_exit(self, monkeypatch):
+        """驗證祕鑰格式有誤者終止"""
+        monkeypatch.setenv('GEMINI_API_KEY', "g;weight=0")
+        monkeypatch.setenv('PERPLEXITY_API_KEY', "p")
+        monkeypatch.delenv('GEMINI_API_KEYS', raising=False)
+        with pytest.raises(SystemExit):
+            load_environment_variables()
@@ -0,0 +1,110 @@
+"""
+開環負載產生器之測試
+此乃驗證壓力試煉之試煉
+"""
+
+import time
+from unittest.mock import Mock
+
+import pytest
+
+from chatbot.handlers import ChatBot
+from chatbot.loadgen import (
+    InProcessTarget,
+    LatencyHistogram,
+    SimulatedAPIHandler,
+    TrafficRecord,
+    arrival_offsets,
+    run_load,
+    synthetic_traffic,
+)
+from chatbot.models import ConversationManager
+from chatbot.services import APIHandler
+
+
+class TestArrivalOffsets:
+    """到達時刻測試"""
+
+    def test_uniform_spacing(self):
+        """驗證固定間隔之到達時刻"""
+        offsets = arrival_offsets(rate=10, count=5, process='uniform')
+        assert offsets == pytest.approx([0.0, 0.1, 0.2, 0.3, 0.4])
+
+    def test_poisson_mean_rate(self):
+        """驗證 Poisson 到達之平均間隔趨近 1/rate"""
+        offsets = arrival_offsets(rate=100, count=20000, seed=1)
+        assert offsets[-1] / len(offsets) == pytest.approx(0.01, rel=0.05)
+
+    def test_invalid_rate(self):
+        """驗證到達率非正時拋出異常"""
+        with pytest.raises(ValueError):
+            arrival_offsets(rate=0, count=1)
+
+
+class TestLatencyHistogram:
+    """延遲直方圖測試"""
+
+    def test_percentiles_within_precision(self):
+        """驗證百分位之相對誤差不逾精度"""
+        histogram = LatencyHistogram(precision=0.01)
+        for ms in range(1, 1001):
+            histogram.record(ms / 1000.0)
+        assert histogram.total == 1000
+        assert histogram.percentile(50) == pytest.approx(0.5, rel=0.011)
+        assert histogram.percentile(99) == pytest.approx(0.99, rel=0.011)
+        assert histogram.percentile(100) == pytest.approx(1.0)
+
+    def test_empty_histogram(self):
+        """驗證空直方圖之百分位為 0"""
+        assert LatencyHistogram().percentile(99) == 0.0
+
+
+class TestRunLoad:
+    """負載施加測試"""
+
+    def test_in_process_outcomes(self):
+        """驗證本行程內驅動時之結果分類"""
+        api_handler = Mock(spec=APIHandler)
+        api_handler.query_gemini = Mock(return_value="好")
+        api_handler.query_perplexity = Mock(side_effect=Exception("失敗"))
+        target = InProcessTarget(ChatBot(api_handler, ConversationManager()))
+        traffic = [TrafficRecord("u1", "你好"), TrafficRecord("u2", "/請查詢 天氣")]
+
+        report = run_load(target, traffic, rate=500, count=20, seed=1)
+
+        assert report.outcomes == {'ok': 10, 'error': 10}
+        assert report.latency.total == 20
+
+    def test_exceptions_are_classified_by_type(self):
+        """驗證目標拋出之例外依型別分類"""
+        def target(record):
+            raise TimeoutError()
+
+        report = run_load(target, [TrafficRecord("u", "m")], rate=500, count=5)
+        assert report.outcomes == {'TimeoutError': 5}
+
+    def test_coordinated_omission_correction(self):
+        """驗證排隊等候計入矯正後延遲，而不計入服務時間"""
+        def target(record):
+            time.sleep(0.02)
+            return 'ok'
+
+        # 單一工作者，到達率為服務能力之兩倍
+        report = run_load(target, [TrafficRecord("u", "m")], rate=100, count=20,
+                          arrival='uniform', concurrency=1)
+
+        assert report.service_time.percentile(99) < 0.05
+        assert report.latency.max > 0.15
+        assert report.goodput < 60
+
+    def test_simulated_handler_end_to_end(self):
+        """驗證模擬處理器可驅動完整流程"""
+        api_handler = SimulatedAPIHandler(latency=0.001, error_rate=0.0, seed=1)
+        target = InProcessTarget(ChatBot(api_handler, ConversationManager()))
+        traffic = synthetic_traffic(users=5, size=50, seed=1)
+
+        report = run_load(target, traffic, rate=1000, count=50, seed=1)
+
+        assert report.outcomes['ok'] == 50
+        assert 'ok' in report.format()
+        assert report.to_dict()['sent'] == 50
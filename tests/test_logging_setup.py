@@ -0,0 +1,136 @@
+"""
+非阻塞結構化日誌之測試
+此乃驗證記錄之驛站不阻請求
+"""
+
+import io
+import json
+import logging
+import queue
+import time
+
+import pytest
+
+from chatbot.handlers import ChatBot
+from chatbot.loadgen import SimulatedAPIHandler
+from chatbot.logging_setup import JsonFormatter, NonBlockingQueueHandler, RateLimitFilter, setup_logging
+from chatbot.models import ConversationManager
+
+
+def _record(msg="出錯: %s", args=("逾時",), level=logging.ERROR, **extra) -> logging.LogRecord:
+    record = logging.LogRecord("chatbot.test", level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+@pytest.fixture
+def root_logger():
+    """保存並復原根記錄器之設定"""
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield root
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+class _CountingStr:
+    """記錄 __str__ 被呼叫之次數"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __str__(self):
+        self.calls += 1
+        return "參數"
+
+
+class TestJsonFormatter:
+    """JSON 格式化測試"""
+
+    def test_includes_structured_fields(self):
+        """驗證輸出含訊息與結構化欄位"""
+        line = JsonFormatter().format(_record(user="user1", route="gemini", latency_ms=12.5))
+        entry = json.loads(line)
+        assert entry["msg"] == "出錯: 逾時"
+        assert entry["level"] == "ERROR"
+        assert (entry["user"], entry["route"], entry["latency_ms"]) == ("user1", "gemini", 12.5)
+        assert "provider" not in entry
+
+
+class TestRateLimitFilter:
+    """限流測試"""
+
+    def test_suppresses_beyond_burst_and_reports_count(self):
+        """驗證超額者丟棄，補充後放行者附略去筆數"""
+        limiter = RateLimitFilter(rate=1000.0, burst=3)
+        passed = [limiter.filter(_record()) for _ in range(10)]
+        assert passed == [True] * 3 + [False] * 7
+        time.sleep(0.01)
+        record = _record()
+        assert limiter.filter(record)
+        assert record.suppressed == 7
+
+    def test_keys_by_template_and_ignores_info(self):
+        """驗證不同模板各自限流，低於門檻之層級不受限"""
+        limiter = RateLimitFilter(rate=0.0, burst=1)
+        assert limiter.filter(_record("甲: %s"))
+        assert not limiter.filter(_record("甲: %s", ("另一值",)))
+        assert limiter.filter(_record("乙: %s"))
+        assert all(limiter.filter(_record(level=logging.INFO)) for _ in range(5))
+
+
+class TestNonBlockingQueueHandler:
+    """佇列處理器測試"""
+
+    def test_drops_when_full_without_blocking(self):
+        """驗證佇列滿時丟棄並計數，不阻塞"""
+        handler = NonBlockingQueueHandler(queue.Queue(maxsize=2))
+        start = time.perf_counter()
+        for _ in range(100):
+            handler.handle(_record())
+        assert time.perf_counter() - start < 0.5
+        assert handler.dropped == 98
+
+    def test_defers_formatting(self):
+        """驗證 %-參數不於呼叫者執行緒展開"""
+        log_queue = queue.Queue()
+        handler = NonBlockingQueueHandler(log_queue)
+        argument = _CountingStr()
+        handler.handle(_record("值: %s", (argument,)))
+        assert argument.calls == 0
+        assert log_queue.get_nowait().getMessage() == "值: 參數"
+
+
+class TestSetupLogging:
+    """整體設定測試"""
+
+    def test_chatbot_errors_carry_user_route_latency(self, root_logger):
+        """驗證 ChatBot 之錯誤記錄為含使用者、路由與延遲之 JSON"""
+        stream = io.StringIO()
+        listener = setup_logging(logging.INFO, stream=stream)
+        try:
+            chatbot = ChatBot(SimulatedAPIHandler(latency=0.0, error_rate=1.0), ConversationManager())
+            assert chatbot.process_message("user1", "你好") == ChatBot.ERROR_MESSAGE
+        finally:
+            listener.stop()
+        entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+        entry = next(e for e in entries if e["logger"] == "chatbot.handlers.chatbot")
+        assert entry["level"] == "ERROR"
+        assert entry["user"] == "user1"
+        assert entry["route"] == "gemini"
+        assert entry["latency_ms"] >= 0
+
+    def test_error_flood_is_rate_limited(self, root_logger):
+        """驗證錯誤洪流僅少數輸出"""
+        stream = io.StringIO()
+        listener = setup_logging(logging.INFO, stream=stream, error_rate=0.0, error_burst=5)
+        try:
+            logger = logging.getLogger("chatbot.flood")
+            for i in range(1000):
+                logger.error("提供者中斷: %d", i)
+        finally:
+            listener.stop()
+        assert len(stream.getvalue().splitlines()) == 5
@@ -0,0 +1,176 @@
+"""
+按需剖析之測試
+此乃驗證線上之診察
+"""
+
+import os
+import pstats
+import signal
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from chatbot.handlers import ChatBot
+from chatbot.loadgen import SimulatedAPIHandler
+from chatbot.models import ConversationManager
+from chatbot.profiling import RequestProfiler
+
+
+def _chatbot(profiler: RequestProfiler, latency: float = 0.0) -> ChatBot:
+    return ChatBot(SimulatedAPIHandler(latency=latency), ConversationManager(), profiler=profiler)
+
+
+class TestRequestProfiler:
+    """按需剖析器測試"""
+
+    def test_rejects_unknown_mode(self, tmp_path):
+        """驗證未知模式被拒"""
+        with pytest.raises(ValueError):
+            RequestProfiler(str(tmp_path), mode='perf')
+
+    def test_cprofile_writes_after_n_requests(self, tmp_path):
+        """驗證剖析 N 則後自動結束並寫出 .prof"""
+        profiler = RequestProfiler(str(tmp_path), requests=3)
+        chatbot = _chatbot(profiler)
+        assert profiler.start()
+        for i in range(5):
+            chatbot.process_message(f"user{i}", "你好")
+        assert not profiler.active
+        assert len(profiler.outputs) == 1
+        path = profiler.outputs[0]
+        assert path.endswith('.prof')
+        stats = pstats.Stats(path)
+        calls = {func[2]: stat[0] for func, stat in stats.stats.items()}
+        assert calls['_handle_message'] == 3
+        assert os.path.exists(path[:-len('.prof')] + '.txt')
+
+    def test_cprofile_concurrent_requests_not_serialized(self, tmp_path):
+        """驗證剖析中時並行之請求照常處理而不剖析，亦不計入名額"""
+        started, release = threading.Event(), threading.Event()
+
+        def query(prompt, **kwargs):
+            if "慢" in prompt:
+                started.set()
+                release.wait(5)
+            return "答"
+
+        api_handler = SimulatedAPIHandler(latency=0.0)
+        api_handler.query_gemini = query
+        profiler = RequestProfiler(str(tmp_path), requests=2)
+        chatbot = ChatBot(api_handler, ConversationManager(), profiler=profiler)
+        profiler.start()
+        thread = threading.Thread(target=chatbot.process_message, args=("user1", "慢"))
+        thread.start()
+        assert started.wait(5)
+
+        assert chatbot.process_message("user2", "你好") == "答"
+        assert not release.is_set()
+        release.set()
+        thread.join()
+        assert profiler.active
+        chatbot.process_message("user3", "你好")
+        assert not profiler.active
+        stats = pstats.Stats(profiler.outputs[0])
+        calls = {func[2]: stat[0] for func, stat in stats.stats.items()}
+        assert calls['_handle_message'] == 2
+
+    def test_sessions_in_same_second_write_distinct_files(self, tmp_path):
+        """驗證接連之剖析各寫其檔，不相覆蓋"""
+        profiler = RequestProfiler(str(tmp_path), requests=1)
+        chatbot = _chatbot(profiler)
+        for _ in range(3):
+            profiler.start()
+            chatbot.process_message("user1", "你好")
+        assert len(set(profiler.outputs)) == 3
+        assert all(os.path.exists(path) for path in profiler.outputs)
+
+    def test_loadgen_writes_profile_for_short_run(self, tmp_path):
+        """驗證負載產生器之請求數少於剖析名額時，結束時仍寫出結果"""
+        from chatbot import loadgen
+
+        loadgen.main([
+            '--requests', '5', '--rate', '1000', '--latency', '0',
+            '--profile', '100', '--profile-dir', str(tmp_path), '--seed', '1'
+        ])
+        assert any(name.endswith('.prof') for name in os.listdir(tmp_path))
+
+    def test_stop_waits_for_in_flight_requests(self, tmp_path):
+        """驗證 stop() 於請求剖析中時僅停止受理，待其完成方寫出並停止追蹤"""
+        started, release = threading.Event(), threading.Event()
+
+        def query(prompt, **kwargs):
+            started.set()
+            release.wait(5)
+            return "答"
+
+        api_handler = SimulatedAPIHandler(latency=0.0)
+        api_handler.query_gemini = query
+        profiler = RequestProfiler(str(tmp_path), mode='tracemalloc', requests=10)
+        chatbot = ChatBot(api_handler, ConversationManager(), profiler=profiler)
+        profiler.start()
+        thread = threading.Thread(target=chatbot.process_message, args=("user1", "你好"))
+        thread.start()
+        assert started.wait(5)
+
+        assert profiler.stop() is None
+        assert not profiler.active
+        assert tracemalloc.is_tracing()
+        assert profiler.outputs == []
+
+        release.set()
+        thread.join()
+        assert not tracemalloc.is_tracing()
+        with open(profiler.outputs[0], encoding='utf-8') as f:
+            assert "# 請求 user=user1" in f.read()
+
+    def test_inactive_profiler_is_bypassed(self, tmp_path):
+        """驗證未啟動時不剖析、不寫檔"""
+        profiler = RequestProfiler(str(tmp_path))
+        chatbot = _chatbot(profiler)
+        assert chatbot.process_message("user1", "你好") == "gemini 模擬回應"
+        assert profiler.stop() is None
+        assert os.listdir(tmp_path) == []
+
+    def test_sample_mode_records_request_stacks(self, tmp_path):
+        """驗證取樣模式記下請求之呼叫堆疊"""
+        profiler = RequestProfiler(str(tmp_path), mode='sample', requests=5, sample_interval=0.001)
+        chatbot = _chatbot(profiler, latency=0.02)
+        profiler.start()
+        for _ in range(5):
+            chatbot.process_message("user1", "你好")
+        with open(profiler.outputs[0], encoding='utf-8') as f:
+            content = f.read()
+        assert '_handle_message' in content
+
+    def test_tracemalloc_reports_allocation_sites(self, tmp_path):
+        """驗證配置追蹤模式逐請求列出配置位置，結束後停止追蹤"""
+        profiler = RequestProfiler(str(tmp_path), mode='tracemalloc', requests=2)
+        chatbot = _chatbot(profiler)
+        profiler.start()
+        chatbot.process_message("user1", "你好" * 1000)
+        chatbot.process_message("user2", "再會" * 1000)
+        assert not tracemalloc.is_tracing()
+        with open(profiler.outputs[0], encoding='utf-8') as f:
+            content = f.read()
+        assert "# 請求 user=user1" in content
+        assert "# 請求 user=user2" in content
+        assert "chatbot" in content
+
+    @pytest.mark.skipif(not hasattr(signal, 'SIGUSR1'), reason="平台不支援 SIGUSR1")
+    def test_signal_toggles_profiling(self, tmp_path):
+        """驗證訊號開始剖析，再次收到則提前結束並寫出"""
+        previous = signal.getsignal(signal.SIGUSR1)
+        try:
+            profiler = RequestProfiler(str(tmp_path), requests=100)
+            profiler.install_signal()
+            chatbot = _chatbot(profiler)
+            os.kill(os.getpid(), signal.SIGUSR1)
+            assert profiler.active
+            chatbot.process_message("user1", "你好")
+            os.kill(os.getpid(), signal.SIGUSR1)
+            assert not profiler.active
+            assert len(profiler.outputs) == 1
+        finally:
+            signal.signal(signal.SIGUSR1, previous)
@@ -0,0 +1,132 @@
+"""
+競速路由之測試
+此乃驗證先得佳答者勝之試煉
+"""
+
+import time
+from unittest.mock import Mock
+
+import pytest
+
+from chatbot.handlers import ChatBot, RaceRunner
+from chatbot.models import ConversationManager
+from chatbot.services import APIHandler
+
+
+def _slow(reply, delay):
+    def call(*args, **kwargs):
+        time.sleep(delay)
+        return reply
+    return call
+
+
+class TestRaceRunner:
+    """競速執行器測試"""
+
+    def test_fastest_success_wins(self):
+        """驗證最快之成功者勝出並記入勝率"""
+        runner = RaceRunner()
+        winner, reply = runner.race([('slow', _slow('慢', 0.2)), ('fast', _slow('快', 0.0))])
+        assert (winner, reply) == ('fast', '快')
+        assert runner.stats.win_rate('fast') == 1.0
+        assert runner.stats.win_rate('slow') == 0.0
+
+    def test_failure_falls_through_to_next(self):
+        """驗證先完成者失敗時，取後續之成功者"""
+        def broken():
+            raise RuntimeError("壞")
+
+        runner = RaceRunner()
+        winner, reply = runner.race([('broken', broken), ('ok', _slow('好', 0.05))])
+        assert winner == 'ok'
+        assert runner.stats.failures['broken'] == 1
+
+    def test_all_fail_raises(self):
+        """驗證全數失敗時拋出異常"""
+        def broken():
+            raise ValueError("壞")
+
+        with pytest.raises(ValueError):
+            RaceRunner().race([('a', broken), ('b', broken)])
+
+    def test_does_not_wait_for_losers(self):
+        """驗證勝負既分即返回，不候落敗者"""
+        runner = RaceRunner()
+        start = time.monotonic()
+
+        winner, _ = runner.race([('fast', _slow('快', 0.0)), ('slow', _slow('慢', 0.5))])
+
+        assert winner == 'fast'
+        assert time.monotonic() - start < 0.3
+
+
+class TestChatBotRaceMode:
+    """ChatBot 競速模式測試"""
+
+    @pytest.fixture
+    def setup(self):
+        api_handler = Mock(spec=APIHandler)
+        api_handler.query_gemini = Mock(side_effect=_slow("Gemini 之回應", 0.2))
+        api_handler.query_perplexity = Mock(side_effect=_slow("Perplexity 之回應", 0.0))
+        conversation_manager = ConversationManager()
+        chatbot = ChatBot(api_handler, conversation_manager)
+        return chatbot, api_handler, conversation_manager
+
+    def test_race_command_stores_only_winner(self, setup):
+        """驗證 /競速 指令啟用競速，且僅勝者之回覆入歷史"""
+        chatbot, api_handler, conversation_manager = setup
+
+        response = chatbot.process_message("u1", "/競速 你好")
+
+        assert response == "Perplexity 之回應"
+        assert api_handler.query_gemini.called and api_handler.query_perplexity.called
+        assert conversation_manager.get_history("u1") == ["你好", "Perplexity 之回應"]
+
+    def test_perplexity_contender_gets_plain_message(self, setup):
+        """驗證 Perplexity 參賽者僅得原訊息，Gemini 參賽者得含歷史之提示詞"""
+        chatbot, api_handler, _ = setup
+        chatbot.process_message("u1", "/競速 量子糾纏是什麼")
+        assert api_handler.query_perplexity.call_args.args[0] == "量子糾纏是什麼"
+        assert "對話歷史" in api_handler.query_gemini.call_args.args[0]
+
+    @pytest.mark.parametrize("message", ["/競速xyz", "/競速的規則"])
+    def test_race_command_requires_separator(self, setup, message):
+        """驗證指令後緊接文字者不視為競速指令"""
+        chatbot, api_handler, _ = setup
+        assert chatbot.process_message("u1", message) == "Gemini 之回應"
+        assert not api_handler.query_perplexity.called
+
+    def test_race_command_alone_or_with_fullwidth_space(self, setup):
+        """驗證單獨之指令與全形空白分隔皆可"""
+        chatbot, _, conversation_manager = setup
+        assert chatbot.process_message("u1", "/競速\u3000你好") == "Perplexity 之回應"
+        assert conversation_manager.get_history("u1")[0] == "你好"
+        assert chatbot.race_runner.stats.races == 1
+
+    def test_per_user_race_mode(self, setup):
+        """驗證按使用者啟用與停用競速"""
+        chatbot, api_handler, _ = setup
+        chatbot.set_race_mode("u1", True)
+        assert chatbot.process_message("u1", "你好") == "Perplexity 之回應"
+
+        chatbot.set_race_mode("u1", False)
+        assert chatbot.process_message("u1", "你好") == "Gemini 之回應"
+        assert chatbot.race_runner.stats.races == 1
+
+    def test_two_gemini_models(self, setup):
+        """驗證兩個 Gemini 模型互相競速"""
+        _, api_handler, conversation_manager = setup
+        api_handler.query_gemini = Mock(
+            side_effect=lambda prompt, model=None, **kwargs: _slow(f"{model}", 0.1 if model == 'pro' else 0)()
+        )
+        chatbot = ChatBot(api_handler, conversation_manager,
+                          race_contenders=('gemini:pro', 'gemini:flash'))
+
+        assert chatbot.process_message("u1", "你好", race=True) == "flash"
+        assert chatbot.race_runner.stats.wins == {'gemini:flash': 1}
+
+    def test_perplexity_trigger_is_not_raced(self, setup):
+        """驗證 /請查詢 訊息不參與競速"""
+        chatbot, api_handler, _ = setup
+        chatbot.process_message("u1", "/請查詢 天氣", race=True)
+        assert not api_handler.query_gemini.called
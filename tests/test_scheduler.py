@@ -0,0 +1,191 @@
+"""
+優先序排程器之測試
+此乃驗證輕重緩急之序
+"""
+
+import threading
+import time
+from typing import List
+from unittest.mock import MagicMock
+
+import pytest
+
+from chatbot import codec
+from chatbot.exceptions import BusyError, QueueTimeoutError
+from chatbot.handlers import ChatBot
+from chatbot.loadgen import InProcessTarget, SimulatedAPIHandler, run_load, synthetic_traffic
+from chatbot.models import ConversationManager
+from chatbot.services import BACKGROUND, BATCH, INTERACTIVE, APIHandler, PriorityClass, PriorityScheduler
+
+
+def _wait_queued(scheduler: PriorityScheduler, priority: str, count: int) -> None:
+    """等候某類別之佇列達到指定深度"""
+    limit = time.monotonic() + 2
+    while scheduler.stats[priority].queued < count:
+        assert time.monotonic() < limit, "等候入佇列逾時"
+        time.sleep(0.001)
+
+
+def _enqueue(scheduler: PriorityScheduler, priorities: List[str], order: List[str]) -> List[threading.Thread]:
+    """依序排入等候者；各者獲名額即記下其類別並釋出"""
+    def run(priority):
+        with scheduler.slot(priority):
+            order.append(priority)
+
+    threads = []
+    for priority in priorities:
+        queued = scheduler.stats[priority].queued
+        thread = threading.Thread(target=run, args=(priority,))
+        thread.start()
+        _wait_queued(scheduler, priority, queued + 1)
+        threads.append(thread)
+    return threads
+
+
+class TestPriorityScheduler:
+    """優先序排程器測試"""
+
+    def test_admits_immediately_under_capacity(self):
+        """驗證名額未滿時即刻取得，釋出後歸還"""
+        scheduler = PriorityScheduler(max_concurrency=2)
+        with scheduler.slot(INTERACTIVE), scheduler.slot(BATCH):
+            assert scheduler.in_flight == 2
+            assert scheduler.stats[BATCH].in_flight == 1
+        assert scheduler.in_flight == 0
+        assert scheduler.stats[INTERACTIVE].admitted == 1
+
+    def test_interactive_served_before_queued_batch(self):
+        """驗證名額釋出時，後到之互動請求先於久候之批次請求"""
+        scheduler = PriorityScheduler(max_concurrency=1)
+        order: List[str] = []
+        scheduler.acquire(BATCH)
+        threads = _enqueue(scheduler, [BATCH, BATCH, INTERACTIVE], order)
+        scheduler.release(BATCH)
+        for thread in threads:
+            thread.join(timeout=2)
+        assert order == [INTERACTIVE, BATCH, BATCH]
+        assert scheduler.stats[BATCH].max_wait >= scheduler.stats[INTERACTIVE].max_wait
+
+    def test_weighted_fairness_does_not_starve_batch(self):
+        """驗證兩類皆積壓時依權重交錯分配"""
+        scheduler = PriorityScheduler(1, [PriorityClass(INTERACTIVE, weight=3), PriorityClass(BATCH, weight=1)])
+        order: List[str] = []
+        scheduler.acquire(BATCH)
+        threads = _enqueue(scheduler, [BATCH] * 4 + [INTERACTIVE] * 6, order)
+        scheduler.release(BATCH)
+        for thread in threads:
+            thread.join(timeout=2)
+        assert ''.join(p[0] for p in order) == "iiiibiibbb"
+
+    def test_class_concurrency_limit_reserves_room(self):
+        """驗證批次達其上限即排隊，互動請求仍可即刻取得名額"""
+        scheduler = PriorityScheduler(4, [
+            PriorityClass(INTERACTIVE), PriorityClass(BATCH, max_concurrency=2, max_queue_wait=0.05)
+        ])
+        scheduler.acquire(BATCH)
+        scheduler.acquire(BATCH)
+        with pytest.raises(QueueTimeoutError):
+            scheduler.acquire(BATCH)
+        scheduler.acquire(INTERACTIVE, timeout=0)
+        assert scheduler.stats[BATCH].expired == 1
+        assert scheduler.in_flight == 3
+
+    def test_released_slot_goes_to_class_under_limit(self):
+        """驗證釋出之名額不交予已達上限之類別"""
+        scheduler = PriorityScheduler(2, [PriorityClass(INTERACTIVE), PriorityClass(BACKGROUND, max_concurrency=1)])
+        order: List[str] = []
+        scheduler.acquire(BACKGROUND)
+        scheduler.acquire(INTERACTIVE)
+        threads = _enqueue(scheduler, [BACKGROUND, INTERACTIVE], order)
+        scheduler.release(INTERACTIVE)
+        threads[1].join(timeout=2)
+        assert order == [INTERACTIVE]
+        scheduler.release(BACKGROUND)
+        threads[0].join(timeout=2)
+        assert order == [INTERACTIVE, BACKGROUND]
+
+    def test_full_queue_rejects(self):
+        """驗證類別之佇列已滿即刻拒絕"""
+        scheduler = PriorityScheduler(1, [PriorityClass(INTERACTIVE), PriorityClass(BATCH, max_queue=0)])
+        scheduler.acquire(INTERACTIVE)
+        with pytest.raises(BusyError):
+            scheduler.acquire(BATCH)
+        assert scheduler.stats[BATCH].rejected == 1
+
+    def test_stats_are_snapshots(self):
+        """驗證統計為取用當下之副本，不隨其後之排程變動"""
+        scheduler = PriorityScheduler(max_concurrency=2)
+        before = scheduler.stats
+        with scheduler.slot(INTERACTIVE):
+            assert before[INTERACTIVE].in_flight == 0
+            assert scheduler.stats[INTERACTIVE].in_flight == 1
+        assert scheduler.classes == (INTERACTIVE, BATCH, BACKGROUND)
+
+    def test_rejects_invalid_configuration(self):
+        """驗證未知類別、零名額與非正權重被拒"""
+        with pytest.raises(ValueError):
+            PriorityScheduler().acquire('urgent')
+        with pytest.raises(ValueError):
+            PriorityScheduler(0)
+        with pytest.raises(ValueError):
+            PriorityScheduler(1, [PriorityClass(INTERACTIVE, weight=0)])
+
+
+class TestSchedulingIntegration:
+    """排程與 API 處理器、ChatBot 之整合測試"""
+
+    def test_provider_calls_take_a_slot(self):
+        """驗證提供者呼叫依其優先類別取得名額"""
+        handler = APIHandler("g", "p")
+        scheduler = handler.enable_scheduling(max_concurrency=4)
+        handler._session = MagicMock()
+        handler._session.post.return_value.headers = {}
+        handler._session.post.return_value.content = codec.dumps({"choices": [{"message": {"content": "答"}}]})
+        assert handler.query_perplexity("問", priority=BACKGROUND) == "答"
+        assert scheduler.stats[BACKGROUND].admitted == 1
+        assert scheduler.in_flight == 0
+
+    def test_chatbot_passes_priority(self):
+        """驗證 ChatBot 將請求之優先類別傳至排程；排隊逾時者回覆繁忙"""
+        api_handler = SimulatedAPIHandler(latency=0.0)
+        scheduler = api_handler.enable_scheduling(1, [
+            PriorityClass(INTERACTIVE), PriorityClass(BATCH, max_queue_wait=0.01)
+        ])
+        chatbot = ChatBot(api_handler, ConversationManager())
+        assert chatbot.process_message("user1", "你好", priority=BATCH) == "gemini 模擬回應"
+        assert scheduler.stats[BATCH].admitted == 1
+        scheduler.acquire(INTERACTIVE)
+        assert chatbot.process_message("user1", "再問", priority=BATCH) == ChatBot.BUSY_MESSAGE
+
+    def test_deadline_cut_wait_times_out(self):
+        """驗證排程等候為時限所截者回覆逾時，而非繁忙"""
+        api_handler = SimulatedAPIHandler(latency=0.0)
+        scheduler = api_handler.enable_scheduling(1, [PriorityClass(INTERACTIVE, max_queue_wait=10)])
+        chatbot = ChatBot(api_handler, ConversationManager())
+        scheduler.acquire(INTERACTIVE)
+        start = time.monotonic()
+        assert chatbot.process_message("user1", "你好", deadline=0.05) == ChatBot.TIMEOUT_MESSAGE
+        assert time.monotonic() - start < 1
+        assert scheduler.stats[INTERACTIVE].expired == 1
+
+    def test_unknown_priority_rejected(self):
+        """驗證未知之優先類別不論是否啟用排程皆於處理前被拒"""
+        api_handler = SimulatedAPIHandler(latency=0.0)
+        chatbot = ChatBot(api_handler, ConversationManager())
+        with pytest.raises(ValueError):
+            chatbot.process_message("user1", "你好", priority='urgent')
+        api_handler.enable_scheduling(1, [PriorityClass('urgent')])
+        assert chatbot.process_message("user1", "你好", priority='urgent') == "gemini 模擬回應"
+        with pytest.raises(ValueError):
+            chatbot.process_message("user1", "再問", priority=BATCH)
+        assert chatbot.conversation_manager.get_history("user1") == ["你好", "gemini 模擬回應"]
+
+    def test_load_report_breaks_down_by_priority(self):
+        """驗證負載報告依優先類別分列延遲"""
+        api_handler = SimulatedAPIHandler(latency=0.001, seed=1)
+        api_handler.enable_scheduling(4)
+        traffic = synthetic_traffic(users=10, size=100, seed=1, batch_ratio=0.5)
+        report = run_load(InProcessTarget(ChatBot(api_handler, ConversationManager())), traffic, 500, 100, seed=1)
+        assert set(report.by_priority) == {INTERACTIVE, BATCH}
+        assert sum(h.total for h in report.by_priority.values()) == 100
+        assert set(report.to_dict()['by_priority']) == {INTERACTIVE, BATCH}
@@ -0,0 +1,208 @@
+"""
+一致性雜湊分片之測試
+此乃驗證分而治之之試煉
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from chatbot.deadline import Deadline
+from chatbot.handlers import ChatBot
+from chatbot.loadgen import SimulatedAPIHandler
+from chatbot.models import ConversationManager
+from chatbot.sharding import HashRing, ShardedChatBot
+
+
+class _EchoAPIHandler(SimulatedAPIHandler):
+    """以提示詞為回應，藉此觀察工作者所持之對話歷史"""
+
+    def query_gemini(self, prompt, *args, **kwargs):
+        return prompt
+
+
+class _SlowEchoAPIHandler(_EchoAPIHandler):
+    """含「慢」之訊息延遲一秒半方回應"""
+
+    def query_gemini(self, prompt, *args, **kwargs):
+        if "慢" in prompt:
+            time.sleep(1.5)
+        return prompt
+
+
+class _DeadlineAPIHandler(SimulatedAPIHandler):
+    """以剩餘時限為回應，藉此觀察工作者所見之時限"""
+
+    def query_gemini(self, prompt, *args, deadline=None, **kwargs):
+        return f"{deadline.remaining():.3f}"
+
+
+def _make_chatbot() -> ChatBot:
+    """各工作行程內建立之聊天機器人"""
+    return ChatBot(SimulatedAPIHandler(latency=0.0), ConversationManager())
+
+
+def _make_echo_chatbot() -> ChatBot:
+    return ChatBot(_EchoAPIHandler(latency=0.0), ConversationManager())
+
+
+def _make_slow_echo_chatbot() -> ChatBot:
+    return ChatBot(_SlowEchoAPIHandler(latency=0.0), ConversationManager())
+
+
+def _make_deadline_chatbot() -> ChatBot:
+    return ChatBot(_DeadlineAPIHandler(latency=0.0), ConversationManager())
+
+
+class TestHashRing:
+    """雜湊環測試"""
+
+    def test_balanced_distribution(self):
+        """驗證虛擬節點令分佈大致均衡"""
+        ring = HashRing(["a", "b", "c", "d"])
+        counts = {}
+        for i in range(20000):
+            node = ring.get(f"user{i}")
+            counts[node] = counts.get(node, 0) + 1
+        assert min(counts.values()) > 20000 / 4 * 0.7
+
+    def test_minimal_reshuffle_on_add(self):
+        """驗證加入節點時僅約 1/N 之鍵易主，且皆移至新節點"""
+        keys = [f"user{i}" for i in range(10000)]
+        ring = HashRing(["a", "b", "c", "d"])
+        before = {k: ring.get(k) for k in keys}
+        ring.add("e")
+        moved = [k for k in keys if ring.get(k) != before[k]]
+
+        assert all(ring.get(k) == "e" for k in moved)
+        assert 0.1 < len(moved) / len(keys) < 0.3
+
+    def test_remove_only_moves_removed_keys(self):
+        """驗證移除節點時僅其鍵易主"""
+        keys = [f"user{i}" for i in range(5000)]
+        ring = HashRing(["a", "b", "c"])
+        before = {k: ring.get(k) for k in keys}
+        ring.remove("b")
+        assert all(ring.get(k) == before[k] for k in keys if before[k] != "b")
+
+    def test_empty_ring(self):
+        """驗證空環查詢拋出異常"""
+        with pytest.raises(LookupError):
+            HashRing().get("x")
+
+
+class TestShardedChatBot:
+    """多行程分片路由測試"""
+
+    @pytest.fixture
+    def router(self):
+        router = ShardedChatBot(_make_chatbot, workers=2)
+        yield router
+        router.close()
+
+    def test_session_affinity(self, router):
+        """驗證同一使用者之訊息皆由同一工作者處理"""
+        users = [f"user{i}" for i in range(20)]
+        with ThreadPoolExecutor(8) as pool:
+            replies = list(pool.map(lambda u: router.process_message(u, "你好"), users * 2))
+
+        assert all(reply == "gemini 模擬回應" for reply in replies)
+        assert sum(router.distribution().values()) == len(users)
+        assert sum(router.routed.values()) == len(users) * 2
+
+    def test_add_worker_migrates_sessions(self, router):
+        """驗證加入工作者時，改歸其所屬之使用者連同對話遷入"""
+        users = [f"user{i}" for i in range(60)]
+        for u in users:
+            router.process_message(u, "你好")
+
+        new = router.add_worker()
+
+        distribution = router.distribution()
+        assert distribution[new] == sum(1 for u in users if router.owner(u) == new)
+        assert distribution[new] > 0
+        assert sum(distribution.values()) == len(users)
+        assert router.migrated == distribution[new]
+
+    def test_remove_worker_keeps_all_sessions(self, router):
+        """驗證移除工作者後，其使用者之對話遷至他處"""
+        users = [f"user{i}" for i in range(40)]
+        for u in users:
+            router.process_message(u, "你好")
+
+        router.remove_worker(router.workers[0])
+
+        assert router.distribution() == {router.workers[0]: len(users)}
+        with pytest.raises(ValueError):
+            router.remove_worker(router.workers[0])
+
+    def test_history_follows_migrated_user(self):
+        """驗證遷移後之使用者仍見其先前之對話"""
+        router = ShardedChatBot(_make_echo_chatbot, workers=1)
+        try:
+            users = [f"user{i}" for i in range(30)]
+            for u in users:
+                router.process_message(u, f"{u} 之第一則")
+            new = router.add_worker()
+            moved = next(u for u in users if router.owner(u) == new)
+
+            reply = router.process_message(moved, "第二則")
+
+            assert f"{moved} 之第一則" in reply
+        finally:
+            router.close()
+
+    def test_default_start_method_does_not_fork(self, router):
+        """驗證預設不以 fork 啟動工作行程，因路由器已有讀取執行緒"""
+        assert router._context.get_start_method() in ShardedChatBot.START_METHODS
+
+    def test_deadline_sent_as_absolute_expiry(self):
+        """驗證時限以絕對時刻傳至工作者，已耗之時間不致重計"""
+        router = ShardedChatBot(_make_deadline_chatbot, workers=1)
+        try:
+            deadline = Deadline.after(5)
+            time.sleep(0.3)
+            assert float(router.process_message("user1", "你好", deadline=deadline)) <= 4.75
+            assert float(router.process_message("user1", "你好", deadline=5)) > 4.5
+            expired = Deadline(time.monotonic() - 1)
+            assert router.process_message("user1", "你好", deadline=expired) == ChatBot.TIMEOUT_MESSAGE
+        finally:
+            router.close()
+
+
+    def test_membership_change_holds_only_moving_users(self):
+        """驗證增減工作者時不待他人處理中之訊息，易主者之訊息完成後方連同對話遷移"""
+        router = ShardedChatBot(_make_slow_echo_chatbot, workers=1)
+        try:
+            after = HashRing(router.workers + ["w1"])
+            users = [f"user{i}" for i in range(40)]
+            staying = [u for u in users if after.get(u) == "w0"]
+            moving = [u for u in users if after.get(u) == "w1"]
+            for u in staying[1:] + moving[1:]:
+                router.process_message(u, "你好")
+            slow = [
+                threading.Thread(target=router.process_message, args=(u, f"{u} 之慢訊息"))
+                for u in (staying[0], moving[0])
+            ]
+            for thread in slow:
+                thread.start()
+            time.sleep(0.2)
+
+            adding = threading.Thread(target=router.add_worker)
+            adding.start()
+            while "w1" not in router.workers:
+                time.sleep(0.01)
+            start = time.monotonic()
+            assert router.process_message(staying[1], "再問").endswith("再問")
+            assert time.monotonic() - start < 0.5
+            assert adding.is_alive() and slow[0].is_alive()
+
+            adding.join()
+            for thread in slow:
+                thread.join()
+            assert f"{moving[0]} 之慢訊息" in router.process_message(moving[0], "再問")
+            assert router.distribution() == {"w0": len(staying), "w1": len(moving)}
+        finally:
+            router.close()
@@ -0,0 +1,132 @@
+"""
+共享記憶體對話儲存之測試
+此乃驗證眾行程共用之記錄
+"""
+
+import multiprocessing
+
+import pytest
+
+from chatbot.handlers import ChatBot
+from chatbot.loadgen import SimulatedAPIHandler
+from chatbot.models import SharedConversationManager
+
+
+@pytest.fixture
+def manager():
+    store = SharedConversationManager(slots=64, stripes=8, max_message_bytes=64)
+    yield store
+    store.close()
+    store.unlink()
+
+
+def _write_history(store: SharedConversationManager, user_id: str, count: int) -> None:
+    """子行程內寫入訊息"""
+    for i in range(count):
+        store.add_message(user_id, f"{user_id}-{i}")
+
+
+class TestSharedConversationManager:
+    """共享記憶體對話儲存測試"""
+
+    def test_add_and_get(self, manager):
+        """驗證訊息依序保存"""
+        manager.add_message("user1", "你好")
+        manager.add_message("user1", "您好，有何指教？")
+        assert manager.get_history("user1") == ["你好", "您好，有何指教？"]
+        assert manager.get_history("unknown") == []
+
+    def test_ring_buffer_keeps_latest(self, manager):
+        """驗證超過上限時僅留最新之 max_messages 則"""
+        for i in range(11):
+            manager.add_message("user1", f"訊息 {i}")
+        assert manager.get_history("user1") == [f"訊息 {i}" for i in range(7, 11)]
+
+    def test_user_isolation_and_clear(self, manager):
+        """驗證使用者隔離，清除後可重新寫入"""
+        manager.add_message("user1", "甲")
+        manager.add_message("user2", "乙")
+        manager.clear_history("user1")
+        assert manager.get_history("user1") == []
+        assert manager.get_history("user2") == ["乙"]
+        assert manager.users() == ["user2"]
+        manager.add_message("user1", "丙")
+        assert manager.get_history("user1") == ["丙"]
+
+    def test_truncates_on_character_boundary(self, manager):
+        """驗證過長訊息於 UTF-8 字元邊界截斷"""
+        manager.add_message("user1", "量" * 30)
+        assert manager.get_history("user1") == ["量" * 21]
+
+    def test_rejects_long_user_id(self, manager):
+        """驗證過長之使用者識別被拒"""
+        with pytest.raises(ValueError):
+            manager.add_message("u" * 65, "你好")
+
+    def test_evicts_least_recently_used_when_full(self):
+        """驗證段滿時驅逐最久未用者"""
+        store = SharedConversationManager(slots=4, stripes=1)
+        try:
+            for i in range(4):
+                store.add_message(f"user{i}", "你好")
+            store.get_history("user0")
+            store.add_message("user4", "你好")
+            assert store.evictions == 1
+            assert sorted(store.users()) == ["user0", "user2", "user3", "user4"]
+        finally:
+            store.close()
+            store.unlink()
+
+    def test_attaching_does_not_track_segment(self, manager, monkeypatch):
+        """驗證他行程附掛時不向其 resource_tracker 登記，免其結束時 unlink 該段"""
+        from multiprocessing import resource_tracker, shared_memory
+
+        registered = []
+        monkeypatch.setattr(resource_tracker, 'register', lambda name, rtype: registered.append((name, rtype)))
+        attached = SharedConversationManager.__new__(SharedConversationManager)
+        attached.__setstate__(manager.__getstate__())
+        try:
+            attached.add_message("user1", "你好")
+        finally:
+            attached.close()
+        assert registered == []
+        segment = shared_memory.SharedMemory(name=manager.name)
+        segment.close()
+
+    @pytest.mark.parametrize("start_method", ["fork", "spawn"])
+    def test_visible_across_processes(self, start_method):
+        """驗證子行程之寫入為父行程所見"""
+        manager = SharedConversationManager(slots=64, stripes=8, start_method=start_method)
+        context = multiprocessing.get_context(start_method)
+        processes = [
+            context.Process(target=_write_history, args=(manager, f"user{i}", 3))
+            for i in range(4)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(timeout=30)
+            assert process.exitcode == 0
+        try:
+            for i in range(4):
+                assert manager.get_history(f"user{i}") == [f"user{i}-{j}" for j in range(3)]
+        finally:
+            manager.close()
+            manager.unlink()
+
+    def test_concurrent_writers_to_same_user(self, manager):
+        """驗證多行程同寫一使用者時，環形緩衝不致損毀"""
+        processes = [multiprocessing.Process(target=_write_history, args=(manager, "shared", 200)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(timeout=30)
+        history = manager.get_history("shared")
+        assert len(history) == manager.max_messages
+        assert all(message.startswith("shared-") for message in history)
+
+    def test_backs_chatbot(self, manager):
+        """驗證可作為 ChatBot 之對話管理"""
+        chatbot = ChatBot(SimulatedAPIHandler(latency=0.0), manager)
+        chatbot.process_message("user1", "你好")
+        assert manager.get_history("user1") == ["你好", "gemini 模擬回應"]
@@ -0,0 +1,144 @@
+"""
+啟動階段之測試
+此乃驗證延遲載入與預熱之試煉
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from chatbot.models import ConversationManager
+from chatbot.services import APIHandler
+from chatbot.startup import StartupReport
+
+
+class TestLazyImport:
+    """延遲載入測試"""
+
+    def test_import_chatbot_is_lightweight(self):
+        """驗證 import chatbot 不載入子模組"""
+        code = (
+            "import sys, chatbot; "
+            "print(sorted(m for m in sys.modules if m.startswith('chatbot')))"
+        )
+        output = subprocess.run(
+            [sys.executable, '-c', code], capture_output=True, text=True, check=True
+        ).stdout
+        assert output.strip() == "['chatbot']"
+
+    def test_lazy_attribute_resolves(self):
+        """驗證公開名稱於取用時正確解析"""
+        import chatbot
+
+        assert chatbot.ChatBot.__name__ == 'ChatBot'
+        assert 'APIHandler' in dir(chatbot)
+
+
+class TestAPIHandlerClients:
+    """共用客戶端測試"""
+
+    def test_gemini_client_is_reused(self):
+        """驗證 Gemini 客戶端僅建立一次"""
+        genai = MagicMock()
+        google = MagicMock(genai=genai)
+        with patch.dict(sys.modules, {'google': google, 'google.genai': genai}):
+            handler = APIHandler("g", "p")
+            handler.query_gemini("一")
+            handler.query_gemini("二")
+        assert genai.Client.call_count == 1
+
+    def test_prewarm_touches_both_providers(self):
+        """驗證預熱觸及兩端，且失敗不拋出異常"""
+        handler = APIHandler("g", "p")
+        handler._gemini_clients["g"] = MagicMock()
+        handler._session = MagicMock()
+        handler._session.head.side_effect = ConnectionError("無網路")
+
+        timings = handler.prewarm()
+
+        assert set(timings) == {'gemini', 'perplexity'}
+        handler._gemini_clients["g"].models.get.assert_called_once()
+        handler._session.head.assert_called_once()
+
+
+class TestStartupReport:
+    """啟動報告測試"""
+
+    def test_phases_are_recorded(self):
+        """驗證各階段耗時被記錄"""
+        report = StartupReport()
+        with report.phase('config'):
+            pass
+        report.record('prewarm_gemini', 0.25)
+
+        data = report.to_dict()
+        assert list(data) == ['config', 'prewarm_gemini', 'total']
+        assert data['prewarm_gemini'] == 0.25
+        assert 'prewarm_gemini' in report.format()
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run_until_ready_then_terminate(snapshot: str) -> str:
+    """啟動 main.py，待其就緒後送 SIGTERM，返回其日誌"""
+    env = dict(os.environ, GEMINI_API_KEY="g", PERPLEXITY_API_KEY="p")
+    env.pop('GEMINI_API_KEYS', None)
+    env.pop('PERPLEXITY_API_KEYS', None)
+    process = subprocess.Popen(
+        [sys.executable, 'main.py', '--log-format', 'text', '--snapshot', snapshot],
+        cwd=ROOT, env=env, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    watchdog = threading.Timer(30, process.kill)
+    watchdog.start()
+    try:
+        lines = []
+        for line in process.stderr:
+            lines.append(line)
+            if "請輸入訊息" in line:
+                process.send_signal(signal.SIGTERM)
+                break
+        lines.append(process.stderr.read())
+        assert process.wait() == 0
+        return "".join(lines)
+    finally:
+        watchdog.cancel()
+        process.stdin.close()
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGTERM') or os.name != 'posix', reason="需 POSIX 之 SIGTERM")
+class TestMainLifecycle:
+    """主程式之啟停測試"""
+
+    def test_sigterm_checkpoints_conversations(self, tmp_path):
+        """驗證收到 SIGTERM 時正常退出並封存對話"""
+        snapshot = str(tmp_path / "state.snap")
+        manager = ConversationManager()
+        manager.add_message("u1", "你好")
+        manager.snapshot(snapshot)
+
+        log = _run_until_ready_then_terminate(snapshot)
+
+        assert "收到終止訊號" in log
+        assert "已封存 1 位使用者之對話" in log
+        restored = ConversationManager()
+        restored.restore(snapshot)
+        assert restored.get_history("u1") == ["你好"]
+
+    def test_corrupt_snapshot_moved_aside(self, tmp_path):
+        """驗證毀損之快照移至一旁，服務仍以空白之對話啟動"""
+        snapshot = tmp_path / "state.snap"
+        snapshot.write_bytes(b"not a snapshot")
+
+        log = _run_until_ready_then_terminate(str(snapshot))
+
+        assert "快照無法復原" in log
+        aside = [path for path in tmp_path.iterdir() if path.name.startswith("state.snap.bad-")]
+        assert len(aside) == 1
+        assert aside[0].read_bytes() == b"not a snapshot"
+        assert "已封存 0 位使用者之對話" in log
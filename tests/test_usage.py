@@ -0,0 +1,185 @@
+"""
+用量計量與限額之測試
+此乃驗證用度之帳簿
+"""
+
+from types import SimpleNamespace
+from unittest.mock import MagicMock, Mock
+
+import pytest
+
+from chatbot import codec
+from chatbot.exceptions import QuotaExceededError
+from chatbot.handlers import AdmissionController, ChatBot
+from chatbot.loadgen import SimulatedAPIHandler
+from chatbot.models import ConversationManager, Quota, Usage, UsageMeter
+from chatbot.services import APIHandler
+
+
+class FakeClock:
+    """可手動推進之時鐘"""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestUsageMeter:
+    """用量計量器測試"""
+
+    def test_records_requests_and_tokens(self):
+        """驗證請求數與權杖數之合計"""
+        meter = UsageMeter()
+        meter.admit("user1")
+        meter.record("user1", Usage('gemini', 10, 30))
+        meter.record("user1", Usage('perplexity', 5, 15))
+        totals = meter.totals("user1")
+        assert (totals.requests, totals.input_tokens, totals.output_tokens) == (1, 15, 45)
+        assert totals.tokens == 60
+        assert meter.totals("nobody").requests == 0
+
+    def test_window_rolls_over(self):
+        """驗證滑出時窗之用量被扣除"""
+        clock = FakeClock()
+        meter = UsageMeter(window=60, buckets=6, clock=clock)
+        meter.admit("user1")
+        clock.now += 30
+        meter.admit("user1")
+        assert meter.totals("user1").requests == 2
+        clock.now += 35
+        assert meter.totals("user1").requests == 1
+        clock.now += 600
+        assert meter.totals("user1").requests == 0
+
+    def test_request_quota_rejects_with_retry_after(self):
+        """驗證請求數達限額即拒，並告知何時可再試"""
+        clock = FakeClock()
+        meter = UsageMeter(Quota(max_requests=2), window=60, buckets=6, clock=clock)
+        meter.admit("user1")
+        meter.admit("user1")
+        with pytest.raises(QuotaExceededError) as excinfo:
+            meter.admit("user1")
+        assert 0 < excinfo.value.retry_after <= 60
+        assert meter.rejected == 1
+        assert meter.totals("user1").requests == 2
+        meter.admit("user2")
+        clock.now += excinfo.value.retry_after
+        meter.admit("user1")
+
+    def test_refund_returns_admitted_request(self):
+        """驗證退還之請求不計入限額；時窗外或無用量者無可退還"""
+        clock = FakeClock()
+        meter = UsageMeter(Quota(max_requests=1), window=60, buckets=6, clock=clock)
+        meter.admit("user1")
+        clock.now += 15
+        meter.refund("user1")
+        meter.admit("user1")
+        assert meter.totals("user1").requests == 1
+        meter.refund("nobody")
+        clock.now += 600
+        meter.refund("user1")
+        assert meter.totals("user1").requests == 0
+
+    def test_token_quota_and_overrides(self):
+        """驗證權杖限額與個別使用者之限額"""
+        meter = UsageMeter(Quota(max_tokens=100))
+        meter.overrides["vip"] = Quota()
+        for user_id in ("user1", "vip"):
+            meter.admit(user_id)
+            meter.record(user_id, Usage('gemini', 40, 60))
+        with pytest.raises(QuotaExceededError):
+            meter.admit("user1")
+        meter.admit("vip")
+
+    def test_top_and_prune(self):
+        """驗證用量排行與閒置使用者之回收"""
+        clock = FakeClock()
+        meter = UsageMeter(window=60, clock=clock)
+        meter.record("light", Usage('gemini', 1, 1))
+        meter.record("heavy", Usage('gemini', 100, 100))
+        assert [user_id for user_id, _ in meter.top(1)] == ["heavy"]
+        assert meter.prune() == 0
+        clock.now += 120
+        assert meter.prune() == 2
+        assert len(meter) == 0
+
+    def test_idle_users_reclaimed_while_recording(self):
+        """驗證未呼叫 prune() 時，閒置逾時窗之使用者亦於其後之記帳時回收"""
+        clock = FakeClock()
+        meter = UsageMeter(window=60, clock=clock)
+        for i in range(100):
+            meter.admit(f"user{i}")
+        assert len(meter) == 100
+        clock.now += 5
+        meter.admit("user0")
+        assert len(meter) == 100
+        clock.now += 60
+        meter.admit("active")
+        assert len(meter) == 1
+        assert meter.totals("active").requests == 1
+
+
+class TestChatBotQuota:
+    """聊天機器人之限額測試"""
+
+    def test_rejects_before_calling_provider(self):
+        """驗證超額者於呼叫提供者前即被拒"""
+        api_handler = Mock()
+        api_handler.query_gemini.return_value = "答"
+        chatbot = ChatBot(api_handler, ConversationManager(), usage_meter=UsageMeter(Quota(max_requests=1)))
+        assert chatbot.process_message("user1", "你好") == "答"
+        assert chatbot.process_message("user1", "再問") == ChatBot.QUOTA_MESSAGE
+        assert api_handler.query_gemini.call_count == 1
+
+    def test_busy_rejection_is_not_charged(self):
+        """驗證入場即拒而未呼叫提供者之請求不耗用限額"""
+        admission = AdmissionController(max_concurrency=1, max_queue=0)
+        meter = UsageMeter(Quota(max_requests=1))
+        chatbot = ChatBot(
+            SimulatedAPIHandler(latency=0.0), ConversationManager(), admission=admission, usage_meter=meter
+        )
+        admission.acquire()
+        assert chatbot.process_message("user1", "你好") == ChatBot.BUSY_MESSAGE
+        assert meter.totals("user1").requests == 0
+        admission.release()
+        assert chatbot.process_message("user1", "你好") == "gemini 模擬回應"
+        assert meter.totals("user1").requests == 1
+
+    def test_records_provider_usage(self):
+        """驗證提供者之用量記入發問之使用者"""
+        meter = UsageMeter()
+        chatbot = ChatBot(SimulatedAPIHandler(), ConversationManager(), usage_meter=meter)
+        chatbot.process_message("user1", "你好")
+        totals = meter.totals("user1")
+        assert totals.requests == 1
+        assert totals.input_tokens > 0 and totals.output_tokens > 0
+
+
+class TestAPIHandlerUsage:
+    """API 處理器之用量回報測試"""
+
+    def test_perplexity_usage(self):
+        """驗證自 Perplexity 回應取出用量"""
+        handler = APIHandler("g", "p")
+        handler._session = MagicMock()
+        handler._session.post.return_value.content = codec.dumps({
+            "usage": {"prompt_tokens": 12, "completion_tokens": 34, "total_tokens": 46},
+            "choices": [{"message": {"content": "答"}}],
+        })
+        on_usage = Mock()
+        assert handler.query_perplexity("問", on_usage=on_usage) == "答"
+        on_usage.assert_called_once_with(Usage('perplexity', 12, 34))
+
+    def test_gemini_usage_counts_thoughts_as_output(self):
+        """驗證 Gemini 之思考權杖計入輸出"""
+        handler = APIHandler("g", "p")
+        handler._gemini_clients["g"] = MagicMock()
+        handler._gemini_clients["g"].models.generate_content.return_value = SimpleNamespace(
+            text="答",
+            usage_metadata=SimpleNamespace(prompt_token_count=7, candidates_token_count=20, thoughts_token_count=5)
+        )
+        on_usage = Mock()
+        assert handler.query_gemini("問", on_usage=on_usage) == "答"
+        on_usage.assert_called_once_with(Usage('gemini', 7, 25))